@@ -0,0 +1,13 @@
+from django.conf import settings
+
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared(alias='default'):
+    shared = getattr(settings, 'SHARED_CACHE', None)
+    if shared is not None:
+        return shared
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_CACHE_BACKENDS
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+
+METRICS_SAMPLE_SIZE = getattr(settings, 'METRICS_SAMPLE_SIZE', 2048)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+class Histogram:
+    def __init__(self, size=METRICS_SAMPLE_SIZE, unit='ms'):
+        self.unit = unit
+        self.scale = 1000 if unit == 'ms' else 1
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, ordered, fraction):
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        scaled = lambda value: round(value * self.scale, 3) if value is not None else None
+        return {
+            'count': self.count,
+            f'mean_{self.unit}': scaled(self.total / self.count) if self.count else None,
+            f'p50_{self.unit}': scaled(self.percentile(ordered, 0.50)),
+            f'p95_{self.unit}': scaled(self.percentile(ordered, 0.95)),
+            f'p99_{self.unit}': scaled(self.percentile(ordered, 0.99)),
+            f'max_{self.unit}': scaled(self.max) if self.count else None,
+        }
+
+
+def observe(name, value, unit='ms'):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(unit=unit)
+        histogram.observe(value)
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'histograms': {name: histogram.snapshot() for name, histogram in _histograms.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from asgiref.sync import sync_to_async
+from channels import DEFAULT_CHANNEL_LAYER
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from RidingApp import json_utils
+from RidingApp.cache_utils import cache_is_shared
+
+REPLAY_BACKEND = getattr(settings, 'WS_REPLAY_BACKEND', 'RidingApp.replay_utils.InMemoryReplayBuffer')
+REPLAY_BUFFER_SIZE = getattr(settings, 'WS_REPLAY_BUFFER_SIZE', 200)
+REPLAY_TTL = getattr(settings, 'WS_REPLAY_TTL', 300)
+REPLAY_MAX_STREAMS = getattr(settings, 'WS_REPLAY_MAX_STREAMS', 10000)
+REPLAY_CACHE_ALIAS = getattr(settings, 'WS_REPLAY_CACHE_ALIAS', 'default')
+
+
+def sockets_are_single_process():
+    single = getattr(settings, 'WS_SINGLE_PROCESS', None)
+    if single is not None:
+        return single
+    layer = settings.CHANNEL_LAYERS.get(DEFAULT_CHANNEL_LAYER, {})
+    return layer.get('BACKEND') == 'channels.layers.InMemoryChannelLayer'
+
+
+def encode_frame(payload, seq):
+    return json_utils.dumps({**payload, 'seq': seq})
+
+
+class ReplayBuffer:
+    shared = False
+
+    def __init__(self, size=REPLAY_BUFFER_SIZE, ttl=REPLAY_TTL):
+        self.size = size
+        self.ttl = ttl
+
+    def publish(self, stream, payload):
+        raise NotImplementedError
+
+    def current(self, stream):
+        raise NotImplementedError
+
+    def replay(self, stream, last_seq):
+        raise NotImplementedError
+
+    async def apublish(self, stream, payload):
+        return self.publish(stream, payload)
+
+    async def acurrent(self, stream):
+        return self.current(stream)
+
+    async def areplay(self, stream, last_seq):
+        return self.replay(stream, last_seq)
+
+
+class InMemoryReplayBuffer(ReplayBuffer):
+    def __init__(self, size=REPLAY_BUFFER_SIZE, ttl=REPLAY_TTL, max_streams=REPLAY_MAX_STREAMS):
+        super().__init__(size, ttl)
+        self.max_streams = max_streams
+        self.streams = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return sockets_are_single_process()
+
+    def _prune(self, now):
+        while self.streams:
+            stream, (_, _, published_at) = next(iter(self.streams.items()))
+            if len(self.streams) <= self.max_streams and now - published_at < self.ttl:
+                break
+            del self.streams[stream]
+
+    def publish(self, stream, payload):
+        now = time.monotonic()
+        with self.lock:
+            seq, frames, _ = self.streams.pop(stream, (0, None, now))
+            if frames is None:
+                frames = deque(maxlen=self.size)
+            seq += 1
+            frame = encode_frame(payload, seq)
+            frames.append((seq, frame))
+            self.streams[stream] = (seq, frames, now)
+            self._prune(now)
+        return seq, frame
+
+    def clear(self):
+        with self.lock:
+            self.streams.clear()
+
+    def current(self, stream):
+        with self.lock:
+            return self.streams.get(stream, (0, None, None))[0]
+
+    def replay(self, stream, last_seq):
+        with self.lock:
+            seq, frames, _ = self.streams.get(stream, (0, None, None))
+            if last_seq > seq:
+                return None
+            if last_seq == seq:
+                return []
+            if not frames or frames[0][0] > last_seq + 1:
+                return None
+            return [(frame_seq, frame) for frame_seq, frame in frames if frame_seq > last_seq]
+
+
+class CacheReplayBuffer(ReplayBuffer):
+    def __init__(self, size=REPLAY_BUFFER_SIZE, ttl=REPLAY_TTL, alias=REPLAY_CACHE_ALIAS):
+        super().__init__(size, ttl)
+        self.alias = alias
+        self.cache = caches[alias]
+
+    @property
+    def shared(self):
+        return cache_is_shared(self.alias)
+
+    def seq_key(self, stream):
+        return f'ws_replay_seq:{stream}'
+
+    def frame_key(self, stream, seq):
+        return f'ws_replay:{stream}:{seq}'
+
+    def _next_seq(self, stream):
+        self.cache.add(self.seq_key(stream), 0, timeout=None)
+        try:
+            return self.cache.incr(self.seq_key(stream))
+        except ValueError:
+            self.cache.add(self.seq_key(stream), 0, timeout=None)
+            return self.cache.incr(self.seq_key(stream))
+
+    def publish(self, stream, payload):
+        seq = self._next_seq(stream)
+        frame = encode_frame(payload, seq)
+        self.cache.set(self.frame_key(stream, seq), frame, timeout=self.ttl)
+        return seq, frame
+
+    def current(self, stream):
+        return self.cache.get(self.seq_key(stream), 0)
+
+    def _in_window(self, last_seq, seq):
+        return last_seq <= seq and seq - last_seq <= self.size
+
+    def _collect(self, stream, last_seq, seq, found):
+        frames = []
+        for frame_seq in range(last_seq + 1, seq + 1):
+            frame = found.get(self.frame_key(stream, frame_seq))
+            if frame is None:
+                return None
+            frames.append((frame_seq, frame))
+        return frames
+
+    def _range_keys(self, stream, last_seq, seq):
+        return [self.frame_key(stream, frame_seq) for frame_seq in range(last_seq + 1, seq + 1)]
+
+    def replay(self, stream, last_seq):
+        seq = self.current(stream)
+        if not self._in_window(last_seq, seq):
+            return None
+        return self._collect(stream, last_seq, seq, self.cache.get_many(self._range_keys(stream, last_seq, seq)))
+
+    async def apublish(self, stream, payload):
+        # BaseCache.aincr is a get then a set, which races and resets the
+        # seq key's timeout; the backends' sync incr is atomic. Cache clients
+        # are thread-safe, so this stays off the database thread.
+        return await sync_to_async(self.publish, thread_sensitive=False)(stream, payload)
+
+    async def acurrent(self, stream):
+        return await self.cache.aget(self.seq_key(stream), 0)
+
+    async def areplay(self, stream, last_seq):
+        seq = await self.acurrent(stream)
+        if not self._in_window(last_seq, seq):
+            return None
+        found = await self.cache.aget_many(self._range_keys(stream, last_seq, seq))
+        return self._collect(stream, last_seq, seq, found)
+
+
+replay_buffer = import_string(REPLAY_BACKEND)()
+
+
+def unsequenced_event(group, payload, **extra):
+    return {'type': 'send_frame', 'frame': json_utils.dumps(payload), 'group': group, **extra}
+
+
+def sequenced_event(group, payload, **extra):
+    if not replay_buffer.shared:
+        return unsequenced_event(group, payload, **extra)
+    seq, frame = replay_buffer.publish(group, payload)
+    return {'type': 'send_frame', 'frame': frame, 'group': group, 'seq': seq, **extra}
+
+
+async def asequenced_event(group, payload, **extra):
+    if not replay_buffer.shared:
+        return unsequenced_event(group, payload, **extra)
+    seq, frame = await replay_buffer.apublish(group, payload)
+    return {'type': 'send_frame', 'frame': frame, 'group': group, 'seq': seq, **extra}
@@ -88,6 +88,51 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Use orjson for REST and WebSocket payloads when it is installed
+FAST_JSON_ENABLED = os.environ.get('FAST_JSON_ENABLED', 'True').lower() == 'true'
+
+# Chat messages are broadcast right away and written in batches ('buffered')
+# or inserted before the broadcast ('immediate'). Durable mode also flushes
+# the buffer when a socket disconnects and when the process exits. Inserts
+# that still fail after the retries are reported to the room as message_failed.
+CHAT_MESSAGE_WRITE_MODE = os.environ.get('CHAT_MESSAGE_WRITE_MODE', 'buffered')
+CHAT_MESSAGE_BATCH_SIZE = 200
+CHAT_MESSAGE_FLUSH_INTERVAL = 0.05
+CHAT_MESSAGE_DURABLE = True
+CHAT_MESSAGE_WRITE_RETRIES = 3
+CHAT_MESSAGE_RETRY_DELAY = 0.1
+# Must be unique per worker process (0-63); message ids embed it
+CHAT_WORKER_ID = os.environ.get('CHAT_WORKER_ID')
+
+# Completed rides older than this are folded into ChatArchive by `manage.py archive_chats`
+CHAT_ARCHIVE_AFTER_HOURS = int(os.environ.get('CHAT_ARCHIVE_AFTER_HOURS', 24))
+
+# Broadcast frames carry a per-stream seq and are kept in a bounded replay
+# buffer, so reconnecting sockets can send last_seq and get only what they
+# missed. Sequencing, dedupe and replay only happen when the buffer is shared
+# by every worker: CacheReplayBuffer on a shared cache, or the in-memory buffer
+# when one process owns every socket (InMemoryChannelLayer, or
+# WS_SINGLE_PROCESS=True). Otherwise frames go out without a seq and
+# reconnects get a full resync.
+WS_REPLAY_BACKEND = os.environ.get('WS_REPLAY_BACKEND', (
+    'RidingApp.replay_utils.CacheReplayBuffer' if os.environ.get('CACHE_REDIS_URL')
+    else 'RidingApp.replay_utils.InMemoryReplayBuffer'
+))
+WS_REPLAY_BUFFER_SIZE = 200
+WS_REPLAY_TTL = 300
+WS_SINGLE_PROCESS = None
+
+# Location fan-out keeps only the latest pending frame per driver and flushes
+# on a tick. A tick that starts late is event-loop delay for the whole worker,
+# so it only slows that socket's tick. Time spent inside send() is the
+# socket's own backpressure: it slows the tick, and past the disconnect lag it
+# closes the socket. Daphne's send() never waits on the client, so there this
+# stays near zero and slow phones are only ever slowed down, never closed.
+WS_LOCATION_FLUSH_INTERVAL = 0.1
+WS_LOCATION_MAX_FLUSH_INTERVAL = 2.0
+WS_LOCATION_DOWNGRADE_LAG = 1.0
+WS_LOCATION_DISCONNECT_LAG = 10.0
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -140,6 +185,15 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'users.authentication.CustomJWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'RidingApp.json_utils.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'RidingApp.json_utils.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
@@ -193,12 +247,26 @@ GOOGLE_OAUTH2_CLIENT_SECRET = os.environ.get('GOOGLE_OAUTH2_CLIENT_SECRET')
 FACEBOOK_APP_ID = os.environ.get('FACEBOOK_APP_ID')
 FACEBOOK_APP_SECRET = os.environ.get('FACEBOOK_APP_SECRET')
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Participant cards, auth lookups and token revocation are cached in the
+# default cache. Entries are only trusted across workers when the cache is
+# shared (Redis); with the per-process LocMem cache those paths read the
+# database instead. SHARED_CACHE overrides the backend-based detection.
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+SHARED_CACHE = None
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -212,6 +280,7 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=600),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.RidingTokenRefreshSerializer',
 }
 
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
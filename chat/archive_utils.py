@@ -0,0 +1,99 @@
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from RidingApp import json_utils
+from .models import ChatRoom, ChatMessage, ChatArchive
+
+ARCHIVE_AFTER_HOURS = getattr(settings, 'CHAT_ARCHIVE_AFTER_HOURS', 24)
+ARCHIVE_COMPRESSION_LEVEL = getattr(settings, 'CHAT_ARCHIVE_COMPRESSION_LEVEL', 6)
+ARCHIVE_DELETE_CHUNK_SIZE = 500
+ARCHIVE_FIELDS = ('id', 'chat_room_id', 'sender_id', 'message', 'timestamp', 'is_read')
+
+
+def encode_archive(rows):
+    return zlib.compress(json_utils.dumps_bytes(rows), ARCHIVE_COMPRESSION_LEVEL)
+
+
+def decode_row(row):
+    if isinstance(row['timestamp'], str):
+        row['timestamp'] = parse_datetime(row['timestamp'])
+    return row
+
+
+def decode_archive(payload):
+    return [decode_row(row) for row in json_utils.loads(zlib.decompress(bytes(payload)))]
+
+
+def archived_message(row):
+    return ChatMessage(**decode_row(dict(row)))
+
+
+def load_archived_rows(chat_room_id):
+    payload = ChatArchive.objects.filter(chat_room_id=chat_room_id).values_list('payload', flat=True).first()
+    return decode_archive(payload) if payload is not None else []
+
+
+def archived_messages(chat_room_id):
+    return [ChatMessage(**row) for row in load_archived_rows(chat_room_id)]
+
+
+def archivable_rooms(older_than_hours=ARCHIVE_AFTER_HOURS):
+    cutoff = timezone.now() - timedelta(hours=older_than_hours)
+    return ChatRoom.objects.filter(
+        riding_event__status='completed',
+        riding_event__updated_at__lt=cutoff
+    ).filter(
+        Exists(ChatMessage.objects.filter(chat_room=OuterRef('pk')))
+    ).order_by('id').values_list('id', flat=True)
+
+
+def archive_room(chat_room_id):
+    with transaction.atomic():
+        hot = list(ChatMessage.objects.filter(
+            chat_room_id=chat_room_id
+        ).order_by('timestamp', 'id').values(*ARCHIVE_FIELDS))
+        if not hot:
+            return 0
+        archive = ChatArchive.objects.select_for_update().filter(chat_room_id=chat_room_id).first()
+        if archive is None:
+            archive = ChatArchive(chat_room_id=chat_room_id)
+            rows = []
+        else:
+            rows = decode_archive(archive.payload)
+        known = {row['id'] for row in rows}
+        rows.extend(row for row in hot if row['id'] not in known)
+        rows.sort(key=lambda row: (row['timestamp'], row['id']))
+        archive.payload = encode_archive(rows)
+        archive.message_count = len(rows)
+        archive.first_message_at = rows[0]['timestamp']
+        archive.last_message_at = rows[-1]['timestamp']
+        archive.last_message = json_utils.loads(json_utils.dumps_bytes(rows[-1]))
+        archive.save()
+        hot_ids = [row['id'] for row in hot]
+        for start in range(0, len(hot_ids), ARCHIVE_DELETE_CHUNK_SIZE):
+            ChatMessage.objects.filter(
+                chat_room_id=chat_room_id,
+                id__in=hot_ids[start:start + ARCHIVE_DELETE_CHUNK_SIZE]
+            ).delete()
+    return len(hot)
+
+
+def iter_archived_rows(start=None, end=None):
+    archives = ChatArchive.objects.all()
+    if start:
+        archives = archives.filter(last_message_at__gte=start)
+    if end:
+        archives = archives.filter(first_message_at__lt=end)
+    archives = archives.order_by('id').values_list('chat_room__riding_event_id', 'payload')
+    for riding_event_id, payload in archives.iterator(chunk_size=50):
+        for row in decode_archive(payload):
+            if start and row['timestamp'] < start:
+                continue
+            if end and row['timestamp'] >= end:
+                continue
+            row['riding_event_id'] = riding_event_id
+            yield row
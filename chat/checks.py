@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.core.exceptions import ImproperlyConfigured
+from .id_utils import worker_id
+
+
+@register(Tags.database, deploy=True)
+def check_worker_id(app_configs, **kwargs):
+    if getattr(settings, 'CHAT_WORKER_ID', None) in (None, ''):
+        return [Error(
+            'CHAT_WORKER_ID is not set.',
+            hint='Give every ASGI/WSGI worker its own CHAT_WORKER_ID so chat message ids never collide.',
+            id='chat.E001',
+        )]
+    try:
+        worker_id()
+    except ImproperlyConfigured as e:
+        return [Error(str(e), id='chat.E002')]
+    return []
@@ -1,292 +1,222 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from .models import ChatRoom, ChatMessage, DriverLocation
-from maps.models import RidingEvent
-from math import radians, cos, sin, asin, sqrt
+from urllib.parse import parse_qs
+from RidingApp import json_utils
+from .streams import STREAM_CLASSES, ChatStream, RideStatusStream, RideTrackingStream, TrackingStream, NearbyDriversStream
+from .location_utils import LOCATION_SUBPROTOCOL
 
-User = get_user_model()
+MAX_STREAMS = getattr(settings, 'WS_MAX_STREAMS', 20)
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.riding_event_id = self.scope['url_route']['kwargs']['riding_event_id']
-        self.room_group_name = f'chat_ride_{self.riding_event_id}'
+
+class StreamHostMixin:
+    binary = False
+
+    def init_streams(self):
         self.user = self.scope['user']
-        if isinstance(self.user, AnonymousUser):
-            await self.close()
-            return
-        if not await self.can_access_chat():
+        self.streams = {}
+        self.group_streams = {}
+
+    async def join_group(self, group, stream):
+        streams = self.group_streams.setdefault(group, [])
+        if not streams:
+            await self.channel_layer.group_add(group, self.channel_name)
+        streams.append(stream)
+
+    async def leave_group(self, group, stream):
+        streams = self.group_streams.get(group, [])
+        if stream in streams:
+            streams.remove(stream)
+        if not streams:
+            self.group_streams.pop(group, None)
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def stop_streams(self):
+        streams, self.streams = self.streams, {}
+        for stream in streams.values():
+            await stream.stop()
+
+    async def send_frame(self, event):
+        for stream in list(self.group_streams.get(event.get('group'), ())):
+            await stream.send_frame(event)
+
+    async def ride_status(self, event):
+        for stream in list(self.group_streams.get(event.get('group'), ())):
+            await stream.ride_status(event)
+
+    async def driver_card(self, event):
+        for stream in list(self.group_streams.get(event.get('group'), ())):
+            await stream.driver_card(event)
+
+
+class SingleStreamConsumer(StreamHostMixin, AsyncWebsocketConsumer):
+    stream_class = None
+    allow_anonymous = False
+
+    def get_stream_class(self):
+        return self.stream_class
+
+    def select_subprotocol(self):
+        return None
+
+    def get_stream_params(self):
+        params = {key: values[0] for key, values in parse_qs(self.scope.get('query_string', b'').decode()).items()}
+        params.update(self.scope['url_route']['kwargs'])
+        return params
+
+    async def connect(self):
+        self.init_streams()
+        if isinstance(self.user, AnonymousUser) and not self.allow_anonymous:
             await self.close()
             return
-        if await self.is_event_completed():
+        self.stream = self.get_stream_class()(self, self.get_stream_params())
+        if not await self.stream.open():
+            await self.stream.stop()
             await self.close()
             return
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-        await self.accept()
-        messages = await self.get_chat_history()
-        await self.send(text_data=json.dumps({
-            'type': 'chat_history',
-            'messages': messages
-        }))
+        self.streams[self.stream.key] = self.stream
+        await self.accept(self.select_subprotocol())
+        await self.stream.start()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.stop_streams()
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            await self.stream.receive_binary(bytes_data)
+            return
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            data = json_utils.loads(text_data)
+        except ValueError:
+            await self.send(text_data=json_utils.dumps({
                 'type': 'error',
                 'message': 'Invalid JSON format'
             }))
             return
-        message_type = data.get('type', 'chat_message')
-        if message_type == 'chat_message':
-            message = data['message']
-            if await self.is_event_completed():
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'Chat is disabled. This riding event has been completed.'
-                }))
-                await self.close()
-                return
-            if not await self.can_access_chat():
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'You do not have access to this chat room'
-                }))
-                await self.close()
-                return
-            chat_message = await self.save_message(message)
-            if chat_message is None:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'Failed to send message'
-                }))
-                return
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'sender_id': self.user.id,
-                    'sender_name': await self.get_sender_name(),
-                    'timestamp': str(chat_message.timestamp),
-                    'message_id': chat_message.id
-                }
-            )
-        elif message_type == 'mark_read':
-            message_id = data.get('message_id')
-            if await self.can_access_chat():
-                await self.mark_message_read(message_id)
-
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'sender_id': event['sender_id'],
-            'sender_name': event['sender_name'],
-            'timestamp': event['timestamp'],
-            'message_id': event['message_id']
-        }))
-
-    @database_sync_to_async
-    def can_access_chat(self):
-        try:
-            event = RidingEvent.objects.get(id=self.riding_event_id)
-            return self.user == event.user or self.user == event.driver
-        except RidingEvent.DoesNotExist:
-            return False
+        if isinstance(data, dict):
+            await self.stream.receive(data)
 
-    @database_sync_to_async
-    def is_event_completed(self):
-        try:
-            event = RidingEvent.objects.get(id=self.riding_event_id)
-            return event.status == 'completed'
-        except RidingEvent.DoesNotExist:
-            return True
+    async def send_stream(self, stream, frame):
+        await self.send(text_data=frame)
+
+    async def send_binary(self, stream, data):
+        await self.send(bytes_data=data)
+
+    async def close_stream(self, stream):
+        await self.close()
+
+
+class RideStreamConsumer(SingleStreamConsumer):
+    def get_stream_params(self):
+        params = super().get_stream_params()
+        params['ride_id'] = params['riding_event_id']
+        return params
+
+
+class ChatConsumer(RideStreamConsumer):
+    stream_class = ChatStream
+
+
+class RideStatusConsumer(RideStreamConsumer):
+    stream_class = RideStatusStream
+
+
+class RideTrackingConsumer(RideStreamConsumer):
+    stream_class = RideTrackingStream
+
+
+class DriverLocationConsumer(SingleStreamConsumer):
+    allow_anonymous = True
 
-    @database_sync_to_async
-    def get_chat_history(self):
-        try:
-            chat_room = ChatRoom.objects.get(riding_event_id=self.riding_event_id)
-            messages = chat_room.messages.all()[:50]
-            return [{
-                'id': msg.id,
-                'message': msg.message,
-                'sender_id': msg.sender.id,
-                'sender_name': msg.sender.get_full_name() if hasattr(msg.sender, 'get_full_name') else str(msg.sender),
-                'timestamp': str(msg.timestamp),
-                'is_read': msg.is_read
-            } for msg in messages]
-        except ChatRoom.DoesNotExist:
-            return []
-
-    @database_sync_to_async
-    def save_message(self, message):
-        try:
-            event = RidingEvent.objects.get(id=self.riding_event_id)
-            if event.status == 'completed':
-                return None
-            if self.user != event.user and self.user != event.driver:
-                return None
-            chat_room, _ = ChatRoom.objects.get_or_create(
-                riding_event_id=self.riding_event_id
-            )
-            chat_message = ChatMessage.objects.create(
-                chat_room=chat_room,
-                sender=self.user,
-                message=message
-            )
-            return chat_message
-        except RidingEvent.DoesNotExist:
-            return None
-        except Exception:
-            return None
-
-    @database_sync_to_async
-    def get_sender_name(self):
-        if hasattr(self.user, 'get_full_name'):
-            return self.user.get_full_name()
-        return str(self.user)
-
-    @database_sync_to_async
-    def mark_message_read(self, message_id):
-        try:
-            message = ChatMessage.objects.get(id=message_id)
-            if message.chat_room.riding_event_id != int(self.riding_event_id):
-                return
-            event = message.chat_room.riding_event
-            if self.user != event.user and self.user != event.driver:
-                return
-            if message.sender != self.user:
-                message.is_read = True
-                message.save()
-        except ChatMessage.DoesNotExist:
-            pass
-        except Exception:
-            pass
-
-class DriverLocationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.user = self.scope['user']
-        if hasattr(self.user, 'account_type') and self.user.account_type == 'driver':
-            self.room_group_name = f'driver_location_{self.user.id}'
-        else:
-            self.room_group_name = 'nearby_drivers'
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        self.binary = LOCATION_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        await super().connect()
+
+    def select_subprotocol(self):
+        return LOCATION_SUBPROTOCOL if self.binary else None
+
+    def get_stream_class(self):
+        if getattr(self.user, 'account_type', None) == 'driver':
+            return TrackingStream
+        return NearbyDriversStream
+
+
+class StreamConsumer(StreamHostMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        self.init_streams()
+        if isinstance(self.user, AnonymousUser):
+            await self.close()
+            return
         await self.accept()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message_type = data.get('type')
-        if message_type == 'update_location' and self.user.account_type == 'driver':
-            latitude = data.get('latitude')
-            longitude = data.get('longitude')
-            is_available = data.get('is_available', True)
-            await self.update_driver_location(latitude, longitude, is_available)
-            await self.channel_layer.group_send(
-                'nearby_drivers',
-                {
-                    'type': 'location_update',
-                    'driver_id': self.user.id,
-                    'latitude': latitude,
-                    'longitude': longitude,
-                    'is_available': is_available,
-                    'driver_name': await self.get_driver_name(),
-                    'car_name': await self.get_car_name(),
-                    'car_color': await self.get_car_color()
-                }
-            )
-        elif message_type == 'request_nearby_drivers':
-            user_lat = data.get('latitude')
-            user_lng = data.get('longitude')
-            radius_km = data.get('radius_km', 10)
-            nearby_drivers = await self.get_nearby_drivers(user_lat, user_lng, radius_km)
-            await self.send(text_data=json.dumps({
-                'type': 'nearby_drivers',
-                'drivers': nearby_drivers
-            }))
+        await self.stop_streams()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            await self.send_wrapped(None, {'type': 'error', 'message': 'Binary frames are only accepted on ws/drivers/'})
+            return
+        try:
+            data = json_utils.loads(text_data)
+        except ValueError:
+            await self.send_wrapped(None, {'type': 'error', 'message': 'Invalid JSON format'})
+            return
+        if not isinstance(data, dict):
+            await self.send_wrapped(None, {'type': 'error', 'message': 'Frames must be JSON objects'})
+            return
+        stream_class = STREAM_CLASSES.get(data.get('stream'))
+        if stream_class is None:
+            await self.send_wrapped(data.get('stream'), {
+                'type': 'error',
+                'message': f"Unknown stream. Choose from: {', '.join(STREAM_CLASSES)}"
+            })
+            return
+        try:
+            key = stream_class.stream_key(data)
+        except (KeyError, TypeError, ValueError):
+            await self.send_wrapped(stream_class.name, {'type': 'error', 'message': 'A numeric ride_id is required'})
+            return
+        action = data.get('action', 'send')
+        if action == 'subscribe':
+            await self.subscribe(stream_class, key, data)
+        elif action == 'unsubscribe':
+            stream = self.streams.pop(key, None)
+            if stream is not None:
+                await stream.stop()
+            await self.send_wrapped(key, {'type': 'unsubscribed'})
+        elif key not in self.streams:
+            await self.send_wrapped(key, {'type': 'error', 'message': 'Subscribe to this stream first'})
+        elif not isinstance(data.get('payload'), dict):
+            await self.send_wrapped(key, {'type': 'error', 'message': 'payload must be a JSON object'})
+        else:
+            await self.streams[key].receive(data['payload'])
+
+    async def subscribe(self, stream_class, key, params):
+        if key in self.streams:
+            await self.send_wrapped(key, {'type': 'subscribed'})
+            return
+        if len(self.streams) >= MAX_STREAMS:
+            await self.send_wrapped(key, {'type': 'error', 'message': f'At most {MAX_STREAMS} streams per connection'})
+            return
+        stream = stream_class(self, params)
+        if not await stream.open():
+            await stream.stop()
+            await self.send_wrapped(key, {'type': 'error', 'message': 'You do not have access to this stream'})
+            return
+        self.streams[key] = stream
+        await self.send_wrapped(key, {'type': 'subscribed'})
+        await stream.start()
+
+    async def send_wrapped(self, key, payload):
+        await self.send(text_data=self.wrap(key, json_utils.dumps(payload)))
+
+    def wrap(self, key, frame):
+        return '{"stream":' + json_utils.dumps(key) + ',"payload":' + frame + '}'
+
+    async def send_stream(self, stream, frame):
+        await self.send(text_data=self.wrap(stream.key, frame))
 
-    async def location_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'location_update',
-            'driver_id': event['driver_id'],
-            'latitude': event['latitude'],
-            'longitude': event['longitude'],
-            'is_available': event['is_available'],
-            'driver_name': event['driver_name'],
-            'car_name': event['car_name'],
-            'car_color': event['car_color']
-        }))
-
-    @database_sync_to_async
-    def update_driver_location(self, latitude, longitude, is_available):
-        DriverLocation.objects.update_or_create(
-            driver=self.user,
-            defaults={
-                'latitude': latitude,
-                'longitude': longitude,
-                'is_available': is_available
-            }
-        )
-
-    @database_sync_to_async
-    def get_nearby_drivers(self, user_lat, user_lng, radius_km):
-        all_drivers = DriverLocation.objects.filter(is_available=True).select_related('driver')
-        nearby = []
-        for driver_loc in all_drivers:
-            distance = self.haversine(user_lat, user_lng, driver_loc.latitude, driver_loc.longitude)
-            if distance <= radius_km:
-                nearby.append({
-                    'driver_id': driver_loc.driver.id,
-                    'driver_name': driver_loc.driver.get_full_name() if hasattr(driver_loc.driver, 'get_full_name') else str(driver_loc.driver),
-                    'latitude': driver_loc.latitude,
-                    'longitude': driver_loc.longitude,
-                    'distance_km': round(distance, 2),
-                    'car_name': getattr(driver_loc.driver, 'car_name', ''),
-                    'car_color': getattr(driver_loc.driver, 'car_color', ''),
-                    'rating': getattr(driver_loc.driver, 'rating', 0)
-                })
-        return sorted(nearby, key=lambda x: x['distance_km'])
-
-    def haversine(self, lat1, lon1, lat2, lon2):
-        lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        km = 6371 * c
-        return km
-
-    @database_sync_to_async
-    def get_driver_name(self):
-        if hasattr(self.user, 'get_full_name'):
-            return self.user.get_full_name()
-        return str(self.user)
-
-    @database_sync_to_async
-    def get_car_name(self):
-        return getattr(self.user, 'car_name', '')
-
-    @database_sync_to_async
-    def get_car_color(self):
-        return getattr(self.user, 'car_color', '')
+    async def close_stream(self, stream):
+        if self.streams.pop(stream.key, None) is not None:
+            await stream.stop()
+            await self.send_wrapped(stream.key, {'type': 'unsubscribed'})
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db.models import Q
+from .models import ChatMessage
+from .archive_utils import archived_messages
+from users.card_utils import get_participant_cards
+
+HISTORY_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+HISTORY_MAX_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 200)
+
+
+def parse_cursor(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def history_limit(value):
+    if value in (None, ''):
+        return HISTORY_PAGE_SIZE
+    return max(1, min(int(value), HISTORY_MAX_PAGE_SIZE))
+
+
+def _pivot_timestamp(chat_room_id, message_id):
+    return ChatMessage.objects.filter(
+        chat_room_id=chat_room_id, id=message_id
+    ).values_list('timestamp', flat=True).first()
+
+
+def _after(message, pivot, cursor_id):
+    if pivot is None:
+        return message.id > cursor_id
+    return (message.timestamp, message.id) > (pivot, cursor_id)
+
+
+def _before(message, pivot, cursor_id):
+    if pivot is None:
+        return message.id < cursor_id
+    return (message.timestamp, message.id) < (pivot, cursor_id)
+
+
+def fetch_history(chat_room_id, before_id=None, after_id=None, limit=HISTORY_PAGE_SIZE):
+    archived = None
+    cursor_id = after_id if after_id is not None else before_id
+    pivot = None
+    if cursor_id is not None:
+        pivot = _pivot_timestamp(chat_room_id, cursor_id)
+        if pivot is None:
+            archived = archived_messages(chat_room_id)
+            pivot = next((message.timestamp for message in archived if message.id == cursor_id), None)
+    queryset = ChatMessage.objects.filter(chat_room_id=chat_room_id)
+    if after_id is not None:
+        if pivot is None:
+            queryset = queryset.filter(id__gt=after_id)
+        else:
+            queryset = queryset.filter(Q(timestamp__gt=pivot) | Q(timestamp=pivot, id__gt=after_id))
+        queryset = queryset.order_by('timestamp', 'id')
+    else:
+        if before_id is not None:
+            if pivot is None:
+                queryset = queryset.filter(id__lt=before_id)
+            else:
+                queryset = queryset.filter(Q(timestamp__lt=pivot) | Q(timestamp=pivot, id__lt=before_id))
+        queryset = queryset.order_by('-timestamp', '-id')
+    messages = list(queryset[:limit + 1])
+    if len(messages) <= limit:
+        if archived is None:
+            archived = archived_messages(chat_room_id)
+        if archived:
+            hot_ids = {message.id for message in messages}
+            if after_id is not None:
+                archived = [message for message in archived if _after(message, pivot, after_id)]
+            elif before_id is not None:
+                archived = [message for message in archived if _before(message, pivot, before_id)]
+            messages.extend(message for message in archived if message.id not in hot_ids)
+            messages.sort(key=lambda message: (message.timestamp, message.id), reverse=after_id is None)
+            messages = messages[:limit + 1]
+    return messages[:limit], len(messages) > limit
+
+
+def history_payload(messages):
+    cards = get_participant_cards(message.sender_id for message in messages)
+    return [{
+        'id': message.id,
+        'message': message.message,
+        'sender_id': message.sender_id,
+        'sender_name': cards[message.sender_id]['name'] if message.sender_id in cards else None,
+        'timestamp': str(message.timestamp),
+        'is_read': message.is_read
+    } for message in messages]
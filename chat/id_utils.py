@@ -0,0 +1,48 @@
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# 41 + 6 + 6 bits keeps every id below 2**53 so JavaScript clients can hold it
+# in a Number without losing precision.
+ID_EPOCH_MS = 1704067200000
+TIMESTAMP_BITS = 41
+WORKER_BITS = 6
+SEQUENCE_BITS = 6
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+MAX_MESSAGE_ID = (1 << (TIMESTAMP_BITS + WORKER_BITS + SEQUENCE_BITS)) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+
+
+def worker_id():
+    value = getattr(settings, 'CHAT_WORKER_ID', None)
+    if value in (None, ''):
+        if settings.DEBUG:
+            return 0
+        raise ImproperlyConfigured('CHAT_WORKER_ID must be set to a number unique to each worker process.')
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ImproperlyConfigured('CHAT_WORKER_ID must be an integer.')
+    if not 0 <= value <= MAX_WORKER_ID:
+        raise ImproperlyConfigured(f'CHAT_WORKER_ID must be between 0 and {MAX_WORKER_ID}.')
+    return value
+
+
+def generate_message_id():
+    global _last_ms, _sequence
+    worker = worker_id()
+    with _lock:
+        now_ms = max(int(time.time() * 1000), _last_ms)
+        if now_ms == _last_ms:
+            _sequence = (_sequence + 1) & SEQUENCE_MASK
+            if _sequence == 0:
+                now_ms += 1
+        else:
+            _sequence = 0
+        _last_ms = now_ms
+        return ((now_ms - ID_EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (worker << SEQUENCE_BITS) | _sequence
@@ -0,0 +1,54 @@
+import struct
+import time
+from django.conf import settings
+
+LOCATION_SUBPROTOCOL = 'ridingapp.location.v1'
+DRIVER_FRAME = struct.Struct('<iiHIB')
+LOCATION_FRAME = struct.Struct('<BIiiHIB')
+FRAME_LOCATION = 1
+FLAG_AVAILABLE = 1
+COORDINATE_SCALE = 10_000_000
+HEADING_SCALE = 100
+
+LOCATION_FLUSH_INTERVAL = getattr(settings, 'WS_LOCATION_FLUSH_INTERVAL', 0.1)
+LOCATION_MAX_FLUSH_INTERVAL = getattr(settings, 'WS_LOCATION_MAX_FLUSH_INTERVAL', 2.0)
+LOCATION_DOWNGRADE_LAG = getattr(settings, 'WS_LOCATION_DOWNGRADE_LAG', 1.0)
+LOCATION_DISCONNECT_LAG = getattr(settings, 'WS_LOCATION_DISCONNECT_LAG', 10.0)
+
+
+def decode_driver_frame(data):
+    if len(data) != DRIVER_FRAME.size:
+        raise ValueError(f'Location frames must be {DRIVER_FRAME.size} bytes')
+    latitude, longitude, heading, timestamp, flags = DRIVER_FRAME.unpack(data)
+    return {
+        'latitude': latitude / COORDINATE_SCALE,
+        'longitude': longitude / COORDINATE_SCALE,
+        'heading': heading / HEADING_SCALE,
+        'timestamp': timestamp,
+        'is_available': bool(flags & FLAG_AVAILABLE),
+    }
+
+
+def encode_location_frame(driver_id, latitude, longitude, is_available, heading=None, timestamp=None):
+    try:
+        return LOCATION_FRAME.pack(
+            FRAME_LOCATION,
+            driver_id,
+            round(float(latitude) * COORDINATE_SCALE),
+            round(float(longitude) * COORDINATE_SCALE),
+            round(float(heading or 0) * HEADING_SCALE) % (360 * HEADING_SCALE),
+            int(timestamp or time.time()),
+            FLAG_AVAILABLE if is_available else 0
+        )
+    except (TypeError, ValueError, struct.error):
+        return None
+
+
+def driver_info(card):
+    return {
+        'type': 'driver_info',
+        'driver_id': card['id'],
+        'driver_name': card['name'],
+        'car_name': card['car_name'],
+        'car_color': ''
+    }
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from chat.archive_utils import ARCHIVE_AFTER_HOURS, archivable_rooms, archive_room
+
+
+class Command(BaseCommand):
+    help = 'Fold messages of completed rides into one compressed archive per chat room and delete the hot rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=int, default=ARCHIVE_AFTER_HOURS)
+        parser.add_argument('--limit', type=int, default=None, help='Archive at most this many rooms')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        room_ids = archivable_rooms(options['older_than_hours'])
+        if options['limit']:
+            room_ids = room_ids[:options['limit']]
+        room_ids = list(room_ids)
+        if options['dry_run']:
+            self.stdout.write(f'{len(room_ids)} chat rooms would be archived')
+            return
+        archived_messages = 0
+        for chat_room_id in room_ids:
+            archived_messages += archive_room(chat_room_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived_messages} messages from {len(room_ids)} chat rooms'
+        ))
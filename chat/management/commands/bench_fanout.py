@@ -0,0 +1,88 @@
+import asyncio
+import time
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from RidingApp import json_utils
+from maps.realtime_utils import frame_event
+from .bench_json import location_broadcast
+
+
+def chat_broadcast():
+    return {
+        'type': 'chat_message',
+        'message': 'I am waiting at the main gate, near the blue pharmacy sign.',
+        'sender_id': 1,
+        'sender_name': 'Rahim Uddin',
+        'timestamp': '2025-11-06 17:40:12.123456+00:00',
+        'message_id': 309637458411584,
+    }
+
+
+class Subscriber:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, text_data):
+        self.sent += len(text_data)
+
+    async def rebuild_and_encode(self, event):
+        await self.send(text_data=json_utils.dumps({key: event[key] for key in event}))
+
+    async def forward_frame(self, event):
+        await self.send(text_data=event['frame'])
+
+
+async def fan_out(subscribers, events, handler_name, layer):
+    channels = []
+    for _ in subscribers:
+        channel = await layer.new_channel()
+        await layer.group_add('bench', channel)
+        channels.append(channel)
+    handler_seconds = 0.0
+    started = time.perf_counter()
+    for payload in events:
+        event = frame_event(payload) if handler_name == 'forward_frame' else payload
+        await layer.group_send('bench', event)
+        received = [await layer.receive(channel) for channel in channels]
+        handler_started = time.perf_counter()
+        for subscriber, message in zip(subscribers, received):
+            await getattr(subscriber, handler_name)(message)
+        handler_seconds += time.perf_counter() - handler_started
+    total_seconds = time.perf_counter() - started
+    await layer.flush()
+    return handler_seconds, total_seconds
+
+
+class Command(BaseCommand):
+    help = 'Benchmark group broadcast fan-out: per-subscriber encoding against encode-once frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=50)
+
+    def handle(self, *args, **options):
+        subscriber_count = options['subscribers']
+        message_count = options['messages']
+        backend = 'orjson' if json_utils.use_orjson() else 'stdlib'
+        self.stdout.write(
+            f'Fan-out of {message_count} broadcasts to {subscriber_count} subscribers '
+            f'through the in-memory channel layer (JSON backend: {backend})'
+        )
+        self.stdout.write(
+            f'{"payload":<18}{"handler/sub":>14}{"handler/once":>14}{"speedup":>10}'
+            f'{"total/sub":>14}{"total/once":>14}'
+        )
+        for name, factory in (('location_update', location_broadcast), ('chat_message', chat_broadcast)):
+            events = [factory() for _ in range(message_count)]
+            results = []
+            for handler_name in ('rebuild_and_encode', 'forward_frame'):
+                subscribers = [Subscriber() for _ in range(subscriber_count)]
+                layer = InMemoryChannelLayer(capacity=message_count + 10, group_expiry=3600)
+                results.append(asyncio.run(fan_out(subscribers, events, handler_name, layer)))
+            deliveries = message_count * subscriber_count
+            (legacy_handler, legacy_total), (frame_handler, frame_total) = results
+            self.stdout.write(
+                f'{name:<18}{legacy_handler / deliveries * 1e6:>12.2f}us{frame_handler / deliveries * 1e6:>12.2f}us'
+                f'{legacy_handler / frame_handler:>9.2f}x'
+                f'{legacy_total / deliveries * 1e6:>12.2f}us{frame_total / deliveries * 1e6:>12.2f}us'
+            )
@@ -0,0 +1,81 @@
+import json
+import random
+import timeit
+from django.core.management.base import BaseCommand
+from RidingApp import json_utils
+
+
+def location_broadcast():
+    return {
+        'type': 'location_update',
+        'driver_id': random.randint(1, 100000),
+        'latitude': random.uniform(-90, 90),
+        'longitude': random.uniform(-180, 180),
+        'is_available': True,
+        'driver_name': 'Rahim Uddin',
+        'car_name': 'Toyota Axio',
+        'car_color': '',
+    }
+
+
+def nearby_drivers(count):
+    return {
+        'type': 'nearby_drivers',
+        'drivers': [{
+            'driver_id': index,
+            'driver_name': f'Driver {index}',
+            'latitude': random.uniform(23.7, 23.9),
+            'longitude': random.uniform(90.3, 90.5),
+            'distance_km': round(random.uniform(0, 10), 2),
+            'car_name': 'Toyota Axio',
+            'car_color': '',
+            'rating': 0,
+        } for index in range(count)]
+    }
+
+
+def chat_history(count):
+    return {
+        'type': 'chat_history',
+        'messages': [{
+            'id': index,
+            'message': 'I am waiting at the main gate, near the blue pharmacy sign.',
+            'sender_id': 1 + index % 2,
+            'sender_name': 'Karim Hossain' if index % 2 else 'Rahim Uddin',
+            'timestamp': '2025-11-06 17:40:12.123456+00:00',
+            'is_read': index % 3 == 0,
+        } for index in range(count)]
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark stdlib json against the fast JSON layer on WebSocket and REST payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--drivers', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=50)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        payloads = [
+            ('location_update', location_broadcast()),
+            (f'nearby_drivers x{options["drivers"]}', nearby_drivers(options['drivers'])),
+            (f'chat_history x{options["messages"]}', chat_history(options['messages'])),
+        ]
+        backend = 'orjson' if json_utils.use_orjson() else 'stdlib (orjson not installed or disabled)'
+        self.stdout.write(f'Fast JSON backend: {backend}')
+        self.stdout.write(f'{"payload":<22}{"bytes":>8}{"json.dumps":>14}{"fast dumps":>14}{"json.loads":>14}{"fast loads":>14}')
+        for name, payload in payloads:
+            text = json.dumps(payload)
+            fast_text = json_utils.dumps(payload)
+            if json_utils.loads(fast_text) != json.loads(text):
+                self.stderr.write(f'{name}: fast JSON output does not round-trip to the stdlib result')
+            results = [
+                timeit.timeit(lambda: json.dumps(payload), number=iterations),
+                timeit.timeit(lambda: json_utils.dumps(payload), number=iterations),
+                timeit.timeit(lambda: json.loads(text), number=iterations),
+                timeit.timeit(lambda: json_utils.loads(fast_text), number=iterations),
+            ]
+            per_call = [f'{seconds / iterations * 1e6:.2f}us' for seconds in results]
+            self.stdout.write(f'{name:<22}{len(fast_text):>8}' + ''.join(f'{value:>14}' for value in per_call))
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from RidingApp import json_utils
+from RidingApp.metrics_utils import Histogram
+from chat.streams import load_participant_card
+
+User = get_user_model()
+
+
+def driver_field(driver_id, field):
+    return User.objects.filter(id=driver_id).values_list(field, flat=True).first()
+
+
+async def per_frame_lookups(driver_id, latitude, longitude):
+    driver_name = await database_sync_to_async(driver_field)(driver_id, 'full_name')
+    car_name = await database_sync_to_async(driver_field)(driver_id, 'car_name')
+    car_color = await database_sync_to_async(lambda: '')()
+    return json_utils.dumps({
+        'type': 'location_update',
+        'driver_id': driver_id,
+        'latitude': latitude,
+        'longitude': longitude,
+        'is_available': True,
+        'driver_name': driver_name,
+        'car_name': car_name,
+        'car_color': car_color
+    })
+
+
+async def cached_card(card, latitude, longitude):
+    return json_utils.dumps({
+        'type': 'location_update',
+        'driver_id': card['id'],
+        'latitude': latitude,
+        'longitude': longitude,
+        'is_available': True,
+        'driver_name': card['name'],
+        'car_name': card['car_name'],
+        'car_color': ''
+    })
+
+
+async def run(driver_id, frames):
+    card = await load_participant_card(driver_id)
+    results = {'per-frame lookups': Histogram(frames), 'card at connect': Histogram(frames)}
+    for index in range(frames):
+        latitude, longitude = 23.8 + index * 1e-5, 90.4 + index * 1e-5
+        started = time.perf_counter()
+        await per_frame_lookups(driver_id, latitude, longitude)
+        results['per-frame lookups'].observe(time.perf_counter() - started)
+        started = time.perf_counter()
+        await cached_card(card, latitude, longitude)
+        results['card at connect'].observe(time.perf_counter() - started)
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Compare per-frame driver lookups against the precomputed driver card on the location hot path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=500)
+        parser.add_argument('--driver-id', type=int, default=None)
+
+    def handle(self, *args, **options):
+        drivers = User.objects.filter(account_type='driver')
+        if options['driver_id']:
+            drivers = drivers.filter(id=options['driver_id'])
+        driver_id = drivers.values_list('id', flat=True).first()
+        if driver_id is None:
+            raise CommandError('No driver account found to benchmark with')
+        results = asyncio.run(run(driver_id, options['frames']))
+        self.stdout.write(f'Location frame build time for driver {driver_id} over {options["frames"]} frames')
+        self.stdout.write(f'{"path":<20}{"p50":>10}{"p95":>10}{"p99":>10}{"max":>10}')
+        for name, histogram in results.items():
+            stats = histogram.snapshot()
+            self.stdout.write(
+                f'{name:<20}' + ''.join(f'{stats[key]:>8.3f}ms' for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+            )
@@ -0,0 +1,317 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from pathlib import Path
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from RidingApp import json_utils
+from RidingApp.metrics_utils import Histogram
+from chat.models import ChatRoom
+from maps.models import RidingEvent
+from users.tokens import RidingRefreshToken
+
+User = get_user_model()
+
+LOADTEST_DOMAIN = 'loadtest.ridingapp.local'
+OPERATIONS = ('location_update', 'nearby_drivers', 'chat_message')
+COMPARED_STATS = ('throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def loadtest_account(kind, index):
+    email = f'{kind}-{index}@{LOADTEST_DOMAIN}'
+    user = User.objects.filter(email=email).first()
+    if user is None:
+        user = User.objects.create_user(
+            email=email,
+            account_type=kind,
+            full_name=f'Load test {kind} {index}',
+            car_name='Load test car' if kind == 'driver' else None,
+            is_verified=True
+        )
+    return user
+
+
+def prepare_accounts(driver_count, rider_count):
+    drivers = [loadtest_account('driver', index) for index in range(driver_count)]
+    riders = [loadtest_account('user', index) for index in range(rider_count)]
+    rides = []
+    for index, rider in enumerate(riders):
+        driver = drivers[index % driver_count]
+        ride = RidingEvent.objects.filter(user=rider, driver=driver, status='in_progress').first()
+        if ride is None:
+            ride = RidingEvent.objects.create(
+                user=rider,
+                driver=driver,
+                from_where='Load test origin',
+                to_where='Load test destination',
+                distance_km=5.0,
+                estimated_time_min=15.0,
+                charge_amount=50.0,
+                payment_method='cash'
+            )
+        ChatRoom.objects.get_or_create(riding_event=ride)
+        rides.append(ride)
+    return drivers, riders, rides
+
+
+def cleanup_accounts():
+    return User.objects.filter(email__endswith=f'@{LOADTEST_DOMAIN}').delete()[0]
+
+
+def compare_results(current, baseline, tolerance):
+    rows = []
+    regressions = []
+    for operation in OPERATIONS:
+        for stat in COMPARED_STATS:
+            new = current.get(operation, {}).get(stat)
+            old = baseline.get(operation, {}).get(stat)
+            if new is None or not old:
+                continue
+            change = (new - old) / old * 100
+            worse = change < -tolerance if stat == 'throughput_per_s' else change > tolerance
+            rows.append((operation, stat, old, new, change, worse))
+            if worse:
+                regressions.append(f'{operation} {stat}')
+    return rows, regressions
+
+
+class LoadTest:
+    def __init__(self, application, options, drivers, riders, rides):
+        self.application = application
+        self.options = options
+        self.drivers = drivers
+        self.riders = riders
+        self.rides = rides
+        self.tokens = {
+            user.id: str(RidingRefreshToken.for_user(user).access_token) for user in drivers + riders
+        }
+        self.histograms = {operation: Histogram(size=100000) for operation in OPERATIONS}
+        self.sent = Counter()
+        self.received = Counter()
+        self.errors = Counter()
+        self.location_sent = {}
+        self.chat_sent = {}
+        self.nearby_sent = {}
+        self.communicators = []
+
+    async def connect(self, path, user):
+        communicator = WebsocketCommunicator(self.application, f'{path}?token={self.tokens[user.id]}')
+        connected, _ = await communicator.connect(timeout=10)
+        if not connected:
+            raise CommandError(f'Could not connect {user.email} to {path}')
+        self.communicators.append(communicator)
+        return communicator
+
+    def observe(self, operation, started, received_at):
+        self.received[operation] += 1
+        self.histograms[operation].observe(received_at - started)
+
+    async def read(self, communicator, owner_id):
+        while True:
+            message = await communicator.output_queue.get()
+            received_at = time.perf_counter()
+            if message['type'] == 'websocket.close':
+                self.errors['closed'] += 1
+                return
+            if 'text' not in message:
+                continue
+            frame = json_utils.loads(message['text'])
+            frame_type = frame.get('type')
+            if frame_type == 'location_update':
+                started = self.location_sent.get((frame['driver_id'], frame['latitude']))
+                if started is not None:
+                    self.observe('location_update', started, received_at)
+            elif frame_type == 'nearby_drivers':
+                pending = self.nearby_sent.get(owner_id)
+                if pending:
+                    self.observe('nearby_drivers', pending.pop(0), received_at)
+            elif frame_type == 'chat_message':
+                started = self.chat_sent.pop(frame['message'], None)
+                if started is not None:
+                    self.observe('chat_message', started, received_at)
+            elif frame_type == 'error':
+                self.errors[frame.get('message')] += 1
+
+    async def every(self, interval, action):
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            await action()
+            await asyncio.sleep(interval)
+
+    def drive(self, index, driver, communicator):
+        state = {'seq': 0}
+        base_latitude = 23.7 + index * 0.001
+
+        async def send_location():
+            state['seq'] += 1
+            latitude = round(base_latitude + state['seq'] * 0.000001, 7)
+            self.location_sent[(driver.id, latitude)] = time.perf_counter()
+            self.sent['location_update'] += 1
+            await communicator.send_to(text_data=json_utils.dumps({
+                'type': 'update_location',
+                'latitude': latitude,
+                'longitude': 90.4,
+                'is_available': True
+            }))
+        return self.every(self.options['location_interval'], send_location)
+
+    def request_nearby(self, rider, communicator):
+        async def send_request():
+            self.nearby_sent.setdefault(rider.id, []).append(time.perf_counter())
+            self.sent['nearby_drivers'] += 1
+            await communicator.send_to(text_data=json_utils.dumps({
+                'type': 'request_nearby_drivers',
+                'latitude': 23.75,
+                'longitude': 90.4,
+                'radius_km': 50
+            }))
+        return self.every(self.options['nearby_interval'], send_request)
+
+    def chat(self, rider, communicator):
+        state = {'seq': 0}
+
+        async def send_message():
+            state['seq'] += 1
+            message = f'load test {rider.id}:{state["seq"]}'
+            self.chat_sent[message] = time.perf_counter()
+            self.sent['chat_message'] += 1
+            await communicator.send_to(text_data=json_utils.dumps({
+                'type': 'chat_message',
+                'message': message
+            }))
+        return self.every(self.options['chat_interval'], send_message)
+
+    async def run(self):
+        readers, loops = [], []
+        for index, driver in enumerate(self.drivers):
+            communicator = await self.connect('/ws/drivers/', driver)
+            readers.append(self.read(communicator, driver.id))
+            loops.append(self.drive(index, driver, communicator))
+        for rider, ride in zip(self.riders, self.rides):
+            nearby = await self.connect('/ws/drivers/', rider)
+            chat = await self.connect(f'/ws/chat/{ride.id}/', rider)
+            readers.append(self.read(nearby, rider.id))
+            readers.append(self.read(chat, rider.id))
+            loops.append(self.request_nearby(rider, nearby))
+            loops.append(self.chat(rider, chat))
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in readers + loops]
+        started = time.perf_counter()
+        await asyncio.sleep(self.options['duration'])
+        for task in tasks[len(readers):]:
+            task.cancel()
+        await asyncio.sleep(self.options['drain'])
+        duration = time.perf_counter() - started
+        for task in tasks[:len(readers)]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(
+            *(communicator.disconnect() for communicator in self.communicators),
+            return_exceptions=True
+        )
+        return self.summary(duration, len(self.riders))
+
+    def summary(self, duration, rider_count):
+        results = {}
+        for operation in OPERATIONS:
+            expected = self.sent[operation] * rider_count if operation == 'location_update' else self.sent[operation]
+            results[operation] = {
+                'sent': self.sent[operation],
+                'expected': expected,
+                'received': self.received[operation],
+                'throughput_per_s': round(self.received[operation] / duration, 1),
+                **self.histograms[operation].snapshot()
+            }
+        return {'duration_s': round(duration, 3), 'results': results, 'errors': dict(self.errors)}
+
+
+class Command(BaseCommand):
+    help = 'Drive the ASGI application in-process with simulated drivers and riders and report WebSocket latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=10)
+        parser.add_argument('--riders', type=int, default=20)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to generate load for')
+        parser.add_argument('--drain', type=float, default=1.0, help='Seconds to wait for in-flight frames')
+        parser.add_argument('--location-interval', type=float, default=1.0)
+        parser.add_argument('--nearby-interval', type=float, default=5.0)
+        parser.add_argument('--chat-interval', type=float, default=2.0)
+        parser.add_argument('--capacity', type=int, default=100, help='Per-channel capacity of the in-memory layer')
+        parser.add_argument('--output', help='Write the results as JSON to this path')
+        parser.add_argument('--compare', help='Compare against the JSON results of an earlier run')
+        parser.add_argument('--tolerance', type=float, default=10.0, help='Allowed regression in percent')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--keep-accounts', action='store_true', help='Keep the load test accounts afterwards')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError(
+                'loadtest_ws creates accounts and rides in the configured database. '
+                'Run it with DEBUG = True against a development database.'
+            )
+        if options['drivers'] < 1 or options['riders'] < 1:
+            raise CommandError('At least one driver and one rider are required')
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json_utils.loads(Path(options['compare']).read_bytes())
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read {options["compare"]}: {e}')
+        layers = {'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': options['capacity']},
+        }}
+        with override_settings(CHANNEL_LAYERS=layers):
+            try:
+                drivers, riders, rides = prepare_accounts(options['drivers'], options['riders'])
+                from RidingApp.asgi import application
+                report = asyncio.run(LoadTest(application, options, drivers, riders, rides).run())
+            finally:
+                if not options['keep_accounts']:
+                    cleanup_accounts()
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'config': {key: options[key] for key in (
+                'drivers', 'riders', 'duration', 'location_interval', 'nearby_interval', 'chat_interval', 'capacity'
+            )},
+            **report
+        }
+        self.write_report(report)
+        if options['output']:
+            Path(options['output']).write_text(json_utils.dumps(report))
+            self.stdout.write(f'Results written to {options["output"]}')
+        if baseline is not None:
+            self.write_comparison(report, baseline, options)
+
+    def write_report(self, report):
+        self.stdout.write(
+            f'{report["config"]["drivers"]} drivers, {report["config"]["riders"]} riders '
+            f'for {report["duration_s"]}s through the in-memory channel layer'
+        )
+        self.stdout.write(
+            f'{"operation":<18}{"sent":>8}{"received":>10}{"per s":>10}'
+            f'{"p50":>10}{"p95":>10}{"p99":>10}{"max":>10}'
+        )
+        for operation, stats in report['results'].items():
+            latencies = ''.join(
+                f'{stats[key]:>8.2f}ms' if stats[key] is not None else f'{"-":>10}'
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+            )
+            self.stdout.write(
+                f'{operation:<18}{stats["sent"]:>8}{stats["received"]:>10}{stats["throughput_per_s"]:>10}' + latencies
+            )
+        for message, count in report['errors'].items():
+            self.stdout.write(self.style.WARNING(f'{count} x {message}'))
+
+    def write_comparison(self, report, baseline, options):
+        rows, regressions = compare_results(report['results'], baseline.get('results', {}), options['tolerance'])
+        self.stdout.write(f'Compared with the run from {baseline.get("created_at", options["compare"])}')
+        for operation, stat, old, new, change, worse in rows:
+            line = f'{operation:<18}{stat:<18}{old:>12}{new:>12}{change:>+9.1f}%'
+            self.stdout.write(self.style.ERROR(line) if worse else line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Regressed beyond {options["tolerance"]}%: {", ".join(regressions)}')
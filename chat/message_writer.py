@@ -0,0 +1,113 @@
+import asyncio
+import atexit
+import logging
+import time
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from maps.realtime_utils import frame_event
+from .models import ChatMessage
+from .read_utils import record_new_messages
+
+logger = logging.getLogger(__name__)
+
+WRITE_MODE = getattr(settings, 'CHAT_MESSAGE_WRITE_MODE', 'buffered')
+BATCH_SIZE = getattr(settings, 'CHAT_MESSAGE_BATCH_SIZE', 200)
+FLUSH_INTERVAL = getattr(settings, 'CHAT_MESSAGE_FLUSH_INTERVAL', 0.05)
+DURABLE = getattr(settings, 'CHAT_MESSAGE_DURABLE', True)
+WRITE_RETRIES = getattr(settings, 'CHAT_MESSAGE_WRITE_RETRIES', 3)
+RETRY_DELAY = getattr(settings, 'CHAT_MESSAGE_RETRY_DELAY', 0.1)
+
+
+class ChatMessageWriter:
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, retries=WRITE_RETRIES, retry_delay=RETRY_DELAY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pending = []
+        self._timer = None
+        self._timer_loop = None
+        self._tasks = set()
+
+    def add(self, chat_message, group=None):
+        chat_message._broadcast_group = group
+        self.pending.append(chat_message)
+        if len(self.pending) >= self.batch_size:
+            self._schedule(0)
+        elif self._timer is None or self._timer_loop is not asyncio.get_running_loop():
+            self._schedule(self.flush_interval)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_loop = asyncio.get_running_loop()
+        self._timer = self._timer_loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        failed = await database_sync_to_async(self.persist)(batch)
+        for attempt in range(self.retries):
+            if not failed:
+                return
+            await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            failed = await database_sync_to_async(self.persist)(failed)
+        if failed:
+            await self.report_failed(failed)
+
+    def flush_sync(self):
+        batch, self.pending = self.pending, []
+        failed = self.persist(batch) if batch else []
+        for attempt in range(self.retries):
+            if not failed:
+                return
+            time.sleep(self.retry_delay * 2 ** attempt)
+            failed = self.persist(failed)
+        for chat_message in failed:
+            logger.error('Chat message %s for room %s could not be saved', chat_message.id, chat_message.chat_room_id)
+
+    async def report_failed(self, failed):
+        channel_layer = get_channel_layer()
+        for chat_message in failed:
+            logger.error('Chat message %s for room %s could not be saved', chat_message.id, chat_message.chat_room_id)
+            group = getattr(chat_message, '_broadcast_group', None)
+            if channel_layer is None or group is None:
+                continue
+            await channel_layer.group_send(group, frame_event({
+                'type': 'message_failed',
+                'message_id': chat_message.id
+            }, group=group))
+
+    def persist(self, batch):
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(batch, batch_size=self.batch_size)
+                record_new_messages(batch)
+            return []
+        except DatabaseError:
+            logger.exception('Batch insert of %s chat messages failed, retrying one by one', len(batch))
+        failed = []
+        for chat_message in batch:
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create([chat_message])
+                    record_new_messages([chat_message])
+            except DatabaseError:
+                logger.exception('Insert of chat message %s for room %s failed', chat_message.id, chat_message.chat_room_id)
+                failed.append(chat_message)
+        return failed
+
+
+message_writer = ChatMessageWriter()
+
+if DURABLE:
+    atexit.register(message_writer.flush_sync)
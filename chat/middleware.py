@@ -1,12 +1,10 @@
-from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
-
-User = get_user_model()
+from users.auth_utils import UserPrincipal, aget_principal_data
+from users.tokens import ACCOUNT_TYPE_CLAIM, NAME_CLAIM, PASSWORD_EPOCH_CLAIM
 
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
@@ -21,20 +19,17 @@ class JWTAuthMiddleware(BaseMiddleware):
         if token:
             try:
                 access_token = AccessToken(token)
-                user_id = access_token['user_id']
-                if isinstance(user_id, str):
-                    user_id = int(user_id)
-                user = await self.get_user(user_id)
-                scope['user'] = user
+                scope['user'] = await self.get_user(access_token)
             except (InvalidToken, TokenError, KeyError, ValueError):
                 scope['user'] = AnonymousUser()
         else:
             scope['user'] = AnonymousUser()
         return await super().__call__(scope, receive, send)
 
-    @database_sync_to_async
-    def get_user(self, user_id):
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
+    async def get_user(self, access_token):
+        data = await aget_principal_data(int(access_token['user_id']))
+        if data is None or not data['is_active']:
+            return AnonymousUser()
+        if data[PASSWORD_EPOCH_CLAIM] > access_token.get(PASSWORD_EPOCH_CLAIM, access_token.get('iat', 0)):
             return AnonymousUser()
+        return UserPrincipal(data['user_id'], data[ACCOUNT_TYPE_CLAIM], data[NAME_CLAIM], data[PASSWORD_EPOCH_CLAIM])
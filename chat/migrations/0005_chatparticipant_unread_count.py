@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:47
+
+from django.db import migrations, models
+
+
+def backfill_unread_counts(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    rooms = ChatRoom.objects.values_list('id', 'riding_event__user_id', 'riding_event__driver_id')
+    for room_id, *user_ids in rooms.iterator():
+        for user_id in user_ids:
+            if user_id is None:
+                continue
+            participant, _ = ChatParticipant.objects.get_or_create(chat_room_id=room_id, user_id=user_id)
+            participant.unread_count = ChatMessage.objects.filter(
+                chat_room_id=room_id,
+                id__gt=participant.last_read_message_id,
+                is_read=False
+            ).exclude(sender_id=user_id).count()
+            participant.save(update_fields=['unread_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatmessage_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
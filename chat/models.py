@@ -1,6 +1,8 @@
 from django.db import models
+from django.utils import timezone
 from users.models import CustomUser
 from maps.models import RidingEvent
+from .id_utils import generate_message_id
 
 class ChatRoom(models.Model):
     riding_event = models.OneToOneField(
@@ -15,11 +17,11 @@ class ChatRoom(models.Model):
         ordering = ['-updated_at']
 
     def __str__(self):
-        return f"Chat for Event #{self.riding_event.id}"
+        return f"Chat for Event #{self.riding_event_id}"
 
     @property
     def room_name(self):
-        return f"ride_{self.riding_event.id}"
+        return f"ride_{self.riding_event_id}"
     
     def has_access(self, user):
         return (user == self.riding_event.user or 
@@ -29,6 +31,7 @@ class ChatRoom(models.Model):
         return [self.riding_event.user, self.riding_event.driver]
 
 class ChatMessage(models.Model):
+    id = models.BigIntegerField(primary_key=True, default=generate_message_id, editable=False)
     chat_room = models.ForeignKey(
         ChatRoom,
         on_delete=models.CASCADE,
@@ -40,11 +43,14 @@ class ChatMessage(models.Model):
         related_name='sent_messages'
     )
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['chat_room', 'timestamp', 'id'], name='chat_message_history_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.phone_number}: {self.message[:50]}"
@@ -58,9 +64,48 @@ class ChatMessage(models.Model):
             )
     
     def save(self, *args, **kwargs):
-        self.full_clean()
+        if not hasattr(self, '_skip_validation'):
+            self.full_clean()
         super().save(*args, **kwargs)
 
+class ChatParticipant(models.Model):
+    chat_room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='participant_states'
+    )
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='chat_participations'
+    )
+    last_read_message_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('chat_room', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} read room {self.chat_room_id} up to {self.last_read_message_id}"
+
+class ChatArchive(models.Model):
+    chat_room = models.OneToOneField(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='archive'
+    )
+    message_count = models.PositiveIntegerField(default=0)
+    first_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message = models.JSONField(null=True, blank=True)
+    payload = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Archive of {self.message_count} messages for room {self.chat_room_id}"
+
 class DriverLocation(models.Model):
     driver = models.OneToOneField(
         CustomUser,
@@ -0,0 +1,82 @@
+from collections import Counter
+from django.db import transaction
+from django.db.models import F, Max, Q
+from .models import ChatRoom, ChatMessage, ChatParticipant, ChatArchive
+
+
+def get_read_watermark(chat_room_id, user_id):
+    participant, _ = ChatParticipant.objects.get_or_create(chat_room_id=chat_room_id, user_id=user_id)
+    return participant.last_read_message_id
+
+
+def ensure_participants(chat_room_ids):
+    rooms = ChatRoom.objects.filter(id__in=chat_room_ids).values_list(
+        'id', 'riding_event__user_id', 'riding_event__driver_id'
+    )
+    ChatParticipant.objects.bulk_create([
+        ChatParticipant(chat_room_id=room_id, user_id=user_id)
+        for room_id, *user_ids in rooms
+        for user_id in user_ids
+        if user_id is not None
+    ], ignore_conflicts=True)
+
+
+def record_new_messages(messages):
+    counts = Counter((message.chat_room_id, message.sender_id) for message in messages)
+    if not counts:
+        return
+    ensure_participants({chat_room_id for chat_room_id, _ in counts})
+    for (chat_room_id, sender_id), count in counts.items():
+        ChatParticipant.objects.filter(
+            chat_room_id=chat_room_id
+        ).exclude(user_id=sender_id).update(unread_count=F('unread_count') + count)
+
+
+def unread_after(chat_room_id, user_id, message_id):
+    return ChatMessage.objects.filter(
+        chat_room_id=chat_room_id,
+        id__gt=message_id
+    ).exclude(sender_id=user_id).count()
+
+
+def latest_message_id(chat_room_id):
+    latest = ChatMessage.objects.filter(chat_room_id=chat_room_id).aggregate(latest=Max('id'))['latest'] or 0
+    archived = ChatArchive.objects.filter(chat_room_id=chat_room_id).values_list('last_message', flat=True).first()
+    return max(latest, (archived or {}).get('id', 0))
+
+
+def apply_read_watermark(chat_room_id, user_id, message_id):
+    message_id = min(message_id, latest_message_id(chat_room_id))
+    if message_id <= 0:
+        return None
+    with transaction.atomic():
+        updated = ChatParticipant.objects.filter(
+            chat_room_id=chat_room_id,
+            user_id=user_id,
+            last_read_message_id__lt=message_id
+        ).update(last_read_message_id=message_id)
+        if not updated:
+            _, created = ChatParticipant.objects.get_or_create(
+                chat_room_id=chat_room_id,
+                user_id=user_id,
+                defaults={'last_read_message_id': message_id}
+            )
+            if not created:
+                return None
+        ChatMessage.objects.filter(
+            chat_room_id=chat_room_id,
+            id__lte=message_id,
+            is_read=False
+        ).exclude(sender_id=user_id).update(is_read=True)
+        ChatParticipant.objects.filter(
+            chat_room_id=chat_room_id,
+            user_id=user_id
+        ).update(unread_count=unread_after(chat_room_id, user_id, message_id))
+    return message_id
+
+
+def unread_counts_for(user):
+    return ChatParticipant.objects.filter(
+        Q(chat_room__riding_event__user=user) | Q(chat_room__riding_event__driver=user),
+        user=user
+    ).values('chat_room_id', 'chat_room__riding_event_id', 'unread_count')
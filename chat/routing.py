@@ -3,5 +3,8 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<riding_event_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/rides/(?P<riding_event_id>\d+)/$', consumers.RideStatusConsumer.as_asgi()),
+    re_path(r'ws/rides/(?P<riding_event_id>\d+)/tracking/$', consumers.RideTrackingConsumer.as_asgi()),
     re_path(r'ws/drivers/$', consumers.DriverLocationConsumer.as_asgi()),
+    re_path(r'ws/stream/$', consumers.StreamConsumer.as_asgi()),
 ]
@@ -1,38 +1,88 @@
 from rest_framework import serializers
 from .models import ChatRoom, ChatMessage, DriverLocation
-from users.serializers import BasicUserSerializer
+from .archive_utils import archived_message
+from users.serializers import BasicUserSerializer, ParticipantCardListSerializer, ParticipantCardsMixin
 
-class ChatMessageSerializer(serializers.ModelSerializer):
+class ChatMessageSerializer(ParticipantCardsMixin, serializers.ModelSerializer):
     sender_name = serializers.SerializerMethodField()
-    sender_phone = serializers.CharField(source='sender.phone_number', read_only=True)
+    sender_phone = serializers.SerializerMethodField()
     
     class Meta:
         model = ChatMessage
         fields = ['id', 'chat_room', 'sender', 'sender_name', 'sender_phone', 
                   'message', 'timestamp', 'is_read']
         read_only_fields = ['id', 'timestamp', 'sender_name', 'sender_phone']
-    
+        list_serializer_class = ParticipantCardListSerializer
+
+    def card_user_ids(self, obj):
+        return [obj.sender_id]
+
     def get_sender_name(self, obj):
-        if hasattr(obj.sender, 'full_name') and obj.sender.full_name:
-            return obj.sender.full_name
-        return obj.sender.phone_number or str(obj.sender)
+        card = self.participant_card(obj.sender_id)
+        return card['name'] if card else None
 
-class ChatRoomSerializer(serializers.ModelSerializer):
-    messages = ChatMessageSerializer(many=True, read_only=True)
+    def get_sender_phone(self, obj):
+        card = self.participant_card(obj.sender_id)
+        return card['phone_number'] if card else None
+
+class ChatRoomSerializer(ParticipantCardsMixin, serializers.ModelSerializer):
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
+    participants = serializers.SerializerMethodField()
     
     class Meta:
         model = ChatRoom
         fields = ['id', 'riding_event', 'room_name', 'created_at', 
-                  'updated_at', 'messages', 'last_message']
+                  'updated_at', 'last_message', 'unread_count', 'participants']
         read_only_fields = ['id', 'room_name', 'created_at', 'updated_at']
-    
+        list_serializer_class = ParticipantCardListSerializer
+
+    def card_user_ids(self, obj):
+        user_ids = [obj.riding_event.user_id, obj.riding_event.driver_id]
+        for message in getattr(obj, 'latest_messages', ()):
+            user_ids.append(message.sender_id)
+        return user_ids
+
     def get_last_message(self, obj):
-        last_msg = obj.messages.last()
+        if hasattr(obj, 'latest_messages'):
+            last_msg = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_msg = obj.messages.order_by('-timestamp', '-id').first()
+        if last_msg is None:
+            archive = getattr(obj, 'archive', None)
+            if archive is not None and archive.last_message:
+                last_msg = archived_message(archive.last_message)
         if last_msg:
-            return ChatMessageSerializer(last_msg).data
+            return ChatMessageSerializer(last_msg, context=self.context).data
         return None
 
+    def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
+        request = self.context.get('request')
+        if request is None:
+            return None
+        participant = obj.participant_states.filter(user=request.user).values('unread_count').first()
+        return participant['unread_count'] if participant else 0
+
+    def get_participants(self, obj):
+        request = self.context.get('request')
+        participants = []
+        for user_id in (obj.riding_event.user_id, obj.riding_event.driver_id):
+            card = self.participant_card(user_id)
+            if card is None:
+                continue
+            picture = card['profile_picture']
+            if picture and request is not None:
+                picture = request.build_absolute_uri(picture)
+            participants.append({
+                'id': card['id'],
+                'full_name': card['name'],
+                'account_type': card['account_type'],
+                'profile_picture': picture,
+            })
+        return participants
+
 class DriverLocationSerializer(serializers.ModelSerializer):
     driver_info = BasicUserSerializer(source='driver', read_only=True)
     
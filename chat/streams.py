@@ -0,0 +1,672 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.db import DatabaseError, transaction
+from .models import ChatRoom, ChatMessage, DriverLocation
+from .message_writer import message_writer, WRITE_MODE, DURABLE
+from .read_utils import get_read_watermark, apply_read_watermark, record_new_messages
+from .history_utils import fetch_history, history_payload, history_limit, parse_cursor
+from .location_utils import (
+    decode_driver_frame, encode_location_frame, driver_info,
+    LOCATION_FLUSH_INTERVAL, LOCATION_MAX_FLUSH_INTERVAL, LOCATION_DOWNGRADE_LAG, LOCATION_DISCONNECT_LAG
+)
+from maps.models import RidingEvent
+from maps.geo_utils import haversine
+from maps.eta_utils import (
+    initial_eta_state, advance_eta, needs_provider_refresh, provider_route, apply_provider_route,
+    live_eta_fields, save_live_eta, ETA_SAVE_INTERVAL
+)
+from maps.realtime_utils import ride_chat_group, ride_group, ride_tracking_group, driver_group, ride_status_payload, frame_event
+from maps.tracking_utils import active_ride_for_driver, position_key, ride_tracking_payload
+from RidingApp import json_utils, metrics_utils
+from RidingApp.replay_utils import replay_buffer, asequenced_event
+from users.card_utils import get_cached_participant_card, get_participant_card, get_participant_cards
+
+
+async def load_participant_card(user_id):
+    card = get_cached_participant_card(user_id)
+    if card is None:
+        card = await database_sync_to_async(get_participant_card)(user_id)
+    return card
+
+
+class Stream:
+    name = None
+    replay_group = None
+
+    def __init__(self, consumer, params):
+        self.consumer = consumer
+        self.user = consumer.user
+        self.params = params
+        self.key = self.stream_key(params)
+        self.groups = []
+        self.delivered_seq = 0
+        self.replayed = (0, 0)
+
+    @classmethod
+    def stream_key(cls, params):
+        return cls.name
+
+    async def open(self):
+        return True
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        for group in self.groups:
+            await self.consumer.leave_group(group, self)
+        self.groups = []
+
+    async def join(self, group):
+        await self.consumer.join_group(group, self)
+        self.groups.append(group)
+
+    async def leave(self, group):
+        if group in self.groups:
+            self.groups.remove(group)
+            await self.consumer.leave_group(group, self)
+
+    async def send_json(self, payload):
+        await self.consumer.send_stream(self, json_utils.dumps(payload))
+
+    async def send_error(self, message):
+        await self.send_json({
+            'type': 'error',
+            'message': message
+        })
+
+    async def close(self):
+        await self.consumer.close_stream(self)
+
+    def last_seq(self):
+        try:
+            return parse_cursor(self.params.get('last_seq'))
+        except (TypeError, ValueError):
+            return None
+
+    async def resume(self):
+        last_seq = self.last_seq()
+        if last_seq is None or self.replay_group is None or not replay_buffer.shared:
+            return False
+        frames = await replay_buffer.areplay(self.replay_group, last_seq)
+        if frames is None:
+            return False
+        for seq, frame in frames:
+            await self.consumer.send_stream(self, frame)
+            self.delivered_seq = seq
+        self.delivered_seq = max(self.delivered_seq, last_seq)
+        self.replayed = (last_seq, self.delivered_seq)
+        return True
+
+    async def accept_seq(self, seq):
+        if seq > self.delivered_seq:
+            self.delivered_seq = seq
+            return True
+        if seq == self.delivered_seq or self.replayed[0] < seq <= self.replayed[1]:
+            return False
+        # The stream's counter went backwards (e.g. its seq key was evicted),
+        # so the client's last_seq no longer means anything.
+        metrics_utils.increment('ws.replay.resync')
+        self.delivered_seq = seq
+        self.replayed = (0, 0)
+        await self.send_json({
+            'type': 'resync',
+            'seq': seq
+        })
+        return True
+
+    async def receive(self, data):
+        pass
+
+    async def receive_binary(self, data):
+        await self.send_error('Binary frames are not supported on this stream')
+
+    async def send_frame(self, event):
+        if event.get('origin_channel') == self.consumer.channel_name:
+            return
+        if event.get('group') == self.replay_group and 'seq' in event:
+            if not await self.accept_seq(event['seq']):
+                return
+        await self.consumer.send_stream(self, event['frame'])
+
+    async def ride_status(self, event):
+        pass
+
+    async def driver_card(self, event):
+        pass
+
+
+class RideStream(Stream):
+    def __init__(self, consumer, params):
+        super().__init__(consumer, params)
+        self.riding_event_id = int(params['ride_id'])
+
+    @classmethod
+    def stream_key(cls, params):
+        return f"{cls.name}:{int(params['ride_id'])}"
+
+
+class ChatStream(RideStream):
+    name = 'chat'
+
+    async def open(self):
+        self.room_group_name = self.replay_group = ride_chat_group(self.riding_event_id)
+        self.ride_group_name = ride_group(self.riding_event_id)
+        state = await self.load_chat_state()
+        if state is None or self.user.id not in state['participant_ids']:
+            return False
+        if state['status'] == 'completed':
+            return False
+        self.chat_room_id = state['chat_room_id']
+        self.participant_ids = state['participant_ids']
+        self.event_status = state['status']
+        self.read_watermark = state['read_watermark']
+        self.sender_card = await load_participant_card(self.user.id)
+        await self.join(self.room_group_name)
+        await self.join(self.ride_group_name)
+        return True
+
+    async def start(self):
+        if await self.resume():
+            return
+        try:
+            after_id = parse_cursor(self.params.get('after_id'))
+        except (TypeError, ValueError):
+            after_id = None
+        await self.send_history(after_id=after_id)
+
+    async def stop(self):
+        await super().stop()
+        if DURABLE:
+            await message_writer.flush()
+
+    async def send_history(self, before_id=None, after_id=None, limit=None):
+        await message_writer.flush()
+        seq = await replay_buffer.acurrent(self.replay_group)
+        messages, has_more = await self.get_chat_history(before_id, after_id, history_limit(limit))
+        await self.send_json({
+            'type': 'chat_history',
+            'direction': 'after' if after_id is not None else 'before',
+            'messages': messages,
+            'has_more': has_more,
+            'seq': seq
+        })
+
+    async def receive(self, data):
+        message_type = data.get('type', 'chat_message')
+        if message_type == 'chat_message':
+            message = data.get('message')
+            if self.event_status == 'completed':
+                await self.send_error('Chat is disabled. This riding event has been completed.')
+                await self.close()
+                return
+            if not message or not isinstance(message, str):
+                await self.send_error('Message content is required')
+                return
+            chat_message = ChatMessage(
+                chat_room_id=self.chat_room_id,
+                sender_id=self.user.id,
+                message=message
+            )
+            if WRITE_MODE == 'buffered':
+                message_writer.add(chat_message, self.room_group_name)
+            elif not await self.save_message(chat_message):
+                await self.send_error('Failed to send message')
+                return
+            await self.consumer.channel_layer.group_send(
+                self.room_group_name,
+                await asequenced_event(self.room_group_name, {
+                    'type': 'chat_message',
+                    'message': message,
+                    'sender_id': self.user.id,
+                    'sender_name': self.sender_card['name'],
+                    'timestamp': str(chat_message.timestamp),
+                    'message_id': chat_message.id
+                })
+            )
+        elif message_type == 'load_history':
+            try:
+                before_id = parse_cursor(data.get('before_id'))
+                after_id = parse_cursor(data.get('after_id'))
+                limit = history_limit(data.get('limit'))
+            except (TypeError, ValueError):
+                await self.send_error('before_id, after_id and limit must be integers')
+                return
+            if before_id is not None and after_id is not None:
+                await self.send_error('Use either before_id or after_id, not both')
+                return
+            await self.send_history(before_id=before_id, after_id=after_id, limit=limit)
+        elif message_type == 'mark_read':
+            try:
+                message_id = int(data.get('message_id'))
+            except (TypeError, ValueError):
+                return
+            if message_id <= self.read_watermark:
+                return
+            await message_writer.flush()
+            message_id = await self.mark_read_up_to(message_id)
+            if message_id is None:
+                return
+            self.read_watermark = message_id
+            await self.consumer.channel_layer.group_send(
+                self.room_group_name,
+                await asequenced_event(self.room_group_name, {
+                    'type': 'read_receipt',
+                    'reader_id': self.user.id,
+                    'message_id': message_id
+                }, origin_channel=self.consumer.channel_name)
+            )
+
+    async def ride_status(self, event):
+        self.event_status = event['status']
+        self.participant_ids = (event['user_id'], event['driver_id'])
+        if self.user.id not in self.participant_ids:
+            await self.send_error('You do not have access to this chat room')
+            await self.close()
+        elif self.event_status == 'completed':
+            await self.send_error('Chat is disabled. This riding event has been completed.')
+            await self.close()
+
+    @database_sync_to_async
+    def load_chat_state(self):
+        event = RidingEvent.objects.filter(id=self.riding_event_id).values('user_id', 'driver_id', 'status').first()
+        if event is None:
+            return None
+        chat_room, _ = ChatRoom.objects.get_or_create(riding_event_id=self.riding_event_id)
+        participant_ids = (event['user_id'], event['driver_id'])
+        return {
+            'chat_room_id': chat_room.id,
+            'participant_ids': participant_ids,
+            'status': event['status'],
+            'read_watermark': get_read_watermark(chat_room.id, self.user.id) if self.user.id in participant_ids else 0,
+        }
+
+    @database_sync_to_async
+    def get_chat_history(self, before_id, after_id, limit):
+        messages, has_more = fetch_history(self.chat_room_id, before_id=before_id, after_id=after_id, limit=limit)
+        return history_payload(messages), has_more
+
+    @database_sync_to_async
+    def save_message(self, chat_message):
+        chat_message._skip_validation = True
+        try:
+            with transaction.atomic():
+                chat_message.save()
+                record_new_messages([chat_message])
+        except DatabaseError:
+            return False
+        return True
+
+    @database_sync_to_async
+    def mark_read_up_to(self, message_id):
+        return apply_read_watermark(self.chat_room_id, self.user.id, message_id)
+
+
+class RideStatusStream(RideStream):
+    name = 'ride_status'
+
+    async def open(self):
+        self.snapshot = await self.load_ride_status()
+        if self.snapshot is None or self.user.id not in (self.snapshot['user_id'], self.snapshot['driver_id']):
+            return False
+        self.replay_group = ride_group(self.riding_event_id)
+        await self.join(self.replay_group)
+        return True
+
+    async def start(self):
+        if await self.resume():
+            return
+        await self.send_json({
+            'type': 'ride_status',
+            **self.snapshot,
+            'seq': await replay_buffer.acurrent(self.replay_group)
+        })
+
+    async def ride_status(self, event):
+        await self.send_frame(event)
+        if self.user.id not in (event['user_id'], event['driver_id']):
+            await self.close()
+
+    @database_sync_to_async
+    def load_ride_status(self):
+        event = RidingEvent.objects.select_related('stripe_payment').filter(id=self.riding_event_id).first()
+        if event is None:
+            return None
+        payment = getattr(event, 'stripe_payment', None)
+        return ride_status_payload(event, payment.status if payment else None)
+
+
+class NearbyDriversStream(Stream):
+    name = 'nearby_drivers'
+    replay_group = 'nearby_drivers'
+
+    def __init__(self, consumer, params):
+        super().__init__(consumer, params)
+        self.sent_cards = {}
+        self.pending = {}
+        self.flush_interval = LOCATION_FLUSH_INTERVAL
+        self.flusher = None
+
+    async def open(self):
+        await self.join('nearby_drivers')
+        return True
+
+    async def stop(self):
+        if self.flusher is not None and self.flusher is not asyncio.current_task():
+            self.flusher.cancel()
+        self.flusher = None
+        self.pending = {}
+        await super().stop()
+
+    async def send_frame(self, event):
+        driver_id = event.get('driver_id')
+        if driver_id is None or self.flush_interval <= 0:
+            await self.deliver(event)
+            return
+        if self.pending.pop(driver_id, None) is not None:
+            metrics_utils.increment('ws.location.coalesced')
+        self.pending[driver_id] = event
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush_pending())
+
+    async def flush_pending(self):
+        try:
+            while self.pending:
+                deadline = time.monotonic() + self.flush_interval
+                await asyncio.sleep(self.flush_interval)
+                if not await self.flush(deadline):
+                    return
+        finally:
+            if self.flusher is asyncio.current_task():
+                self.flusher = None
+
+    async def flush(self, deadline):
+        started = time.monotonic()
+        pending, self.pending = self.pending, {}
+        metrics_utils.observe('ws.location.queue_depth', len(pending), unit='frames')
+        for event in pending.values():
+            await self.deliver(event)
+        # A late tick means the whole worker's event loop is behind, so it only
+        # slows the tick. Time spent in send() is this connection's own
+        # backpressure, and only that closes it.
+        tick_lag = started - deadline
+        send_time = time.monotonic() - started
+        metrics_utils.observe('ws.location.tick_lag', tick_lag)
+        metrics_utils.observe('ws.location.send_time', send_time)
+        if send_time >= LOCATION_DISCONNECT_LAG:
+            metrics_utils.increment('ws.location.dropped', len(self.pending))
+            metrics_utils.increment('ws.location.slow_consumer_closed')
+            await self.send_error('Connection is too slow to keep up with driver locations')
+            await self.close()
+            return False
+        lag = max(tick_lag, send_time)
+        if lag >= LOCATION_DOWNGRADE_LAG and self.flush_interval < LOCATION_MAX_FLUSH_INTERVAL:
+            self.flush_interval = min(self.flush_interval * 2, LOCATION_MAX_FLUSH_INTERVAL)
+            metrics_utils.increment('ws.location.downgraded')
+        elif lag < LOCATION_DOWNGRADE_LAG / 2 and self.flush_interval > LOCATION_FLUSH_INTERVAL:
+            self.flush_interval = max(self.flush_interval / 2, LOCATION_FLUSH_INTERVAL)
+        return True
+
+    async def deliver(self, event):
+        if not self.consumer.binary or event.get('binary') is None:
+            await super().send_frame(event)
+            return
+        if 'seq' in event and not await self.accept_seq(event['seq']):
+            return
+        card = event['card']
+        if self.sent_cards.get(card['id']) != card:
+            self.sent_cards[card['id']] = card
+            await self.send_json(driver_info(card))
+        await self.consumer.send_binary(self, event['binary'])
+
+    async def start(self):
+        if self.last_seq() is not None and not await self.resume():
+            await self.send_json({
+                'type': 'resync',
+                'seq': await replay_buffer.acurrent(self.replay_group)
+            })
+
+    async def receive(self, data):
+        if data.get('type') == 'request_nearby_drivers':
+            user_lat = data.get('latitude')
+            user_lng = data.get('longitude')
+            radius_km = data.get('radius_km', 10)
+            nearby_drivers = await self.get_nearby_drivers(user_lat, user_lng, radius_km)
+            await self.send_json({
+                'type': 'nearby_drivers',
+                'drivers': nearby_drivers
+            })
+
+    @database_sync_to_async
+    def get_nearby_drivers(self, user_lat, user_lng, radius_km):
+        all_drivers = DriverLocation.objects.filter(is_available=True).values_list('driver_id', 'latitude', 'longitude')
+        in_range = []
+        for driver_id, latitude, longitude in all_drivers:
+            distance = haversine(user_lat, user_lng, latitude, longitude)
+            if distance <= radius_km:
+                in_range.append((driver_id, latitude, longitude, distance))
+        cards = get_participant_cards(driver_id for driver_id, _, _, _ in in_range)
+        nearby = []
+        for driver_id, latitude, longitude, distance in in_range:
+            card = cards.get(driver_id)
+            if card is None:
+                continue
+            nearby.append({
+                'driver_id': driver_id,
+                'driver_name': card['name'],
+                'latitude': latitude,
+                'longitude': longitude,
+                'distance_km': round(distance, 2),
+                'car_name': card['car_name'],
+                'car_color': '',
+                'rating': 0
+            })
+        return sorted(nearby, key=lambda x: x['distance_km'])
+
+
+class TrackingStream(NearbyDriversStream):
+    name = 'tracking'
+    replay_group = None
+
+    def __init__(self, consumer, params):
+        super().__init__(consumer, params)
+        self.eta_refresh = None
+        self.eta_saved_at = None
+
+    async def open(self):
+        if getattr(self.user, 'account_type', None) != 'driver':
+            return False
+        self.card = await load_participant_card(self.user.id)
+        self.ride = None
+        self.ride_position = None
+        await self.join(driver_group(self.user.id))
+        await self.track_ride(await database_sync_to_async(active_ride_for_driver)(self.user.id))
+        return True
+
+    async def stop(self):
+        self.cancel_eta_refresh()
+        await super().stop()
+
+    async def track_ride(self, ride):
+        self.cancel_eta_refresh()
+        if self.ride is not None:
+            await self.leave(ride_group(self.ride['id']))
+        self.ride = ride
+        self.ride_position = None
+        self.eta = None
+        self.eta_saved_at = None
+        if ride is not None:
+            self.eta = initial_eta_state(ride)
+            await self.join(ride_group(ride['id']))
+
+    async def ride_status(self, event):
+        if event['driver_id'] == self.user.id and event['status'] == 'in_progress':
+            if self.ride is None or self.ride['id'] != event['riding_event_id']:
+                await self.track_ride(await database_sync_to_async(active_ride_for_driver)(self.user.id))
+        elif self.ride is not None and self.ride['id'] == event['riding_event_id']:
+            await self.track_ride(None)
+
+    async def driver_card(self, event):
+        self.card = event['card']
+        metrics_utils.increment('ws.driver_card.refreshed')
+
+    async def receive(self, data):
+        if data.get('type') != 'update_location':
+            await super().receive(data)
+            return
+        await self.publish_location(
+            data.get('latitude'),
+            data.get('longitude'),
+            data.get('is_available', True),
+            heading=data.get('heading'),
+            timestamp=data.get('timestamp')
+        )
+
+    async def receive_binary(self, data):
+        try:
+            location = decode_driver_frame(data)
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+        await self.publish_location(**location)
+
+    async def publish_location(self, latitude, longitude, is_available, heading=None, timestamp=None):
+        with metrics_utils.timer('ws.location_update.frame'):
+            tracking_event = self.track_position(latitude, longitude, heading, timestamp)
+            live_eta = self.live_eta_to_save() if tracking_event is not None else None
+            with metrics_utils.timer('ws.location_update.persist'):
+                await self.update_driver_location(latitude, longitude, is_available, live_eta)
+            event = await asequenced_event('nearby_drivers', {
+                'type': 'location_update',
+                'driver_id': self.user.id,
+                'latitude': latitude,
+                'longitude': longitude,
+                'is_available': is_available,
+                'driver_name': self.card['name'],
+                'car_name': self.card['car_name'],
+                'car_color': ''
+            })
+            event['binary'] = encode_location_frame(
+                self.user.id, latitude, longitude, is_available, heading=heading, timestamp=timestamp
+            )
+            event['card'] = self.card
+            event['driver_id'] = self.user.id
+            await self.consumer.channel_layer.group_send('nearby_drivers', event)
+            if tracking_event is not None:
+                await self.consumer.channel_layer.group_send(tracking_event['group'], tracking_event)
+
+    def track_position(self, latitude, longitude, heading, timestamp):
+        if self.ride is None:
+            return None
+        try:
+            position = position_key(latitude, longitude)
+        except (TypeError, ValueError):
+            return None
+        if position == self.ride_position:
+            metrics_utils.increment('ws.ride_tracking.unchanged')
+            return None
+        self.ride_position = position
+        self.update_eta(float(latitude), float(longitude))
+        return frame_event(
+            ride_tracking_payload(self.ride, latitude, longitude, self.eta, heading=heading, timestamp=timestamp),
+            group=ride_tracking_group(self.ride['id'])
+        )
+
+    def update_eta(self, latitude, longitude):
+        ride, eta = self.ride, self.eta
+        now = time.time()
+        with metrics_utils.timer('ws.ride_tracking.eta'):
+            advance_eta(eta, ride, latitude, longitude, now)
+        if needs_provider_refresh(eta, ride, now) and self.eta_refresh is None:
+            eta['provider_at'] = now
+            self.eta_refresh = asyncio.create_task(self.refresh_eta(ride, eta, latitude, longitude))
+
+    def live_eta_to_save(self):
+        # The live ETA rides along with the location write at most every
+        # ETA_SAVE_INTERVAL seconds, so REST readers on any worker see it.
+        now = time.monotonic()
+        if self.eta_saved_at is not None and now - self.eta_saved_at < ETA_SAVE_INTERVAL:
+            return None
+        self.eta_saved_at = now
+        return self.ride['id'], live_eta_fields(self.eta)
+
+    async def refresh_eta(self, ride, eta, latitude, longitude):
+        try:
+            metrics_utils.increment('ws.ride_tracking.eta_provider_calls')
+            route = await sync_to_async(provider_route, thread_sensitive=False)(
+                latitude, longitude, ride['destination_latitude'], ride['destination_longitude']
+            )
+            if route is not None and self.ride is ride and self.eta is eta:
+                apply_provider_route(eta, ride, route, time.time(), origin=(latitude, longitude))
+                await database_sync_to_async(save_live_eta)(ride['id'], live_eta_fields(eta))
+        finally:
+            if self.eta_refresh is asyncio.current_task():
+                self.eta_refresh = None
+
+    def cancel_eta_refresh(self):
+        if self.eta_refresh is not None:
+            self.eta_refresh.cancel()
+            self.eta_refresh = None
+
+    @database_sync_to_async
+    def update_driver_location(self, latitude, longitude, is_available, live_eta=None):
+        DriverLocation.objects.update_or_create(
+            driver_id=self.user.id,
+            defaults={
+                'latitude': latitude,
+                'longitude': longitude,
+                'is_available': is_available
+            }
+        )
+        if live_eta is not None:
+            save_live_eta(*live_eta)
+
+
+class RideTrackingStream(RideStream):
+    name = 'ride_tracking'
+
+    async def open(self):
+        ride = await self.load_ride()
+        if ride is None or self.user.id not in (ride['user_id'], ride['driver_id']):
+            return False
+        if ride['status'] != 'in_progress':
+            return False
+        self.snapshot = ride['snapshot']
+        await self.join(ride_tracking_group(self.riding_event_id))
+        await self.join(ride_group(self.riding_event_id))
+        return True
+
+    async def start(self):
+        if self.snapshot is not None:
+            await self.send_json(self.snapshot)
+
+    async def ride_status(self, event):
+        if event['status'] != 'in_progress' or self.user.id not in (event['user_id'], event['driver_id']):
+            await self.consumer.send_stream(self, event['frame'])
+            await self.close()
+
+    @database_sync_to_async
+    def load_ride(self):
+        ride = RidingEvent.objects.filter(id=self.riding_event_id).values(
+            'id', 'user_id', 'driver_id', 'status', 'live_eta_min', 'live_distance_remaining_km', 'live_eta_updated_at'
+        ).first()
+        if ride is None:
+            return None
+        ride['snapshot'] = None
+        location = None
+        if ride['live_eta_updated_at'] is not None:
+            location = DriverLocation.objects.filter(driver_id=ride['driver_id']).values('latitude', 'longitude').first()
+        if location is not None:
+            ride['snapshot'] = ride_tracking_payload(ride, location['latitude'], location['longitude'], {
+                'distance_remaining_km': ride['live_distance_remaining_km'],
+                'eta_min': ride['live_eta_min'],
+            })
+        return ride
+
+
+STREAM_CLASSES = {
+    stream_class.name: stream_class
+    for stream_class in (ChatStream, RideStatusStream, RideTrackingStream, TrackingStream, NearbyDriversStream)
+}
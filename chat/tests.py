@@ -1 +1,878 @@
-from django.test import TestCase
\ No newline at end of file
+import asyncio
+import io
+import threading
+import time
+import uuid
+from unittest import mock
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+from datetime import timedelta
+from maps.realtime_utils import frame_event, ride_chat_group
+from maps.models import RidingEvent
+from maps.tests import MapsTestCase, create_ride
+from RidingApp import json_utils, metrics_utils
+from RidingApp.replay_utils import CacheReplayBuffer, asequenced_event
+from users.card_utils import get_participant_card
+from users.models import CustomUser
+from users.tests import IN_MEMORY_LAYERS, FAST_HASHERS, create_account, access_token, authenticated_client
+from .checks import check_worker_id
+from .id_utils import MAX_MESSAGE_ID, SEQUENCE_BITS, WORKER_BITS, generate_message_id, worker_id
+from .location_utils import (
+    DRIVER_FRAME, LOCATION_FRAME, LOCATION_SUBPROTOCOL, decode_driver_frame, encode_location_frame
+)
+from .archive_utils import archive_room, load_archived_rows
+from .message_writer import ChatMessageWriter
+from .models import ChatRoom, ChatMessage, ChatParticipant, ChatArchive
+from .location_utils import LOCATION_DOWNGRADE_LAG, LOCATION_DISCONNECT_LAG, LOCATION_FLUSH_INTERVAL, LOCATION_MAX_FLUSH_INTERVAL
+from .streams import NearbyDriversStream
+from .read_utils import apply_read_watermark, record_new_messages
+
+
+@override_settings(CHAT_WORKER_ID=1)
+class ChatTestCase(MapsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(riding_event=self.ride)
+
+    def chat_path(self, ride=None):
+        return f'/ws/chat/{(ride or self.ride).id}/'
+
+    def post_message(self, sender, text):
+        return ChatMessage.objects.create(chat_room=self.room, sender=sender, message=text)
+
+    def send_message(self, sender, text, room=None):
+        response = authenticated_client(sender).post(
+            f'/api/chat/rooms/{(room or self.room).id}/send_message/', {'message': text}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return ChatMessage.objects.get(id=response.data['id'])
+
+    def messages_url(self, room=None):
+        return f'/api/chat/rooms/{(room or self.room).id}/messages/'
+
+
+class MessagesConditionalGetTests(ChatTestCase):
+    def test_matching_etag_returns_not_modified(self):
+        self.post_message(self.driver, 'On my way')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.messages_url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_message_changes_etag(self):
+        etag = self.client.get(self.messages_url())['ETag']
+        self.post_message(self.driver, 'Arrived')
+        response = self.client.get(self.messages_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([message['message'] for message in response.data['results']], ['Arrived'])
+
+    def test_cursor_is_part_of_the_etag(self):
+        first = self.post_message(self.driver, 'One')
+        self.post_message(self.driver, 'Two')
+        etag = self.client.get(self.messages_url())['ETag']
+        response = self.client.get(f'{self.messages_url()}?after_id={first.id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class FastJSONTests(SimpleTestCase):
+    payload = {
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'amount': Decimal('12.50'),
+        'at': datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc),
+        'name': 'Dhaka – Gulshan',
+        'nested': {'ids': [1, 2, 3]},
+    }
+
+    def test_round_trip(self):
+        decoded = json_utils.loads(json_utils.dumps(self.payload))
+        self.assertEqual(decoded['id'], str(self.payload['id']))
+        self.assertEqual(decoded['amount'], 12.5)
+        self.assertEqual(decoded['name'], self.payload['name'])
+        self.assertEqual(decoded['nested'], {'ids': [1, 2, 3]})
+
+    def test_stdlib_fallback_decodes_to_the_same_values(self):
+        fast = json_utils.loads(json_utils.dumps(self.payload))
+        with override_settings(FAST_JSON_ENABLED=False):
+            self.assertFalse(json_utils.use_orjson())
+            slow = json_utils.loads(json_utils.dumps(self.payload).encode())
+        self.assertEqual(fast.keys(), slow.keys())
+        for key in ('id', 'amount', 'name', 'nested'):
+            self.assertEqual(fast[key], slow[key])
+
+    def test_renderer_returns_compact_bytes(self):
+        rendered = json_utils.FastJSONRenderer().render({'a': 1, 'b': [True, None]})
+        self.assertEqual(rendered, b'{"a":1,"b":[true,null]}')
+
+
+class JSONTransportTests(ChatTestCase):
+    def test_rest_rejects_malformed_json(self):
+        response = self.client.put('/api/users/profile/', '{"full_name": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_socket_rejects_malformed_json(self):
+        socket = await self.connect(self.chat_path(), self.rider)
+        await socket.receive_json_from()
+        await socket.send_to(text_data='{"type": ')
+        self.assertEqual(await socket.receive_json_from(), {'type': 'error', 'message': 'Invalid JSON format'})
+        await socket.disconnect()
+
+
+class RoomListTests(ChatTestCase):
+    def add_rooms(self, count):
+        for _ in range(count):
+            driver = create_account(f'driver-{uuid.uuid4().hex[:8]}@example.com', 'driver')
+            room = ChatRoom.objects.create(riding_event=create_ride(self.rider, driver))
+            ChatMessage.objects.create(chat_room=room, sender=driver, message='Hello')
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/chat/rooms/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_room_is_a_summary(self):
+        self.send_message(self.driver, 'First')
+        latest = self.send_message(self.driver, 'Latest')
+        response = self.client.get(f'/api/chat/rooms/{self.room.id}/')
+        self.assertNotIn('messages', response.data)
+        self.assertEqual(response.data['last_message']['id'], latest.id)
+        self.assertEqual(response.data['unread_count'], 2)
+        self.assertEqual(
+            {participant['id'] for participant in response.data['participants']},
+            {self.rider.id, self.driver.id}
+        )
+
+    def test_room_list_queries_do_not_grow_with_rooms(self):
+        self.add_rooms(1)
+        self.list_queries()
+        baseline = self.list_queries()
+        self.add_rooms(5)
+        self.list_queries()
+        self.assertEqual(self.list_queries(), baseline)
+
+    def test_room_list_only_contains_own_rooms(self):
+        stranger = create_account('stranger@example.com')
+        response = authenticated_client(stranger).get('/api/chat/rooms/')
+        self.assertEqual(response.data, [])
+
+
+class MessageSenderCardTests(ChatTestCase):
+    def history_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_history_resolves_cards_once(self):
+        self.post_message(self.driver, 'Hello')
+        self.history_queries()
+        baseline, _ = self.history_queries()
+        for index in range(10):
+            self.post_message(self.rider if index % 2 else self.driver, f'Message {index}')
+        queries, response = self.history_queries()
+        self.assertEqual(queries, baseline)
+        self.assertEqual(
+            {message['sender_name'] for message in response.data['results']},
+            {self.rider.full_name, self.driver.full_name}
+        )
+
+    def test_renamed_sender_shows_up_in_history(self):
+        self.post_message(self.driver, 'Hello')
+        self.client.get(self.messages_url())
+        self.driver.full_name = 'Renamed Driver'
+        self.driver.save()
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.data['results'][0]['sender_name'], 'Renamed Driver')
+
+
+class ChatConnectionStateTests(ChatTestCase):
+    async def test_strangers_and_completed_rides_are_refused(self):
+        stranger = await sync_to_async(create_account)('stranger@example.com')
+        self.tokens[stranger.id] = await sync_to_async(access_token)(stranger)
+        await self.connect(self.chat_path(), stranger, accepted=False)
+        completed = await sync_to_async(create_ride)(self.rider, self.driver, status='completed')
+        await self.connect(self.chat_path(completed), self.rider, accepted=False)
+        await self.connect(self.chat_path(), accepted=False)
+
+    def test_sending_does_not_reload_the_ride(self):
+        async def send(queries):
+            socket = await self.connect(self.chat_path(), self.rider)
+            await socket.receive_json_from()
+            start = len(queries)
+            await socket.send_json_to({'type': 'chat_message', 'message': 'Where are you?'})
+            frame = await socket.receive_json_from()
+            end = len(queries)
+            await socket.disconnect()
+            return frame, queries.captured_queries[start:end]
+
+        with CaptureQueriesContext(connection) as queries:
+            frame, sending = async_to_sync(send)(queries)
+        self.assertEqual(frame['message'], 'Where are you?')
+        self.assertFalse([query for query in sending if 'maps_ridingevent' in query['sql']])
+        self.assertTrue(ChatMessage.objects.filter(id=frame['message_id']).exists())
+
+    async def test_status_change_closes_open_chat(self):
+        socket = await self.connect(self.chat_path(), self.driver)
+        await socket.receive_json_from()
+        response = await sync_to_async(self.client.patch)(
+            f'/api/maps/event/{self.ride.id}/', {'status': 'completed'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await socket.receive_json_from(), {
+            'type': 'error',
+            'message': 'Chat is disabled. This riding event has been completed.'
+        })
+        self.assertEqual((await socket.receive_output())['type'], 'websocket.close')
+
+
+class MessageIdTests(SimpleTestCase):
+    @override_settings(CHAT_WORKER_ID=5)
+    def test_ids_are_increasing_javascript_safe_integers(self):
+        ids = [generate_message_id() for _ in range(500)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLessEqual(MAX_MESSAGE_ID, 2 ** 53 - 1)
+        self.assertTrue(all(0 < message_id <= MAX_MESSAGE_ID for message_id in ids))
+        self.assertEqual((ids[0] >> SEQUENCE_BITS) & ((1 << WORKER_BITS) - 1), 5)
+
+    @override_settings(DEBUG=False, CHAT_WORKER_ID=None)
+    def test_worker_id_is_required_outside_debug(self):
+        with self.assertRaises(ImproperlyConfigured):
+            worker_id()
+        self.assertEqual([error.id for error in check_worker_id(None)], ['chat.E001'])
+        with override_settings(DEBUG=True):
+            self.assertEqual(worker_id(), 0)
+
+    def test_worker_id_must_fit_in_the_id(self):
+        with override_settings(CHAT_WORKER_ID='64'):
+            self.assertRaises(ImproperlyConfigured, worker_id)
+            self.assertEqual([error.id for error in check_worker_id(None)], ['chat.E002'])
+        with override_settings(CHAT_WORKER_ID='63'):
+            self.assertEqual(worker_id(), 63)
+            self.assertEqual(check_worker_id(None), [])
+
+
+class MessageWriterTests(ChatTestCase):
+    def buffer(self, writer, text):
+        chat_message = ChatMessage(chat_room=self.room, sender=self.driver, message=text)
+        writer.add(chat_message, 'chat_test')
+        return chat_message
+
+    async def test_failed_insert_is_retried(self):
+        writer = ChatMessageWriter(flush_interval=60, retries=2, retry_delay=0)
+        chat_message = self.buffer(writer, 'Retry me')
+        bulk_create = ChatMessage.objects.bulk_create
+        attempts = []
+
+        def flaky_bulk_create(*args, **kwargs):
+            attempts.append(args)
+            if len(attempts) < 3:
+                raise DatabaseError
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=flaky_bulk_create):
+            with self.assertLogs('chat.message_writer', 'ERROR'):
+                await writer.flush()
+        self.assertTrue(await ChatMessage.objects.filter(id=chat_message.id).aexists())
+
+    async def test_message_that_cannot_be_saved_is_reported(self):
+        socket = await self.connect(self.chat_path(), self.rider)
+        await socket.receive_json_from()
+        writer = ChatMessageWriter(flush_interval=60, retries=1, retry_delay=0)
+        chat_message = ChatMessage(chat_room=self.room, sender=self.driver, message='Lost')
+        writer.add(chat_message, ride_chat_group(self.ride.id))
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertLogs('chat.message_writer', 'ERROR'):
+                await writer.flush()
+        self.assertEqual(await socket.receive_json_from(), {'type': 'message_failed', 'message_id': chat_message.id})
+        await socket.disconnect()
+
+
+class ReadWatermarkTests(ChatTestCase):
+    def watermark(self, user):
+        return ChatParticipant.objects.get(chat_room=self.room, user=user)
+
+    def test_watermark_is_clamped_to_the_latest_message(self):
+        latest = self.send_message(self.driver, 'Hello')
+        self.assertEqual(apply_read_watermark(self.room.id, self.rider.id, 2 ** 53), latest.id)
+        self.assertEqual(self.watermark(self.rider).last_read_message_id, latest.id)
+        self.send_message(self.driver, 'Still there?')
+        self.assertEqual(self.watermark(self.rider).unread_count, 1)
+
+    def test_empty_room_and_stale_ids_are_ignored(self):
+        self.assertIsNone(apply_read_watermark(self.room.id, self.rider.id, 10 ** 12))
+        latest = self.send_message(self.driver, 'Hello')
+        apply_read_watermark(self.room.id, self.rider.id, latest.id)
+        self.assertIsNone(apply_read_watermark(self.room.id, self.rider.id, latest.id - 1))
+
+    async def test_socket_receipt_carries_the_clamped_id(self):
+        latest = await sync_to_async(self.send_message)(self.driver, 'Hello')
+        reader = await self.connect(self.chat_path(), self.rider)
+        sender = await self.connect(self.chat_path(), self.driver)
+        await reader.receive_json_from()
+        await sender.receive_json_from()
+        await reader.send_json_to({'type': 'mark_read', 'message_id': 2 ** 60})
+        receipt = await sender.receive_json_from()
+        self.assertEqual((receipt['type'], receipt['message_id']), ('read_receipt', latest.id))
+        await reader.disconnect()
+        await sender.disconnect()
+
+
+class HistoryCursorTests(ChatTestCase):
+    def test_rest_rejects_both_cursors(self):
+        response = self.client.get(f'{self.messages_url()}?before_id=10&after_id=1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Use either before_id or after_id, not both'})
+
+    async def test_socket_rejects_both_cursors(self):
+        socket = await self.connect(self.chat_path(), self.rider)
+        await socket.receive_json_from()
+        await socket.send_json_to({'type': 'load_history', 'before_id': 10, 'after_id': 1})
+        self.assertEqual(await socket.receive_json_from(), {
+            'type': 'error',
+            'message': 'Use either before_id or after_id, not both'
+        })
+        await socket.disconnect()
+
+    async def test_socket_pages_backwards(self):
+        first = await sync_to_async(self.post_message)(self.driver, 'One')
+        second = await sync_to_async(self.post_message)(self.driver, 'Two')
+        socket = await self.connect(self.chat_path(), self.rider)
+        await socket.receive_json_from()
+        await socket.send_json_to({'type': 'load_history', 'before_id': second.id})
+        history = await socket.receive_json_from()
+        self.assertEqual([message['id'] for message in history['messages']], [first.id])
+        await socket.disconnect()
+
+
+class UnreadCounterAtomicityTests(ChatTestCase):
+    def unread(self, user):
+        return ChatParticipant.objects.filter(chat_room=self.room, user=user).values_list('unread_count', flat=True).first()
+
+    def test_failed_counter_update_rolls_back_the_insert(self):
+        with mock.patch('chat.views.record_new_messages', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                authenticated_client(self.driver).post(
+                    f'/api/chat/rooms/{self.room.id}/send_message/', {'message': 'Hello'}, format='json'
+                )
+        self.assertFalse(ChatMessage.objects.filter(chat_room=self.room).exists())
+
+    def test_writer_retries_insert_and_counter_together(self):
+        writer = ChatMessageWriter(flush_interval=60, retries=1, retry_delay=0)
+        chat_message = ChatMessage(chat_room=self.room, sender=self.driver, message='Hello')
+        calls = []
+
+        def flaky_record(messages):
+            calls.append(messages)
+            if len(calls) < 3:
+                raise DatabaseError
+            record_new_messages(messages)
+
+        with mock.patch('chat.message_writer.record_new_messages', side_effect=flaky_record):
+            with self.assertLogs('chat.message_writer', 'ERROR'):
+                self.assertEqual(writer.persist([chat_message]), [chat_message])
+            self.assertFalse(ChatMessage.objects.filter(id=chat_message.id).exists())
+            self.assertEqual(writer.persist([chat_message]), [])
+        self.assertTrue(ChatMessage.objects.filter(id=chat_message.id).exists())
+        self.assertEqual(self.unread(self.rider), 1)
+
+    async def test_socket_send_is_not_broadcast_when_the_counter_fails(self):
+        socket = await self.connect(self.chat_path(), self.rider)
+        await socket.receive_json_from()
+        with mock.patch('chat.streams.WRITE_MODE', 'immediate'), \
+                mock.patch('chat.streams.record_new_messages', side_effect=DatabaseError):
+            await socket.send_json_to({'type': 'chat_message', 'message': 'Hello'})
+            self.assertEqual(await socket.receive_json_from(), {'type': 'error', 'message': 'Failed to send message'})
+        self.assertFalse(await ChatMessage.objects.filter(chat_room=self.room).aexists())
+        await socket.disconnect()
+
+
+class BroadcastFrameTests(ChatTestCase):
+    def test_frame_event_carries_the_encoded_payload(self):
+        event = frame_event({'type': 'read_receipt', 'message_id': 7}, group='chat_ride_1')
+        self.assertEqual(event['type'], 'send_frame')
+        self.assertEqual(event['group'], 'chat_ride_1')
+        self.assertEqual(json_utils.loads(event['frame']), {'type': 'read_receipt', 'message_id': 7})
+
+    async def test_subscribers_receive_the_senders_frame_unchanged(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(ride_chat_group(self.ride.id), channel)
+        sender = await self.connect(self.chat_path(), self.rider)
+        reader = await self.connect(self.chat_path(), self.driver)
+        await sender.receive_json_from()
+        await reader.receive_json_from()
+        await sender.send_json_to({'type': 'chat_message', 'message': 'Encoded once'})
+        event = await asyncio.wait_for(layer.receive(channel), timeout=1)
+        self.assertEqual(event['type'], 'send_frame')
+        self.assertEqual(await reader.receive_from(), event['frame'])
+        await sender.disconnect()
+        await reader.disconnect()
+
+    def test_bench_fanout_runs(self):
+        output = io.StringIO()
+        call_command('bench_fanout', subscribers=2, messages=1, stdout=output)
+        self.assertIn('chat_message', output.getvalue())
+
+
+class StreamEndpointTests(ChatTestCase):
+    async def request(self, socket, **frame):
+        await socket.send_json_to(frame)
+        return await socket.receive_json_from()
+
+    async def test_anonymous_connection_is_refused(self):
+        await self.connect('/ws/stream/', accepted=False)
+
+    async def test_chat_and_ride_status_share_one_connection(self):
+        socket = await self.connect('/ws/stream/', self.rider)
+        chat_key = f'chat:{self.ride.id}'
+        status_key = f'ride_status:{self.ride.id}'
+        self.assertEqual(await self.request(socket, action='subscribe', stream='chat', ride_id=self.ride.id), {
+            'stream': chat_key, 'payload': {'type': 'subscribed'}
+        })
+        self.assertEqual((await socket.receive_json_from())['payload']['type'], 'chat_history')
+        await self.request(socket, action='subscribe', stream='ride_status', ride_id=self.ride.id)
+        self.assertEqual((await socket.receive_json_from())['payload']['type'], 'ride_status')
+        frame = await self.request(socket, stream='chat', ride_id=self.ride.id, payload={'message': 'Multiplexed'})
+        self.assertEqual((frame['stream'], frame['payload']['message']), (chat_key, 'Multiplexed'))
+        await sync_to_async(self.client.patch)(self.detail_url(), {'status': 'completed'}, format='json')
+        frames = [await socket.receive_json_from() for _ in range(3)]
+        self.assertIn({'stream': chat_key, 'payload': {'type': 'unsubscribed'}}, frames)
+        status_frames = [frame['payload'] for frame in frames if frame['stream'] == status_key]
+        self.assertEqual([payload['status'] for payload in status_frames], ['completed'])
+        await socket.disconnect()
+
+    async def test_invalid_frames_are_rejected(self):
+        socket = await self.connect('/ws/stream/', self.rider)
+        self.assertEqual((await self.request(socket, stream='weather'))['payload']['message'][:14], 'Unknown stream')
+        self.assertEqual(
+            (await self.request(socket, action='subscribe', stream='chat', ride_id='abc'))['payload']['message'],
+            'A numeric ride_id is required'
+        )
+        self.assertEqual(
+            (await self.request(socket, stream='chat', ride_id=self.ride.id, payload={}))['payload']['message'],
+            'Subscribe to this stream first'
+        )
+        await socket.disconnect()
+
+    async def test_subscriptions_are_checked_and_capped(self):
+        stranger = await sync_to_async(create_account)('stranger@example.com')
+        self.tokens[stranger.id] = await sync_to_async(access_token)(stranger)
+        socket = await self.connect('/ws/stream/', stranger)
+        reply = await self.request(socket, action='subscribe', stream='chat', ride_id=self.ride.id)
+        self.assertEqual(reply['payload']['message'], 'You do not have access to this stream')
+        await socket.disconnect()
+        socket = await self.connect('/ws/stream/', self.rider)
+        with mock.patch('chat.consumers.MAX_STREAMS', 1):
+            await self.request(socket, action='subscribe', stream='ride_status', ride_id=self.ride.id)
+            await socket.receive_json_from()
+            reply = await self.request(socket, action='subscribe', stream='chat', ride_id=self.ride.id)
+        self.assertEqual(reply['payload']['message'], 'At most 1 streams per connection')
+        await socket.disconnect()
+
+
+class ChatArchiveTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.messages = [self.post_message(self.driver if index % 2 else self.rider, f'Message {index}') for index in range(5)]
+
+    def complete_ride(self, hours_ago=48):
+        RidingEvent.objects.filter(id=self.ride.id).update(
+            status='completed', updated_at=timezone.now() - timedelta(hours=hours_ago)
+        )
+
+    def archive(self, **options):
+        output = io.StringIO()
+        call_command('archive_chats', stdout=output, **options)
+        return output.getvalue()
+
+    def test_only_old_completed_rides_are_archived(self):
+        self.archive()
+        self.assertFalse(ChatArchive.objects.exists())
+        self.complete_ride(hours_ago=1)
+        self.archive()
+        self.assertFalse(ChatArchive.objects.exists())
+        self.complete_ride()
+        self.assertIn('1 chat rooms would be archived', self.archive(dry_run=True))
+        self.assertEqual(ChatMessage.objects.filter(chat_room=self.room).count(), 5)
+        self.archive()
+        archive = ChatArchive.objects.get(chat_room=self.room)
+        self.assertEqual(archive.message_count, 5)
+        self.assertEqual(archive.last_message['id'], self.messages[-1].id)
+        self.assertFalse(ChatMessage.objects.filter(chat_room=self.room).exists())
+
+    def test_history_reads_through_the_archive(self):
+        self.complete_ride()
+        self.archive()
+        response = self.client.get(f'{self.messages_url()}?limit=2')
+        self.assertEqual([message['id'] for message in response.data['results']], [message.id for message in reversed(self.messages[-2:])])
+        response = self.client.get(f'{self.messages_url()}?before_id={self.messages[3].id}&limit=10')
+        self.assertEqual([message['id'] for message in response.data['results']], [message.id for message in reversed(self.messages[:3])])
+
+    def test_archiving_again_merges_new_messages(self):
+        archive_room(self.room.id)
+        late = self.post_message(self.driver, 'Late message')
+        self.assertEqual(archive_room(self.room.id), 1)
+        self.assertEqual(
+            [row['id'] for row in load_archived_rows(self.room.id)],
+            [message.id for message in self.messages] + [late.id]
+        )
+
+
+class ReplayTests(ChatTestCase):
+    @override_settings(WS_SINGLE_PROCESS=False)
+    async def test_process_local_buffer_sends_frames_without_seq_across_processes(self):
+        event = await asequenced_event('chat_test', {'type': 'read_receipt', 'message_id': 1})
+        self.assertNotIn('seq', event)
+        self.assertNotIn('seq', json_utils.loads(event['frame']))
+
+    @override_settings(WS_SINGLE_PROCESS=False)
+    async def test_reconnect_without_shared_buffer_gets_history(self):
+        message = await sync_to_async(self.post_message)(self.driver, 'Missed')
+        socket = await self.connect(f'{self.chat_path()}?last_seq=3', self.rider)
+        history = await socket.receive_json_from()
+        self.assertEqual((history['type'], [row['id'] for row in history['messages']]), ('chat_history', [message.id]))
+        await socket.disconnect()
+
+    async def reconnect_after_missing_a_frame(self):
+        socket = await self.connect(self.chat_path(), self.rider)
+        await socket.receive_json_from()
+        for text in ('Seen', 'Missed'):
+            await socket.send_json_to({'type': 'chat_message', 'message': text})
+        seen = await socket.receive_json_from()
+        await socket.receive_json_from()
+        await socket.disconnect()
+        socket = await self.connect(f'{self.chat_path()}?last_seq={seen["seq"]}', self.rider)
+        replayed = await socket.receive_json_from()
+        await socket.disconnect()
+        self.assertEqual((replayed['message'], replayed['seq']), ('Missed', seen['seq'] + 1))
+
+    async def test_single_process_buffer_replays_missed_frames(self):
+        await self.reconnect_after_missing_a_frame()
+
+    @override_settings(SHARED_CACHE=True)
+    async def test_shared_buffer_replays_missed_frames(self):
+        buffer = CacheReplayBuffer()
+        with mock.patch('RidingApp.replay_utils.replay_buffer', buffer), mock.patch('chat.streams.replay_buffer', buffer):
+            await self.reconnect_after_missing_a_frame()
+
+    async def test_shared_buffer_numbers_concurrent_frames_uniquely(self):
+        buffer = CacheReplayBuffer()
+        published = await asyncio.gather(*(buffer.apublish('chat_test', {'n': n}) for n in range(20)))
+        self.assertEqual(sorted(seq for seq, _ in published), list(range(1, 21)))
+
+    @override_settings(SHARED_CACHE=True)
+    async def test_lost_seq_counter_resyncs_instead_of_dropping_frames(self):
+        buffer = CacheReplayBuffer()
+        with mock.patch('RidingApp.replay_utils.replay_buffer', buffer), mock.patch('chat.streams.replay_buffer', buffer):
+            socket = await self.connect(self.chat_path(), self.rider)
+            await socket.receive_json_from()
+            for text in ('One', 'Two'):
+                await socket.send_json_to({'type': 'chat_message', 'message': text})
+                await socket.receive_json_from()
+            await buffer.cache.adelete(buffer.seq_key(ride_chat_group(self.ride.id)))
+            await socket.send_json_to({'type': 'chat_message', 'message': 'Three'})
+            self.assertEqual(await socket.receive_json_from(), {'type': 'resync', 'seq': 1})
+            self.assertEqual((await socket.receive_json_from())['message'], 'Three')
+            await socket.disconnect()
+
+    async def test_location_frames_are_only_deduped_when_sequenced(self):
+        consumer = mock.Mock(binary=True, user=self.rider, send_binary=mock.AsyncMock(), send_stream=mock.AsyncMock())
+        stream = NearbyDriversStream(consumer, {})
+        card = await sync_to_async(get_participant_card)(self.driver.id)
+        for seq in (None, None, 5, 5, 3):
+            event = {'binary': b'frame', 'card': card}
+            if seq is not None:
+                event['seq'] = seq
+            await stream.deliver(event)
+        self.assertEqual(consumer.send_binary.await_count, 4)
+        frames = [json_utils.loads(call.args[1]) for call in consumer.send_stream.await_args_list]
+        self.assertIn({'type': 'resync', 'seq': 3}, frames)
+
+    async def test_coalesced_location_frames_keep_seq_order(self):
+        consumer = mock.Mock(binary=False, user=self.rider, send_stream=mock.AsyncMock())
+        stream = NearbyDriversStream(consumer, {})
+        for seq, driver_id in ((1, 7), (2, 8), (3, 7)):
+            await stream.send_frame({'frame': str(seq), 'driver_id': driver_id, 'group': 'nearby_drivers', 'seq': seq})
+        await stream.flush(time.monotonic())
+        await stream.stop()
+        self.assertEqual([call.args[1] for call in consumer.send_stream.await_args_list], ['2', '3'])
+
+
+class DriverLocationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_utils.reset()
+
+    async def share_location(self, driver_socket, **fields):
+        await driver_socket.send_json_to({'type': 'update_location', 'latitude': 23.79, 'longitude': 90.41, **fields})
+
+    async def test_riders_see_the_refreshed_driver_card(self):
+        driver_socket = await self.connect('/ws/drivers/', self.driver)
+        rider_socket = await self.connect('/ws/drivers/', self.rider)
+        await self.share_location(driver_socket)
+        self.assertEqual((await rider_socket.receive_json_from())['car_name'], 'Axio')
+        self.driver.car_name = 'Premio'
+        await sync_to_async(self.driver.save)()
+        await self.share_location(driver_socket, latitude=23.8)
+        frame = await rider_socket.receive_json_from()
+        self.assertEqual((frame['type'], frame['driver_id'], frame['car_name']), ('location_update', self.driver.id, 'Premio'))
+        await driver_socket.disconnect()
+        await rider_socket.disconnect()
+
+    def test_location_updates_are_timed(self):
+        async def drive():
+            driver_socket = await self.connect('/ws/drivers/', self.driver)
+            await self.share_location(driver_socket)
+            await self.share_location(driver_socket, latitude=23.8)
+            await driver_socket.disconnect()
+
+        async_to_sync(drive)()
+        staff = create_account('admin@example.com', is_staff=True)
+        response = authenticated_client(staff).get('/api/chat/metrics/')
+        histograms = response.data['histograms']
+        self.assertEqual(histograms['ws.location_update.frame']['count'], 2)
+        self.assertEqual(histograms['ws.location_update.persist']['count'], 2)
+
+    def test_metrics_are_staff_only(self):
+        self.assertEqual(self.client.get('/api/chat/metrics/').status_code, 403)
+
+
+class LocationFrameTests(SimpleTestCase):
+    def test_driver_frame_round_trip(self):
+        data = DRIVER_FRAME.pack(237_925_000, 904_078_000, 9000, 1_760_000_000, 1)
+        self.assertEqual(decode_driver_frame(data), {
+            'latitude': 23.7925, 'longitude': 90.4078, 'heading': 90.0, 'timestamp': 1_760_000_000, 'is_available': True
+        })
+        with self.assertRaises(ValueError):
+            decode_driver_frame(data[:-1])
+
+    def test_location_frame_layout(self):
+        frame = encode_location_frame(7, 23.7925, 90.4078, False, heading=370, timestamp=1_760_000_000)
+        self.assertEqual(len(frame), 20)
+        self.assertEqual(LOCATION_FRAME.unpack(frame), (1, 7, 237_925_000, 904_078_000, 1000, 1_760_000_000, 0))
+        self.assertIsNone(encode_location_frame(7, 'north', 90.4, True))
+
+
+class BinaryLocationProtocolTests(ChatTestCase):
+    frame = DRIVER_FRAME.pack(237_925_000, 904_078_000, 0, 1_760_000_000, 1)
+
+    async def test_binary_subscribers_get_driver_info_once(self):
+        driver_socket = await self.connect('/ws/drivers/', self.driver, subprotocols=[LOCATION_SUBPROTOCOL])
+        rider_socket = await self.connect('/ws/drivers/', self.rider, subprotocols=[LOCATION_SUBPROTOCOL])
+        json_socket = await self.connect('/ws/drivers/', self.rider)
+        await driver_socket.send_to(bytes_data=self.frame)
+        info = await rider_socket.receive_json_from()
+        self.assertEqual((info['type'], info['driver_id'], info['car_name']), ('driver_info', self.driver.id, 'Axio'))
+        binary = (await rider_socket.receive_output())['bytes']
+        self.assertEqual(LOCATION_FRAME.unpack(binary)[:4], (1, self.driver.id, 237_925_000, 904_078_000))
+        self.assertEqual((await json_socket.receive_json_from())['type'], 'location_update')
+        await driver_socket.send_to(bytes_data=DRIVER_FRAME.pack(237_926_000, 904_078_000, 0, 1_760_000_001, 1))
+        self.assertEqual(len((await rider_socket.receive_output())['bytes']), LOCATION_FRAME.size)
+        for socket in (driver_socket, rider_socket, json_socket):
+            await socket.disconnect()
+
+    async def test_malformed_binary_frame_is_rejected(self):
+        driver_socket = await self.connect('/ws/drivers/', self.driver, subprotocols=[LOCATION_SUBPROTOCOL])
+        await driver_socket.send_to(bytes_data=b'short')
+        self.assertEqual(await driver_socket.receive_json_from(), {
+            'type': 'error', 'message': f'Location frames must be {DRIVER_FRAME.size} bytes'
+        })
+        await driver_socket.disconnect()
+
+
+class TrackingTestCase(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_utils.reset()
+
+    def tracking_path(self, ride=None):
+        return f'/ws/rides/{(ride or self.ride).id}/tracking/'
+
+    async def drive_to(self, driver_socket, latitude, longitude):
+        await driver_socket.send_json_to({'type': 'update_location', 'latitude': latitude, 'longitude': longitude})
+
+
+class RideTrackingTests(TrackingTestCase):
+    async def test_rider_follows_the_assigned_driver(self):
+        driver_socket = await self.connect('/ws/drivers/', self.driver)
+        rider_socket = await self.connect(self.tracking_path(), self.rider)
+        await self.drive_to(driver_socket, 23.7700, 90.3900)
+        frame = await rider_socket.receive_json_from()
+        self.assertEqual((frame['type'], frame['riding_event_id'], frame['driver_id']), ('ride_tracking', self.ride.id, self.driver.id))
+        self.assertLess(frame['distance_remaining_km'], 8.0)
+        await self.drive_to(driver_socket, 23.770001, 90.390001)
+        await self.drive_to(driver_socket, 23.7600, 90.3800)
+        self.assertEqual((await rider_socket.receive_json_from())['latitude'], 23.76)
+        self.assertEqual(metrics_utils.snapshot()['counters']['ws.ride_tracking.unchanged'], 1)
+        await sync_to_async(cache.clear)()
+        late_socket = await self.connect(self.tracking_path(), self.driver)
+        self.assertEqual((await late_socket.receive_json_from())['latitude'], 23.76)
+        for socket in (driver_socket, rider_socket, late_socket):
+            await socket.disconnect()
+
+    async def test_only_participants_of_active_rides_can_track(self):
+        stranger = await sync_to_async(create_account)('stranger@example.com')
+        self.tokens[stranger.id] = await sync_to_async(access_token)(stranger)
+        await self.connect(self.tracking_path(), stranger, accepted=False)
+        cancelled = await sync_to_async(create_ride)(self.rider, self.driver, status='cancelled')
+        await self.connect(self.tracking_path(cancelled), self.rider, accepted=False)
+
+    async def test_tracking_closes_when_the_ride_ends(self):
+        rider_socket = await self.connect(self.tracking_path(), self.rider)
+        await sync_to_async(self.client.patch)(self.detail_url(), {'status': 'completed'}, format='json')
+        frame = await rider_socket.receive_json_from()
+        self.assertEqual((frame['type'], frame['status']), ('ride_status', 'completed'))
+        self.assertEqual((await rider_socket.receive_output())['type'], 'websocket.close')
+
+
+class LiveEtaTests(TrackingTestCase):
+    def live_eta(self):
+        return RidingEvent.objects.values('live_eta_min', 'live_distance_remaining_km', 'live_eta_updated_at').get(id=self.ride.id)
+
+    async def wait_for_eta(self, predicate):
+        for _ in range(100):
+            eta = await sync_to_async(self.live_eta)()
+            if predicate(eta):
+                return eta
+            await asyncio.sleep(0.01)
+        self.fail('Live ETA was not refreshed')
+
+    async def test_provider_refresh_does_not_block_location_updates(self):
+        released = threading.Event()
+
+        def slow_route(*args):
+            released.wait(5)
+            return 6.0, 30.0
+
+        with mock.patch('maps.eta_utils.ETA_PROVIDER_INTERVAL', 0), mock.patch('chat.streams.provider_route', slow_route):
+            driver_socket = await self.connect('/ws/drivers/', self.driver)
+            rider_socket = await self.connect(self.tracking_path(), self.rider)
+            await self.drive_to(driver_socket, 23.7700, 90.3900)
+            self.assertEqual((await rider_socket.receive_json_from())['type'], 'ride_tracking')
+            saved = await sync_to_async(self.live_eta)()
+            await self.drive_to(driver_socket, 23.7600, 90.3800)
+            self.assertEqual((await rider_socket.receive_json_from())['latitude'], 23.76)
+            released.set()
+            eta = await self.wait_for_eta(lambda eta: eta['live_eta_updated_at'] != saved['live_eta_updated_at'])
+            await driver_socket.disconnect()
+            await rider_socket.disconnect()
+        self.assertEqual(metrics_utils.snapshot()['counters']['ws.ride_tracking.eta_provider_calls'], 1)
+        self.assertLess(eta['live_distance_remaining_km'], 6.0)
+        self.assertLess(eta['live_eta_min'], 30.0)
+
+    async def test_saves_are_throttled(self):
+        driver_socket = await self.connect('/ws/drivers/', self.driver)
+        rider_socket = await self.connect(self.tracking_path(), self.rider)
+        await self.drive_to(driver_socket, 23.7700, 90.3900)
+        first = await rider_socket.receive_json_from()
+        await self.drive_to(driver_socket, 23.7600, 90.3800)
+        second = await rider_socket.receive_json_from()
+        self.assertNotEqual(first['eta_min'], second['eta_min'])
+        self.assertEqual((await sync_to_async(self.live_eta)())['live_eta_min'], first['eta_min'])
+        with mock.patch('chat.streams.ETA_SAVE_INTERVAL', 0):
+            await self.drive_to(driver_socket, 23.7550, 90.3780)
+            third = await rider_socket.receive_json_from()
+        self.assertEqual((await sync_to_async(self.live_eta)())['live_eta_min'], third['eta_min'])
+        for socket in (driver_socket, rider_socket):
+            await socket.disconnect()
+
+    def test_detail_serves_the_saved_eta(self):
+        async def drive():
+            driver_socket = await self.connect('/ws/drivers/', self.driver)
+            await self.drive_to(driver_socket, 23.7700, 90.3900)
+            await driver_socket.disconnect()
+
+        etag = self.client.get(self.detail_url())['ETag']
+        async_to_sync(drive)()
+        response = self.client.get(self.detail_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        eta = self.live_eta()
+        self.assertEqual(response.data['live_eta_min'], eta['live_eta_min'])
+        self.assertEqual(response.data['live_eta_updated_at'], DateTimeField().to_representation(eta['live_eta_updated_at']))
+        self.assertIsInstance(response.data['live_eta_updated_at'], str)
+
+
+class LocationFlushTests(SimpleTestCase):
+    def stream(self):
+        consumer = mock.Mock(binary=False, user=None, send_stream=mock.AsyncMock(), close_stream=mock.AsyncMock())
+        return NearbyDriversStream(consumer, {})
+
+    def frame(self, driver_id):
+        return frame_event({'type': 'location_update', 'driver_id': driver_id}, group='nearby_drivers', driver_id=driver_id)
+
+    async def test_on_time_ticks_keep_the_base_interval(self):
+        stream = self.stream()
+        for tick in range(3):
+            await stream.send_frame(self.frame(tick))
+            await stream.flusher
+        self.assertEqual(stream.flush_interval, LOCATION_FLUSH_INTERVAL)
+        self.assertEqual(stream.consumer.send_stream.await_count, 3)
+
+    async def test_late_tick_downgrades_the_interval(self):
+        stream = self.stream()
+        stream.pending = {1: self.frame(1)}
+        self.assertTrue(await stream.flush(time.monotonic() - LOCATION_DOWNGRADE_LAG))
+        self.assertEqual(stream.flush_interval, LOCATION_FLUSH_INTERVAL * 2)
+
+    async def test_slow_interval_recovers_once_ticks_are_on_time(self):
+        stream = self.stream()
+        stream.flush_interval = LOCATION_MAX_FLUSH_INTERVAL
+        intervals = []
+        for _ in range(6):
+            stream.pending = {1: self.frame(1)}
+            await stream.flush(time.monotonic())
+            intervals.append(stream.flush_interval)
+        self.assertEqual(intervals, sorted(intervals, reverse=True))
+        self.assertEqual(intervals[-1], LOCATION_FLUSH_INTERVAL)
+
+    async def test_worker_wide_stall_slows_but_keeps_the_stream(self):
+        stream = self.stream()
+        stream.pending = {1: self.frame(1)}
+        self.assertTrue(await stream.flush(time.monotonic() - LOCATION_DISCONNECT_LAG * 2))
+        self.assertEqual(stream.flush_interval, LOCATION_FLUSH_INTERVAL * 2)
+        stream.consumer.close_stream.assert_not_awaited()
+
+    async def test_connection_that_blocks_in_send_is_closed(self):
+        async def blocked_send(*args):
+            await asyncio.sleep(0.05)
+
+        stream = self.stream()
+        stream.consumer.send_stream.side_effect = blocked_send
+        stream.pending = {1: self.frame(1)}
+        with mock.patch('chat.streams.LOCATION_DISCONNECT_LAG', 0.05):
+            self.assertFalse(await stream.flush(time.monotonic()))
+        stream.consumer.close_stream.assert_awaited_once_with(stream)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, PASSWORD_HASHERS=FAST_HASHERS)
+class LoadTestCommandTests(TransactionTestCase):
+    def run_loadtest(self, **options):
+        output = io.StringIO()
+        call_command('loadtest_ws', drivers=1, riders=1, duration=0.2, drain=0.1, stdout=output, **options)
+        return output.getvalue()
+
+    def loadtest_accounts(self):
+        return CustomUser.objects.filter(email__endswith='@loadtest.ridingapp.local')
+
+    def test_refuses_to_run_without_debug(self):
+        with self.assertRaisesMessage(CommandError, 'DEBUG = True'):
+            self.run_loadtest()
+        self.assertFalse(self.loadtest_accounts().exists())
+
+    @override_settings(DEBUG=True)
+    def test_accounts_are_removed_unless_kept(self):
+        self.assertIn('location_update', self.run_loadtest())
+        self.assertFalse(self.loadtest_accounts().exists())
+        self.run_loadtest(keep_accounts=True)
+        self.assertEqual(self.loadtest_accounts().count(), 2)
@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ChatRoomViewSet, DriverLocationViewSet
+from .views import ChatRoomViewSet, DriverLocationViewSet, RealtimeMetricsView
 
 router = DefaultRouter()
 router.register(r'rooms', ChatRoomViewSet, basename='chatroom')
 router.register(r'drivers', DriverLocationViewSet, basename='driverlocation')
 
 urlpatterns = [
+    path('metrics/', RealtimeMetricsView.as_view(), name='realtime-metrics'),
     path('', include(router.urls)),
 ]
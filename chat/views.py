@@ -1,12 +1,20 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from math import radians, cos, sin, asin, sqrt
-from .models import ChatRoom, ChatMessage, DriverLocation
+from .models import ChatRoom, ChatMessage, ChatParticipant, DriverLocation
 from .serializers import ChatRoomSerializer, ChatMessageSerializer, DriverLocationSerializer, NearbyDriverSerializer
+from .history_utils import fetch_history, history_limit, parse_cursor
+from .read_utils import record_new_messages, unread_counts_for
 from maps.models import RidingEvent
+from RidingApp import metrics_utils
+from RidingApp.http_utils import make_etag, timestamp_of, not_modified_response, set_validators
 
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
@@ -15,22 +23,28 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        latest_messages = ChatMessage.objects.order_by('-timestamp', '-id')[:1]
+        unread = ChatParticipant.objects.filter(chat_room=OuterRef('pk'), user=user).values('unread_count')[:1]
         return ChatRoom.objects.filter(
-            riding_event__user=user
-        ) | ChatRoom.objects.filter(
-            riding_event__driver=user
+            Q(riding_event__user=user) | Q(riding_event__driver=user)
+        ).select_related(
+            'riding_event', 'archive'
+        ).defer(
+            'archive__payload'
+        ).annotate(
+            unread_count=Coalesce(Subquery(unread), 0)
+        ).prefetch_related(
+            Prefetch('messages', queryset=latest_messages, to_attr='latest_messages')
         )
     
     def check_chat_access(self, chat_room):
         event = chat_room.riding_event
-        if self.request.user != event.user and self.request.user != event.driver:
-            return False
-        return True
+        return self.request.user.id in (event.user_id, event.driver_id)
 
     @action(detail=False, methods=['get'], url_path='by-event/(?P<event_id>[^/.]+)')
     def by_event(self, request, event_id=None):
         event = get_object_or_404(RidingEvent, id=event_id)
-        if request.user != event.user and request.user != event.driver:
+        if request.user.id not in (event.user_id, event.driver_id):
             return Response(
                 {'error': 'You do not have access to this chat'},
                 status=status.HTTP_403_FORBIDDEN
@@ -39,6 +53,18 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(chat_room)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        rooms = [{
+            'chat_room': row['chat_room_id'],
+            'riding_event': row['chat_room__riding_event_id'],
+            'unread_count': row['unread_count']
+        } for row in unread_counts_for(request.user)]
+        return Response({
+            'total': sum(room['unread_count'] for room in rooms),
+            'rooms': rooms
+        })
+
     @action(detail=True, methods=['post'])
     def send_message(self, request, pk=None):
         chat_room = self.get_object()
@@ -53,11 +79,13 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 {'error': 'Message content is required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        message = ChatMessage.objects.create(
-            chat_room=chat_room,
-            sender=request.user,
-            message=message_text
-        )
+        with transaction.atomic():
+            message = ChatMessage.objects.create(
+                chat_room=chat_room,
+                sender=request.user,
+                message=message_text
+            )
+            record_new_messages([message])
         serializer = ChatMessageSerializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -69,13 +97,47 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 {'error': 'You do not have access to this chat room'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        messages = chat_room.messages.all()
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = ChatMessageSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        try:
+            before_id = parse_cursor(request.query_params.get('before_id'))
+            after_id = parse_cursor(request.query_params.get('after_id'))
+            limit = history_limit(request.query_params.get('limit'))
+        except ValueError:
+            return Response(
+                {'error': 'before_id, after_id and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if before_id is not None and after_id is not None:
+            return Response(
+                {'error': 'Use either before_id or after_id, not both'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        validators = chat_room.messages.aggregate(
+            latest_id=Max('id'),
+            latest_timestamp=Max('timestamp'),
+            total=Count('id'),
+            read=Count('id', filter=Q(is_read=True))
+        )
+        archive = getattr(chat_room, 'archive', None)
+        etag = make_etag(
+            'chat-messages', chat_room.id, request.get_full_path(),
+            validators['latest_id'], validators['total'], validators['read'],
+            archive.message_count if archive else 0
+        )
+        last_modified = timestamp_of(
+            validators['latest_timestamp'], archive.last_message_at if archive else None, chat_room.created_at
+        )
+        response = not_modified_response(request, etag=etag)
+        if response is not None:
+            return response
+        messages, has_more = fetch_history(chat_room.id, before_id=before_id, after_id=after_id, limit=limit)
         serializer = ChatMessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        response = Response({
+            'results': serializer.data,
+            'has_more': has_more,
+            'next_before_id': messages[-1].id if messages and after_id is None and has_more else None,
+            'next_after_id': messages[-1].id if messages and after_id is not None and has_more else None
+        })
+        return set_validators(response, etag=etag, last_modified=last_modified)
 
 
 class DriverLocationViewSet(viewsets.ModelViewSet):
@@ -150,3 +212,10 @@ class DriverLocationViewSet(viewsets.ModelViewSet):
         c = 2 * asin(sqrt(a))
         km = 6371 * c
         return km
+
+
+class RealtimeMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics_utils.snapshot())
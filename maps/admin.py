@@ -1,12 +1,14 @@
 from django.contrib import admin
+from django.utils import timezone
 from .models import RidingEvent, StripePayment
+from .realtime_utils import notify_ride_status
 
 @admin.register(RidingEvent)
 class RidingEventAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'driver', 'from_where', 'to_where', 'distance_km', 'charge_amount', 'payment_method', 'payment_completed', 'status', 'created_at']
     list_filter = ['payment_completed', 'payment_method', 'status', 'created_at']
     search_fields = ['user__full_name', 'driver__full_name', 'from_where', 'to_where', 'stripe_payment_intent_id']
-    readonly_fields = ['created_at', 'stripe_payment_intent_id']
+    readonly_fields = ['created_at', 'updated_at', 'stripe_payment_intent_id']
     ordering = ['-created_at']
     list_editable = ['status']
     fieldsets = (
@@ -23,31 +25,38 @@ class RidingEventAdmin(admin.ModelAdmin):
             'fields': ('status',)
         }),
         ('Timestamps', {
-            'fields': ('created_at',)
+            'fields': ('created_at', 'updated_at')
         }),
     )
     actions = ['mark_completed', 'mark_cancelled', 'mark_in_progress']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and {'status', 'payment_completed', 'user', 'driver'} & set(form.changed_data):
+            notify_ride_status(obj)
     
-    def mark_completed(self, request, queryset):
-        updated = queryset.update(status='completed')
-        for event in queryset:
-            if event.driver:
+    def update_status(self, queryset, status, release_drivers=False):
+        event_ids = list(queryset.values_list('id', flat=True))
+        updated = RidingEvent.objects.filter(id__in=event_ids).update(status=status, updated_at=timezone.now())
+        for event in RidingEvent.objects.filter(id__in=event_ids).select_related('driver'):
+            notify_ride_status(event)
+            if release_drivers and event.driver:
                 event.driver.driver_is_available = True
                 event.driver.save()
+        return updated
+
+    def mark_completed(self, request, queryset):
+        updated = self.update_status(queryset, 'completed', release_drivers=True)
         self.message_user(request, f'{updated} events marked as completed.')
     mark_completed.short_description = "Mark selected events as completed"
     
     def mark_cancelled(self, request, queryset):
-        updated = queryset.update(status='cancelled')
-        for event in queryset:
-            if event.driver:
-                event.driver.driver_is_available = True
-                event.driver.save()
+        updated = self.update_status(queryset, 'cancelled', release_drivers=True)
         self.message_user(request, f'{updated} events marked as cancelled.')
     mark_cancelled.short_description = "Mark selected events as cancelled"
     
     def mark_in_progress(self, request, queryset):
-        updated = queryset.update(status='in_progress')
+        updated = self.update_status(queryset, 'in_progress')
         self.message_user(request, f'{updated} events marked as in progress.')
     mark_in_progress.short_description = "Mark selected events as in progress"
 
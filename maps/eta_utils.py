@@ -0,0 +1,117 @@
+import logging
+import time
+from django.conf import settings
+from django.utils import timezone
+from .geo_utils import haversine
+from .gmaps_utils import get_gmaps_client
+from .models import RidingEvent
+
+logger = logging.getLogger(__name__)
+
+ETA_SPEED_SMOOTHING = getattr(settings, 'LIVE_ETA_SPEED_SMOOTHING', 0.3)
+ETA_MIN_SPEED_KMH = getattr(settings, 'LIVE_ETA_MIN_SPEED_KMH', 5.0)
+ETA_MAX_SPEED_KMH = getattr(settings, 'LIVE_ETA_MAX_SPEED_KMH', 150.0)
+ETA_PROVIDER_INTERVAL = getattr(settings, 'LIVE_ETA_PROVIDER_INTERVAL', 300)
+ETA_SAVE_INTERVAL = getattr(settings, 'LIVE_ETA_SAVE_INTERVAL', 10)
+
+
+def has_destination(ride):
+    return ride['destination_latitude'] is not None and ride['destination_longitude'] is not None
+
+
+def initial_eta_state(ride, now=None):
+    straight = None
+    if has_destination(ride) and ride['origin_latitude'] is not None and ride['origin_longitude'] is not None:
+        straight = haversine(
+            ride['origin_latitude'], ride['origin_longitude'],
+            ride['destination_latitude'], ride['destination_longitude']
+        )
+    hours = (ride['estimated_time_min'] or 0) / 60
+    saved = ride.get('live_eta_min') is not None
+    return {
+        'speed_kmh': ride['distance_km'] / hours if hours else None,
+        'detour_factor': max(1.0, ride['distance_km'] / straight) if straight else 1.0,
+        'position': None,
+        'observed_at': None,
+        'provider_at': now or time.time(),
+        'distance_remaining_km': ride['live_distance_remaining_km'] if saved else ride['distance_km'],
+        'eta_min': ride['live_eta_min'] if saved else ride['estimated_time_min'],
+        'updated_at': timezone.now(),
+    }
+
+
+def advance_eta(state, ride, latitude, longitude, now):
+    if not has_destination(ride):
+        return state
+    if state['position'] is not None and now > state['observed_at']:
+        moved = haversine(state['position'][0], state['position'][1], latitude, longitude)
+        observed = moved / ((now - state['observed_at']) / 3600)
+        if observed <= ETA_MAX_SPEED_KMH:
+            if state['speed_kmh'] is None:
+                state['speed_kmh'] = observed
+            else:
+                state['speed_kmh'] += ETA_SPEED_SMOOTHING * (observed - state['speed_kmh'])
+    state['position'] = (latitude, longitude)
+    state['observed_at'] = now
+    remaining = haversine(latitude, longitude, ride['destination_latitude'], ride['destination_longitude'])
+    state['distance_remaining_km'] = round(remaining * state['detour_factor'], 3)
+    if state['speed_kmh'] is not None:
+        state['eta_min'] = round(state['distance_remaining_km'] / max(state['speed_kmh'], ETA_MIN_SPEED_KMH) * 60, 1)
+    state['updated_at'] = timezone.now()
+    return state
+
+
+def needs_provider_refresh(state, ride, now):
+    return has_destination(ride) and state['position'] is not None and now - state['provider_at'] >= ETA_PROVIDER_INTERVAL
+
+
+def provider_route(latitude, longitude, destination_latitude, destination_longitude):
+    client = get_gmaps_client()
+    if not client:
+        return None
+    try:
+        result = client.distance_matrix(
+            origins=[(latitude, longitude)],
+            destinations=[(destination_latitude, destination_longitude)],
+            mode='driving',
+            units='metric'
+        )
+        element = result['rows'][0]['elements'][0]
+        if element['status'] != 'OK':
+            return None
+        return element['distance']['value'] / 1000.0, element['duration']['value'] / 60.0
+    except Exception:
+        logger.exception('Failed to refresh route to %s,%s', destination_latitude, destination_longitude)
+        return None
+
+
+def apply_provider_route(state, ride, route, now, origin=None):
+    state['provider_at'] = now
+    if route is None:
+        return state
+    distance_km, duration_min = route
+    latitude, longitude = origin or state['position']
+    straight = haversine(latitude, longitude, ride['destination_latitude'], ride['destination_longitude'])
+    if straight:
+        state['detour_factor'] = max(1.0, distance_km / straight)
+    remaining = distance_km
+    if origin is not None and state['position'] != origin:
+        remaining = haversine(
+            state['position'][0], state['position'][1], ride['destination_latitude'], ride['destination_longitude']
+        ) * state['detour_factor']
+    state['distance_remaining_km'] = round(remaining, 3)
+    state['eta_min'] = round(duration_min * remaining / distance_km if distance_km else duration_min, 1)
+    state['updated_at'] = timezone.now()
+    return state
+
+
+def live_eta_fields(state):
+    return {
+        'live_eta_min': state['eta_min'],
+        'live_distance_remaining_km': state['distance_remaining_km'],
+        'live_eta_updated_at': state['updated_at'],
+    }
+
+
+def save_live_eta(riding_event_id, fields):
+    RidingEvent.objects.filter(id=riding_event_id, status='in_progress').update(**fields)
@@ -0,0 +1,125 @@
+import csv
+import io
+import zlib
+from itertools import chain
+from datetime import datetime, time
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from RidingApp import json_utils
+from .models import RidingEvent, StripePayment
+from chat.models import ChatMessage
+from chat.archive_utils import iter_archived_rows
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+EXPORT_DATASETS = {
+    'rides': {
+        'model': RidingEvent,
+        'date_field': 'created_at',
+        'fields': [
+            'id', 'user_id', 'driver_id', 'from_where', 'to_where', 'distance_km',
+            'estimated_time_min', 'charge_amount', 'payment_method', 'payment_completed',
+            'stripe_payment_intent_id', 'status', 'created_at', 'updated_at'
+        ],
+        'expressions': {},
+    },
+    'payments': {
+        'model': StripePayment,
+        'date_field': 'created_at',
+        'fields': [
+            'id', 'riding_event_id', 'stripe_payment_intent_id', 'stripe_charge_id',
+            'amount', 'currency', 'status', 'payment_method_id', 'customer_email',
+            'error_message', 'created_at', 'updated_at'
+        ],
+        'expressions': {},
+    },
+    'chats': {
+        'model': ChatMessage,
+        'date_field': 'timestamp',
+        'fields': ['id', 'chat_room_id', 'sender_id', 'message', 'timestamp', 'is_read'],
+        'expressions': {'riding_event_id': F('chat_room__riding_event_id')},
+        'archived_rows': iter_archived_rows,
+    },
+}
+
+
+def parse_export_bound(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError(f"Invalid date '{value}'. Use YYYY-MM-DD or an ISO 8601 datetime.")
+        parsed = datetime.combine(parsed_date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_columns(dataset):
+    spec = EXPORT_DATASETS[dataset]
+    return spec['fields'] + list(spec['expressions'])
+
+
+def export_rows(dataset, start=None, end=None):
+    spec = EXPORT_DATASETS[dataset]
+    queryset = spec['model'].objects.all()
+    if start:
+        queryset = queryset.filter(**{f"{spec['date_field']}__gte": start})
+    if end:
+        queryset = queryset.filter(**{f"{spec['date_field']}__lt": end})
+    queryset = queryset.order_by('id').values(*spec['fields'], **spec['expressions'])
+    rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if 'archived_rows' in spec:
+        return chain(rows, spec['archived_rows'](start=start, end=end))
+    return rows
+
+
+def iter_ndjson(rows):
+    lines = []
+    for row in rows:
+        lines.append(json_utils.dumps_bytes(row))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+def iter_csv_gzip(columns, rows):
+    compressor = zlib.compressobj(wbits=31)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+        pending += 1
+        if pending >= EXPORT_CHUNK_SIZE:
+            chunk = compressor.compress(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(buffer.getvalue().encode('utf-8')) + compressor.flush()
+
+
+def export_stream(dataset, output='ndjson', start=None, end=None):
+    rows = export_rows(dataset, start=start, end=end)
+    if output == 'csv':
+        return iter_csv_gzip(export_columns(dataset), rows)
+    return iter_ndjson(rows)
+
+
+def export_content_type(output):
+    return 'application/gzip' if output == 'csv' else 'application/x-ndjson'
+
+
+def export_filename(dataset, output):
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    return f'{dataset}-{stamp}.csv.gz' if output == 'csv' else f'{dataset}-{stamp}.ndjson'
@@ -0,0 +1,39 @@
+from django.http import StreamingHttpResponse
+from rest_framework import status, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .export_utils import (
+    EXPORT_DATASETS, EXPORT_FORMATS, parse_export_bound, export_stream,
+    export_content_type, export_filename
+)
+
+
+class ExportDataView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, dataset):
+        if dataset not in EXPORT_DATASETS:
+            return Response({
+                'error': f"Unknown dataset '{dataset}'. Choose from: {', '.join(EXPORT_DATASETS)}"
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({
+                'error': f"Unknown output '{output}'. Choose from: {', '.join(EXPORT_FORMATS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start = parse_export_bound(request.query_params.get('start'))
+            end = parse_export_bound(request.query_params.get('end'))
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            export_stream(dataset, output=output, start=start, end=end),
+            content_type=export_content_type(output)
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, output)}"'
+        return response
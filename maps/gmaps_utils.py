@@ -0,0 +1,20 @@
+import os
+from django.conf import settings
+
+try:
+    import googlemaps
+    gmaps_available = True
+    gmaps_client = None
+except ImportError:
+    gmaps_available = False
+    gmaps_client = None
+
+def get_gmaps_client():
+    global gmaps_client
+    if not gmaps_available:
+        return None
+    if gmaps_client is None:
+        key = getattr(settings, 'GOOGLE_MAPS_API_KEY', os.environ.get('GOOGLE_MAPS_API_KEY'))
+        if key:
+            gmaps_client = googlemaps.Client(key=key)
+    return gmaps_client
@@ -0,0 +1,32 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from maps.export_utils import EXPORT_DATASETS, EXPORT_FORMATS, parse_export_bound, export_stream
+
+
+class Command(BaseCommand):
+    help = 'Stream rides, payments or chat messages as NDJSON or gzipped CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(EXPORT_DATASETS))
+        parser.add_argument('--output', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--start', help='Include rows created on or after this date/datetime')
+        parser.add_argument('--end', help='Include rows created before this date/datetime')
+        parser.add_argument('--file', help='Write to this path instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_export_bound(options['start'])
+            end = parse_export_bound(options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        stream = export_stream(options['dataset'], output=options['output'], start=start, end=end)
+        if options['file']:
+            with open(options['file'], 'wb') as target:
+                for chunk in stream:
+                    target.write(chunk)
+            self.stderr.write(f"Exported {options['dataset']} to {options['file']}")
+        else:
+            for chunk in stream:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
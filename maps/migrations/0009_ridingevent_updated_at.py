@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0008_alter_ridingevent_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ridingevent',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='ridingevent',
+            name='status',
+            field=models.CharField(blank=True, choices=[('in_progress', 'In Progress'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='in_progress', max_length=20, null=True),
+        ),
+    ]
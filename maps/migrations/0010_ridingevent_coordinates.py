@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0009_ridingevent_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ridingevent',
+            name='destination_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridingevent',
+            name='destination_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridingevent',
+            name='origin_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridingevent',
+            name='origin_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0010_ridingevent_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ridingevent',
+            name='live_distance_remaining_km',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridingevent',
+            name='live_eta_min',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridingevent',
+            name='live_eta_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -24,6 +24,10 @@ class RidingEvent(models.Model):
 
     from_where = models.CharField(max_length=100)
     to_where = models.CharField(max_length=100)
+    origin_latitude = models.FloatField(null=True, blank=True)
+    origin_longitude = models.FloatField(null=True, blank=True)
+    destination_latitude = models.FloatField(null=True, blank=True)
+    destination_longitude = models.FloatField(null=True, blank=True)
     distance_km = models.FloatField()
     estimated_time_min = models.FloatField()
     charge_amount = models.FloatField()
@@ -37,7 +41,11 @@ class RidingEvent(models.Model):
         null=True, 
         blank=True
     )
+    live_eta_min = models.FloatField(null=True, blank=True)
+    live_distance_remaining_km = models.FloatField(null=True, blank=True)
+    live_eta_updated_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
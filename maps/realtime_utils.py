@@ -0,0 +1,79 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from RidingApp import json_utils
+from RidingApp.replay_utils import sequenced_event
+
+logger = logging.getLogger(__name__)
+
+
+def ride_chat_group(riding_event_id):
+    return f'chat_ride_{riding_event_id}'
+
+
+def ride_group(riding_event_id):
+    return f'ride_{riding_event_id}'
+
+
+def ride_tracking_group(riding_event_id):
+    return f'ride_tracking_{riding_event_id}'
+
+
+def driver_group(driver_id):
+    return f'driver_location_{driver_id}'
+
+
+def frame_event(payload, **extra):
+    return {
+        'type': 'send_frame',
+        'frame': json_utils.dumps(payload),
+        **extra
+    }
+
+
+def ride_status_payload(riding_event, payment_status=None):
+    return {
+        'riding_event_id': riding_event.id,
+        'status': riding_event.status,
+        'user_id': riding_event.user_id,
+        'driver_id': riding_event.driver_id,
+        'payment_completed': riding_event.payment_completed,
+        'payment_status': payment_status,
+    }
+
+
+def notify_ride_status(riding_event, payment_status=None):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        group = ride_group(riding_event.id)
+        payload = {
+            'type': 'ride_status',
+            **ride_status_payload(riding_event, payment_status)
+        }
+        async_to_sync(channel_layer.group_send)(group, {
+            **sequenced_event(group, payload),
+            **payload
+        })
+        if riding_event.driver_id:
+            async_to_sync(channel_layer.group_send)(driver_group(riding_event.driver_id), {
+                **payload,
+                'group': driver_group(riding_event.driver_id)
+            })
+    except Exception:
+        logger.exception('Failed to publish status of riding event %s', riding_event.id)
+
+
+def notify_driver_card(card):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(driver_group(card['id']), {
+            'type': 'driver_card',
+            'group': driver_group(card['id']),
+            'card': card
+        })
+    except Exception:
+        logger.exception('Failed to publish card of driver %s', card['id'])
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import RidingEvent, StripePayment
 from users.models import CustomUser
+from users.serializers import ParticipantCardListSerializer, ParticipantCardsMixin
 
 class StripePaymentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,26 +17,58 @@ class StripePaymentSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
 
-class RidingEventSerializer(serializers.ModelSerializer):
-    user_name = serializers.CharField(source='user.full_name', read_only=True)
-    driver_name = serializers.CharField(source='driver.full_name', read_only=True)
-    user_email = serializers.EmailField(source='user.email', read_only=True)
-    driver_email = serializers.EmailField(source='driver.email', read_only=True)
+class RidingEventSerializer(ParticipantCardsMixin, serializers.ModelSerializer):
+    user_name = serializers.SerializerMethodField()
+    driver_name = serializers.SerializerMethodField()
+    user_email = serializers.SerializerMethodField()
+    driver_email = serializers.SerializerMethodField()
     stripe_payment = StripePaymentSerializer(read_only=True)
+    live_eta_min = serializers.SerializerMethodField()
+    live_eta_updated_at = serializers.SerializerMethodField()
     
     class Meta:
         model = RidingEvent
         fields = [
             'id', 'user', 'driver', 'user_name', 'driver_name', 
             'user_email', 'driver_email', 'from_where', 'to_where',
-            'distance_km', 'estimated_time_min', 'charge_amount',
+            'origin_latitude', 'origin_longitude', 'destination_latitude', 'destination_longitude',
+            'distance_km', 'estimated_time_min', 'live_eta_min', 'live_eta_updated_at', 'charge_amount',
             'payment_method', 'payment_completed', 'stripe_payment_intent_id',
             'created_at', 'stripe_payment', 'status'
         ]
         read_only_fields = [
             'id', 'created_at', 'user_name', 'driver_name', 
-            'user_email', 'driver_email', 'stripe_payment'
+            'user_email', 'driver_email', 'stripe_payment', 'live_eta_min', 'live_eta_updated_at',
+            'origin_latitude', 'origin_longitude', 'destination_latitude', 'destination_longitude'
         ]
+        list_serializer_class = ParticipantCardListSerializer
+
+    def card_user_ids(self, obj):
+        return [obj.user_id, obj.driver_id]
+
+    def _card_value(self, user_id, key):
+        card = self.participant_card(user_id)
+        return card[key] if card else None
+
+    def get_user_name(self, obj):
+        return self._card_value(obj.user_id, 'name')
+
+    def get_driver_name(self, obj):
+        return self._card_value(obj.driver_id, 'name')
+
+    def get_user_email(self, obj):
+        return self._card_value(obj.user_id, 'email')
+
+    def get_driver_email(self, obj):
+        return self._card_value(obj.driver_id, 'email')
+
+    def get_live_eta_min(self, obj):
+        return obj.live_eta_min if obj.status == 'in_progress' else None
+
+    def get_live_eta_updated_at(self, obj):
+        if obj.status != 'in_progress' or obj.live_eta_updated_at is None:
+            return None
+        return serializers.DateTimeField().to_representation(obj.live_eta_updated_at)
 
     def validate(self, data):
         instance = getattr(self, 'instance', None)
@@ -8,6 +8,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from .models import RidingEvent, StripePayment
 from .serializers import CreatePaymentIntentSerializer, StripePaymentSerializer
+from .realtime_utils import notify_ride_status
 from .stripe_utils import create_payment_intent, confirm_payment_intent, construct_webhook_event, confirm_payment_with_test_card
 
 
@@ -122,6 +123,7 @@ class ConfirmPaymentView(APIView):
                 riding_event.payment_completed = True
                 riding_event.status = 'completed'
                 riding_event.save()
+                notify_ride_status(riding_event, payment_status=stripe_payment.status)
                 
                 driver = riding_event.driver
                 if driver:
@@ -176,6 +178,7 @@ class ConfirmPaymentView(APIView):
                 if hasattr(payment_intent, 'last_payment_error') and payment_intent.last_payment_error:
                     stripe_payment.error_message = payment_intent.last_payment_error.message
                 stripe_payment.save()
+                notify_ride_status(stripe_payment.riding_event, payment_status=stripe_payment.status)
 
                 return Response({
                     'message': 'Payment failed',
@@ -251,6 +254,7 @@ class StripeWebhookView(APIView):
             riding_event.payment_completed = True
             riding_event.status = 'completed'
             riding_event.save()
+            notify_ride_status(riding_event, payment_status=stripe_payment.status)
             
             driver = riding_event.driver
             if driver:
@@ -268,6 +272,7 @@ class StripeWebhookView(APIView):
             stripe_payment.status = 'failed'
             stripe_payment.error_message = payment_intent.last_payment_error.message if payment_intent.last_payment_error else 'Payment failed'
             stripe_payment.save()
+            notify_ride_status(stripe_payment.riding_event, payment_status=stripe_payment.status)
 
         except StripePayment.DoesNotExist:
             pass
@@ -284,6 +289,7 @@ class StripeWebhookView(APIView):
             riding_event.payment_completed = False
             riding_event.status = 'cancelled'
             riding_event.save()
+            notify_ride_status(riding_event, payment_status=stripe_payment.status)
 
         except StripePayment.DoesNotExist:
             pass
@@ -332,6 +338,7 @@ class TestPaymentView(APIView):
                 riding_event.payment_completed = True
                 riding_event.status = 'completed'
                 riding_event.save()
+                notify_ride_status(riding_event, payment_status=stripe_payment.status)
                 
                 driver = riding_event.driver
                 if driver:
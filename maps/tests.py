@@ -1 +1,201 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import os
+import tempfile
+from datetime import timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+from RidingApp import json_utils
+from RidingApp.replay_utils import replay_buffer
+from RidingApp.asgi import application
+from users.models import CustomUser
+from users.tests import IN_MEMORY_LAYERS, FAST_HASHERS, create_account, access_token, authenticated_client
+from .models import RidingEvent
+from .realtime_utils import ride_group, driver_group
+
+
+def create_ride(user, driver, **extra_fields):
+    fields = {
+        'from_where': 'Gulshan',
+        'to_where': 'Dhanmondi',
+        'origin_latitude': 23.7925,
+        'origin_longitude': 90.4078,
+        'destination_latitude': 23.7461,
+        'destination_longitude': 90.3742,
+        'distance_km': 8.0,
+        'estimated_time_min': 24.0,
+        'charge_amount': 80.0,
+        'payment_method': 'cash',
+        **extra_fields
+    }
+    return RidingEvent.objects.create(user=user, driver=driver, **fields)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, PASSWORD_HASHERS=FAST_HASHERS)
+class MapsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        replay_buffer.clear()
+        self.rider = create_account('rider@example.com')
+        self.driver = create_account('driver@example.com', 'driver', car_name='Axio')
+        self.ride = create_ride(self.rider, self.driver)
+        self.client = authenticated_client(self.rider)
+        self.tokens = {user.id: access_token(user) for user in (self.rider, self.driver)}
+
+    async def connect(self, path, user=None, subprotocols=None, accepted=True):
+        if user is not None:
+            path = f'{path}{"&" if "?" in path else "?"}token={self.tokens[user.id]}'
+        socket = WebsocketCommunicator(application, path, subprotocols=subprotocols)
+        connected, _ = await socket.connect()
+        self.assertEqual(connected, accepted, f'{path} was {"refused" if accepted else "accepted"}')
+        return socket
+
+    def detail_url(self, ride=None):
+        return f'/api/maps/event/{(ride or self.ride).id}/'
+
+    def listen(self, group):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(group, channel)
+
+        async def receive():
+            return await asyncio.wait_for(layer.receive(channel), timeout=1)
+        return async_to_sync(receive)
+
+
+class RideDetailConditionalGetTests(MapsTestCase):
+    def test_matching_etag_returns_not_modified(self):
+        response = self.client.get(self.detail_url())
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.detail_url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_status_change_changes_etag(self):
+        etag = self.client.get(self.detail_url())['ETag']
+        self.client.patch(self.detail_url(), {'status': 'cancelled'}, format='json')
+        response = self.client.get(self.detail_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'cancelled')
+
+    def test_driver_profile_change_changes_etag(self):
+        etag = self.client.get(self.detail_url())['ETag']
+        self.driver.full_name = 'Renamed Driver'
+        self.driver.save()
+        response = self.client.get(self.detail_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['driver_name'], 'Renamed Driver')
+
+    def test_other_users_ride_is_not_found(self):
+        stranger = create_account('stranger@example.com')
+        response = authenticated_client(stranger).get(self.detail_url())
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(MapsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = CustomUser.objects.create_superuser(email='admin@example.com', password='Riding-pass-123')
+        self.staff_client = authenticated_client(self.staff)
+        self.old_ride = create_ride(self.rider, self.driver, from_where='Old pickup')
+        RidingEvent.objects.filter(id=self.old_ride.id).update(created_at=timezone.now() - timedelta(days=30))
+
+    def read_streaming(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_rides_export_as_ndjson(self):
+        response = self.staff_client.get('/api/maps/export/rides/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json_utils.loads(line) for line in self.read_streaming(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.ride.id, self.old_ride.id])
+
+    def test_date_range_filters_rows(self):
+        start = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.staff_client.get(f'/api/maps/export/rides/?start={start}')
+        rows = [json_utils.loads(line) for line in self.read_streaming(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.ride.id])
+
+    def test_csv_export_is_gzipped(self):
+        response = self.staff_client.get('/api/maps/export/rides/?output=csv')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        reader = csv.DictReader(io.StringIO(gzip.decompress(self.read_streaming(response)).decode()))
+        self.assertEqual({row['from_where'] for row in reader}, {'Gulshan', 'Old pickup'})
+
+    def test_invalid_requests_are_rejected(self):
+        self.assertEqual(self.staff_client.get('/api/maps/export/drivers/').status_code, 404)
+        self.assertEqual(self.staff_client.get('/api/maps/export/rides/?output=xml').status_code, 400)
+        self.assertEqual(self.staff_client.get('/api/maps/export/rides/?start=yesterday').status_code, 400)
+
+    def test_export_is_staff_only(self):
+        self.assertEqual(self.client.get('/api/maps/export/rides/').status_code, 403)
+
+    def test_management_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rides.ndjson')
+            call_command('export_data', 'rides', file=path, stderr=io.StringIO())
+            with open(path, 'rb') as exported:
+                self.assertEqual(len(exported.read().splitlines()), 2)
+
+
+class RideAdminActionTests(MapsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = CustomUser.objects.create_superuser(email='admin@example.com', password='Riding-pass-123')
+        self.admin_client = Client()
+        self.admin_client.force_login(self.staff)
+
+    def test_status_action_on_filtered_changelist_notifies_ride(self):
+        receive = self.listen(ride_group(self.ride.id))
+        self.driver.driver_is_available = False
+        self.driver.save()
+        response = self.admin_client.post('/admin/maps/ridingevent/?status__exact=in_progress', {
+            'action': 'mark_completed',
+            '_selected_action': [self.ride.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        event = receive()
+        self.assertEqual((event['type'], event['riding_event_id'], event['status']), ('ride_status', self.ride.id, 'completed'))
+        self.driver.refresh_from_db()
+        self.assertTrue(self.driver.driver_is_available)
+
+
+class RideStatusEventTests(MapsTestCase):
+    def status_path(self, ride=None):
+        return f'/ws/rides/{(ride or self.ride).id}/'
+
+    async def test_snapshot_then_payment_change(self):
+        socket = await self.connect(self.status_path(), self.rider)
+        snapshot = await socket.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['status'], snapshot['payment_completed']), ('ride_status', 'in_progress', False))
+        await sync_to_async(self.client.post)(f'/api/maps/event/{self.ride.id}/complete-payment/')
+        event = await socket.receive_json_from()
+        self.assertEqual((event['status'], event['payment_completed']), ('completed', True))
+        await socket.disconnect()
+
+    async def test_only_participants_can_follow_a_ride(self):
+        stranger = await sync_to_async(create_account)('stranger@example.com')
+        self.tokens[stranger.id] = await sync_to_async(access_token)(stranger)
+        await self.connect(self.status_path(), stranger, accepted=False)
+
+    def test_driver_profile_change_is_pushed_to_the_driver_group(self):
+        receive = self.listen(driver_group(self.driver.id))
+        self.driver.car_name = 'Premio'
+        self.driver.save()
+        event = receive()
+        self.assertEqual((event['type'], event['card']['car_name']), ('driver_card', 'Premio'))
+
+    async def test_cancelling_is_pushed_to_the_driver(self):
+        socket = await self.connect(self.status_path(), self.driver)
+        await socket.receive_json_from()
+        await sync_to_async(self.client.patch)(self.detail_url(), {'status': 'cancelled'}, format='json')
+        event = await socket.receive_json_from()
+        self.assertEqual((event['riding_event_id'], event['status']), (self.ride.id, 'cancelled'))
+        await socket.disconnect()
@@ -0,0 +1,35 @@
+from django.conf import settings
+from .models import RidingEvent
+
+POSITION_PRECISION = getattr(settings, 'RIDE_TRACKING_POSITION_PRECISION', 5)
+
+TRACKED_RIDE_FIELDS = (
+    'id', 'user_id', 'driver_id',
+    'origin_latitude', 'origin_longitude', 'destination_latitude', 'destination_longitude',
+    'distance_km', 'estimated_time_min', 'live_eta_min', 'live_distance_remaining_km',
+)
+
+
+def active_ride_for_driver(driver_id):
+    return RidingEvent.objects.filter(
+        driver_id=driver_id,
+        status='in_progress'
+    ).order_by('-created_at').values(*TRACKED_RIDE_FIELDS).first()
+
+
+def position_key(latitude, longitude):
+    return round(float(latitude), POSITION_PRECISION), round(float(longitude), POSITION_PRECISION)
+
+
+def ride_tracking_payload(ride, latitude, longitude, eta, heading=None, timestamp=None):
+    return {
+        'type': 'ride_tracking',
+        'riding_event_id': ride['id'],
+        'driver_id': ride['driver_id'],
+        'latitude': latitude,
+        'longitude': longitude,
+        'heading': heading,
+        'timestamp': timestamp,
+        'distance_remaining_km': eta['distance_remaining_km'],
+        'eta_min': eta['eta_min'],
+    }
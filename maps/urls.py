@@ -12,6 +12,7 @@ from .stripe_views import (
     StripeWebhookView,
     TestPaymentView,
 )
+from .export_views import ExportDataView
 
 urlpatterns = [
     path('create-event/', CreateRidingEventView.as_view(), name='create-riding-event'),
@@ -23,4 +24,5 @@ urlpatterns = [
     path('confirm-payment/', ConfirmPaymentView.as_view(), name='confirm-payment'),
     path('test-payment/', TestPaymentView.as_view(), name='test-payment'),
     path('stripe-webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
+    path('export/<str:dataset>/', ExportDataView.as_view(), name='export-data'),
 ]
@@ -1,32 +1,15 @@
-import os
-from django.conf import settings
 from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, RetrieveUpdateAPIView
 from .models import RidingEvent
 from .serializers import RidingEventSerializer, CreateRidingEventSerializer
+from .realtime_utils import notify_ride_status
+from .gmaps_utils import get_gmaps_client
 from users.models import CustomUser
 from users.serializers import DriverSerializer
 from chat.models import ChatRoom
-
-try:
-    import googlemaps
-    gmaps_available = True
-    gmaps_client = None
-except ImportError:
-    gmaps_available = False
-    gmaps_client = None
-
-def get_gmaps_client():
-    global gmaps_client
-    if not gmaps_available:
-        return None
-    if gmaps_client is None:
-        key = getattr(settings, 'GOOGLE_MAPS_API_KEY', os.environ.get('GOOGLE_MAPS_API_KEY'))
-        if key:
-            gmaps_client = googlemaps.Client(key=key)
-    return gmaps_client
+from RidingApp.http_utils import make_etag, timestamp_of, not_modified_response, set_validators
 
 class AvailableDriversView(ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -114,6 +97,10 @@ class CreateRidingEventView(APIView):
                 driver=driver,
                 from_where=from_where,
                 to_where=to_where,
+                origin_latitude=lat_from,
+                origin_longitude=lng_from,
+                destination_latitude=lat_to,
+                destination_longitude=lng_to,
                 distance_km=round(distance_km, 2),
                 estimated_time_min=round(estimated_time_min, 2),
                 charge_amount=round(charge_amount, 2),
@@ -123,6 +110,7 @@ class CreateRidingEventView(APIView):
             ChatRoom.objects.create(riding_event=riding_event)
             driver.driver_is_available = False
             driver.save()
+            notify_ride_status(riding_event)
             event_serializer = RidingEventSerializer(riding_event)
             return Response({
                 'message': 'Riding event created successfully',
@@ -157,6 +145,20 @@ class RidingEventDetailView(RetrieveUpdateAPIView):
         elif user.account_type == 'driver':
             return RidingEvent.objects.filter(driver=user)
         return RidingEvent.objects.none()
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_queryset().filter(pk=kwargs['pk']).values(
+            'updated_at', 'stripe_payment__updated_at', 'user__updated_at', 'driver__updated_at', 'live_eta_updated_at'
+        ).first()
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = make_etag('riding-event', kwargs['pk'], *validators.values())
+        last_modified = timestamp_of(*validators.values())
+        response = not_modified_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+        response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag=etag, last_modified=last_modified)
     
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -175,6 +177,7 @@ class RidingEventDetailView(RetrieveUpdateAPIView):
                 'error': 'You do not have permission to edit this event'
             }, status=status.HTTP_403_FORBIDDEN)
         old_status = instance.status
+        old_state = (instance.status, instance.payment_completed, instance.user_id, instance.driver_id)
         partial = kwargs.pop('partial', False)
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
@@ -184,6 +187,8 @@ class RidingEventDetailView(RetrieveUpdateAPIView):
             driver = instance.driver
             driver.driver_is_available = True
             driver.save()
+        if old_state != (new_status, instance.payment_completed, instance.user_id, instance.driver_id):
+            notify_ride_status(serializer.instance)
         return Response({
             'message': 'Riding event updated successfully',
             'event': serializer.data
@@ -206,6 +211,7 @@ class CompletePaymentView(APIView):
         event.payment_completed = True
         event.status = 'completed'
         event.save()
+        notify_ride_status(event)
         driver = event.driver
         driver.driver_is_available = True
         driver.save()
@@ -2,7 +2,10 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django import forms
+from django.utils import timezone
 from .models import CustomUser
+from .auth_utils import invalidate_auth_cache
+from .card_utils import invalidate_participant_cards
 
 class CustomUserCreationForm(UserCreationForm):
     email_or_phone = forms.CharField(
@@ -108,23 +111,30 @@ class CustomUserAdmin(UserAdmin):
     
     actions = ['verify_users', 'unverify_users', 'make_drivers_available', 'make_drivers_unavailable']
     
+    def update_users(self, queryset, **fields):
+        user_ids = list(queryset.values_list('id', flat=True))
+        updated = CustomUser.objects.filter(id__in=user_ids).update(updated_at=timezone.now(), **fields)
+        invalidate_auth_cache(*user_ids)
+        invalidate_participant_cards(*user_ids)
+        return updated
+
     def verify_users(self, request, queryset):
-        updated = queryset.update(is_verified=True)
+        updated = self.update_users(queryset, is_verified=True)
         self.message_user(request, f'{updated} users have been verified.')
     verify_users.short_description = "Verify selected users"
     
     def unverify_users(self, request, queryset):
-        updated = queryset.update(is_verified=False)
+        updated = self.update_users(queryset, is_verified=False)
         self.message_user(request, f'{updated} users have been unverified.')
     unverify_users.short_description = "Unverify selected users"
     
     def make_drivers_available(self, request, queryset):
-        updated = queryset.filter(account_type='driver').update(driver_is_available=True)
+        updated = self.update_users(queryset.filter(account_type='driver'), driver_is_available=True)
         self.message_user(request, f'{updated} drivers have been marked as available.')
     make_drivers_available.short_description = "Mark selected drivers as available"
     
     def make_drivers_unavailable(self, request, queryset):
-        updated = queryset.filter(account_type='driver').update(driver_is_available=False)
+        updated = self.update_users(queryset.filter(account_type='driver'), driver_is_available=False)
         self.message_user(request, f'{updated} drivers have been marked as unavailable.')
     make_drivers_unavailable.short_description = "Mark selected drivers as unavailable"
     
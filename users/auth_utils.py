@@ -0,0 +1,81 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from RidingApp.cache_utils import cache_is_shared
+from .tokens import principal_claims
+
+PRINCIPAL_CACHE_TIMEOUT = getattr(settings, 'AUTH_PRINCIPAL_CACHE_TIMEOUT', 60)
+USER_CACHE_TIMEOUT = getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 5 * 60)
+
+
+def principal_cache_key(user_id):
+    return f'auth_principal_{user_id}'
+
+
+def user_cache_key(user_id):
+    return f'auth_user_{user_id}'
+
+
+def get_cached_user(user_id):
+    if not cache_is_shared():
+        return get_user_model().objects.filter(id=user_id).first()
+    user = cache.get(user_cache_key(user_id))
+    if user is None:
+        user = get_user_model().objects.filter(id=user_id).first()
+        if user is not None:
+            cache.set(user_cache_key(user_id), user, timeout=USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_auth_cache(*user_ids):
+    keys = []
+    for user_id in user_ids:
+        keys += [user_cache_key(user_id), principal_cache_key(user_id)]
+    cache.delete_many(keys)
+
+
+def build_principal_data(user):
+    return {'user_id': user.id, 'is_active': user.is_active, **principal_claims(user)}
+
+
+def load_principal_data(user_id):
+    user = get_user_model().objects.filter(id=user_id).first()
+    if user is None:
+        return None
+    data = build_principal_data(user)
+    if cache_is_shared():
+        cache.set(principal_cache_key(user_id), data, timeout=PRINCIPAL_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_principal_data(user_id):
+    data = await cache.aget(principal_cache_key(user_id)) if cache_is_shared() else None
+    if data is None:
+        data = await database_sync_to_async(load_principal_data)(user_id)
+    return data
+
+
+class UserPrincipal:
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, account_type, name, password_epoch):
+        self.id = self.pk = int(user_id)
+        self.account_type = account_type
+        self.full_name = name
+        self.password_epoch = password_epoch
+        self._user = None
+
+    def get_user(self):
+        if self._user is None:
+            self._user = get_user_model().objects.get(id=self.id)
+        return self._user
+
+    async def aget_user(self):
+        if self._user is None:
+            await database_sync_to_async(self.get_user)()
+        return self._user
+
+    def __str__(self):
+        return f'UserPrincipal {self.id}'
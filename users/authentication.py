@@ -1,14 +1,27 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
 from django.utils import timezone
-from django.contrib.auth import get_user_model
-
-User = get_user_model()
+from .auth_utils import get_cached_user
+from .tokens import PASSWORD_EPOCH_CLAIM, password_epoch
 
 class CustomJWTAuthentication(JWTAuthentication):
     def get_user(self, validated_token):
-        user = super().get_user(validated_token)
-        orig_iat = validated_token.get('orig_iat')
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        token_epoch = validated_token.get(PASSWORD_EPOCH_CLAIM)
+        if token_epoch is not None:
+            if token_epoch < password_epoch(user):
+                raise AuthenticationFailed('Access token is invalid due to password change.')
+            return user
+        orig_iat = validated_token.get('orig_iat', validated_token.get('iat'))
         if hasattr(user, 'last_password_change') and user.last_password_change:
             if orig_iat and timezone.make_aware(timezone.datetime.fromtimestamp(orig_iat)) < user.last_password_change:
                 raise AuthenticationFailed('Access token is invalid due to password change.')
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from RidingApp.cache_utils import cache_is_shared
+
+CARD_CACHE_TIMEOUT = getattr(settings, 'PARTICIPANT_CARD_CACHE_TIMEOUT', 60 * 60)
+
+
+def card_cache_key(user_id):
+    return f'participant_card_{user_id}'
+
+
+def build_participant_card(user):
+    return {
+        'id': user.id,
+        'name': user.full_name or user.phone_number or user.username,
+        'account_type': user.account_type,
+        'email': user.email,
+        'phone_number': user.phone_number,
+        'profile_picture': user.profile_picture.url if user.profile_picture else None,
+        'car_name': user.car_name,
+        'plate_number': user.plate_number,
+    }
+
+
+def cache_participant_card(user):
+    card = build_participant_card(user)
+    if cache_is_shared():
+        cache.set(card_cache_key(user.id), card, timeout=CARD_CACHE_TIMEOUT)
+    return card
+
+
+def invalidate_participant_cards(*user_ids):
+    cache.delete_many([card_cache_key(user_id) for user_id in user_ids])
+
+
+def get_cached_participant_card(user_id):
+    if not cache_is_shared():
+        return None
+    return cache.get(card_cache_key(user_id))
+
+
+def get_participant_card(user_id):
+    if user_id is None:
+        return None
+    card = get_cached_participant_card(user_id)
+    if card is None:
+        user = get_user_model().objects.filter(id=user_id).first()
+        if user is None:
+            return None
+        card = cache_participant_card(user)
+    return card
+
+
+def get_participant_cards(user_ids):
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return {}
+    shared = cache_is_shared()
+    cached = cache.get_many([card_cache_key(user_id) for user_id in user_ids]) if shared else {}
+    cards = {card['id']: card for card in cached.values()}
+    missing = user_ids - cards.keys()
+    if missing:
+        loaded = {}
+        for user in get_user_model().objects.filter(id__in=missing):
+            cards[user.id] = loaded[card_cache_key(user.id)] = build_participant_card(user)
+        if shared:
+            cache.set_many(loaded, timeout=CARD_CACHE_TIMEOUT)
+    return cards
+
+
+def context_participant_cards(context, user_ids):
+    cards = context.setdefault('participant_cards', {})
+    missing = {user_id for user_id in user_ids if user_id is not None} - cards.keys()
+    if missing:
+        loaded = get_participant_cards(missing)
+        cards.update({user_id: loaded.get(user_id) for user_id in missing})
+    return cards
@@ -0,0 +1,14 @@
+from django.core.checks import Tags, Warning, register
+from RidingApp.cache_utils import cache_is_shared
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if cache_is_shared():
+        return []
+    return [Warning(
+        'The default cache is local to each process.',
+        hint='Set CACHE_REDIS_URL so participant cards, auth lookups and token revocation are cached '
+             'for every worker. Until then those paths read the database on each use.',
+        id='users.W001',
+    )]
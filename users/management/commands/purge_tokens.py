@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from users.otp_utils import purge_expired_otps
+from users.revocation_utils import invalidate_revocation_filters
+
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens and one-time passwords and rebuild the revocation filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = OutstandingToken.objects.filter(expires_at__lte=now)
+        if options['dry_run']:
+            self.stdout.write(
+                f'{expired.count()} outstanding tokens and '
+                f'{BlacklistedToken.objects.filter(token__expires_at__lte=now).count()} blacklisted tokens would be deleted'
+            )
+            return
+        deleted = 0
+        while True:
+            token_ids = list(expired.values_list('id', flat=True)[:options['batch_size']])
+            if not token_ids:
+                break
+            deleted += OutstandingToken.objects.filter(id__in=token_ids).delete()[0]
+        invalidate_revocation_filters()
+        otps = purge_expired_otps()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired token rows and {otps} expired one-time passwords'))
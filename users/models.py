@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.exceptions import ValidationError
+from .card_utils import cache_participant_card, get_cached_participant_card, invalidate_participant_cards
+from .auth_utils import invalidate_auth_cache
+from .otp_utils import issue_otp, check_otp, discard_otp
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, username=None, email=None, phone_number=None, password=None, **extra_fields):
@@ -64,8 +67,6 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     last_password_change = models.DateTimeField(blank=True, null=True)
 
     is_verified = models.BooleanField(default=False)
-    otp_code = models.CharField(max_length=6, blank=True, null=True)
-    otp_created_at = models.DateTimeField(blank=True, null=True)
 
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
     id_number = models.CharField(max_length=50, unique=True, blank=True, null=True)
@@ -77,6 +78,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     car_name = models.CharField(max_length=100, blank=True, null=True)
     plate_number = models.CharField(max_length=20, blank=True, null=True)
 
+    otp_code = None
+
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'username'
@@ -105,7 +108,20 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
         if not hasattr(self, '_skip_validation'):
             self.full_clean()
+        previous_card = get_cached_participant_card(self.id) if self.id else None
         super().save(*args, **kwargs)
+        invalidate_auth_cache(self.id)
+        card = cache_participant_card(self)
+        if self.account_type == 'driver' and card != previous_card:
+            from maps.realtime_utils import notify_driver_card
+            notify_driver_card(card)
+
+    def delete(self, *args, **kwargs):
+        user_id = self.id
+        result = super().delete(*args, **kwargs)
+        invalidate_participant_cards(user_id)
+        invalidate_auth_cache(user_id)
+        return result
 
     def __str__(self):
         return self.username
@@ -117,31 +133,35 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         return self.full_name.split()[0] if self.full_name else self.username
 
     def generate_otp(self):
-        import random
-        from django.utils import timezone
-        
-        self.otp_code = str(random.randint(100000, 999999))
-        self.otp_created_at = timezone.now()
-        self.save()
+        self.otp_code = issue_otp(self.id)
         return self.otp_code
 
     def verify_otp(self, otp_code):
-        from django.utils import timezone
-        from datetime import timedelta
-        
-        if not self.otp_code or not self.otp_created_at:
-            return False
-            
-        if self.otp_code != otp_code:
-            return False
-            
-        if timezone.now() > self.otp_created_at + timedelta(minutes=10):
-            return False
-            
-        return True
+        return check_otp(self.id, otp_code)
 
-    def clear_otp(self):
+    def clear_otp(self, commit=True):
+        discard_otp(self.id)
         self.otp_code = None
-        self.otp_created_at = None
+        if self.is_verified:
+            return
         self.is_verified = True
-        self.save()
\ No newline at end of file
+        if commit:
+            self._skip_validation = True
+            try:
+                self.save(update_fields=['is_verified', 'updated_at'])
+            finally:
+                del self._skip_validation
+
+
+class OneTimePassword(models.Model):
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='one_time_password')
+    code_hash = models.CharField(max_length=64, blank=True, default='')
+    expires_at = models.DateTimeField(db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_until = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'user_one_time_password'
+
+    def __str__(self):
+        return f'OTP for user {self.user_id}'
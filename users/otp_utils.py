@@ -0,0 +1,70 @@
+import secrets
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+OTP_TTL = getattr(settings, 'OTP_TTL_SECONDS', 10 * 60)
+OTP_MAX_ATTEMPTS = getattr(settings, 'OTP_MAX_ATTEMPTS', 5)
+OTP_LOCKOUT_SECONDS = getattr(settings, 'OTP_LOCKOUT_SECONDS', 15 * 60)
+
+
+def one_time_passwords():
+    return apps.get_model('users', 'OneTimePassword').objects
+
+
+def hash_otp(user_id, code):
+    return salted_hmac('users.otp', f'{user_id}:{code}').hexdigest()
+
+
+def issue_otp(user_id):
+    code = str(secrets.randbelow(900000) + 100000)
+    fields = {
+        'code_hash': hash_otp(user_id, code),
+        'expires_at': timezone.now() + timedelta(seconds=OTP_TTL),
+        'attempts': 0,
+    }
+    if not one_time_passwords().filter(user_id=user_id).update(**fields):
+        try:
+            with transaction.atomic():
+                one_time_passwords().create(user_id=user_id, **fields)
+        except IntegrityError:
+            one_time_passwords().filter(user_id=user_id).update(**fields)
+    return code
+
+
+def is_locked(user_id):
+    return one_time_passwords().filter(user_id=user_id, locked_until__gt=timezone.now()).exists()
+
+
+def check_otp(user_id, code):
+    if not code:
+        return False
+    now = timezone.now()
+    otp = one_time_passwords().filter(user_id=user_id).first()
+    if otp is None or not otp.code_hash or otp.expires_at <= now:
+        return False
+    if otp.locked_until and otp.locked_until > now:
+        return False
+    if constant_time_compare(otp.code_hash, hash_otp(user_id, code)):
+        return True
+    one_time_passwords().filter(user_id=user_id).update(attempts=F('attempts') + 1)
+    one_time_passwords().filter(user_id=user_id, attempts__gte=OTP_MAX_ATTEMPTS).update(
+        code_hash='',
+        locked_until=now + timedelta(seconds=OTP_LOCKOUT_SECONDS),
+    )
+    return False
+
+
+def discard_otp(user_id):
+    one_time_passwords().filter(user_id=user_id).exclude(locked_until__gt=timezone.now()).delete()
+
+
+def purge_expired_otps():
+    now = timezone.now()
+    return one_time_passwords().filter(expires_at__lte=now).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+    ).delete()[0]
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from RidingApp.cache_utils import cache_is_shared
+
+REVOCATION_FILTER_BITS = getattr(settings, 'TOKEN_REVOCATION_FILTER_BITS', 1 << 20)
+REVOCATION_FILTER_HASHES = getattr(settings, 'TOKEN_REVOCATION_FILTER_HASHES', 7)
+REVOCATION_LOG_TIMEOUT = getattr(settings, 'TOKEN_REVOCATION_LOG_TIMEOUT', 24 * 60 * 60)
+REVOCATION_CATCH_UP_LIMIT = getattr(settings, 'TOKEN_REVOCATION_CATCH_UP_LIMIT', 500)
+REVOCATION_VERSION_KEY = 'token_revocation_version'
+
+
+def revocation_log_key(version):
+    return f'token_revocation_{version}'
+
+
+class BloomFilter:
+    def __init__(self, bits=REVOCATION_FILTER_BITS, hashes=REVOCATION_FILTER_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * step) % self.bits for index in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+def current_version():
+    return cache.get(REVOCATION_VERSION_KEY, 0)
+
+
+def bump_version():
+    cache.add(REVOCATION_VERSION_KEY, 0, timeout=None)
+    try:
+        return cache.incr(REVOCATION_VERSION_KEY)
+    except ValueError:
+        cache.add(REVOCATION_VERSION_KEY, 0, timeout=None)
+        return cache.incr(REVOCATION_VERSION_KEY)
+
+
+class RevocationFilter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.version = None
+
+    def rebuild(self, version):
+        bloom = BloomFilter()
+        revoked = BlacklistedToken.objects.filter(
+            token__expires_at__gt=timezone.now()
+        ).values_list('token__jti', flat=True)
+        for jti in revoked.iterator():
+            bloom.add(jti)
+        self.filter = bloom
+        self.version = version
+
+    def sync(self):
+        version = current_version()
+        with self.lock:
+            if self.filter is not None and version == self.version:
+                return
+            if self.filter is None or version < self.version or version - self.version > REVOCATION_CATCH_UP_LIMIT:
+                self.rebuild(version)
+                return
+            keys = [revocation_log_key(missed) for missed in range(self.version + 1, version + 1)]
+            found = cache.get_many(keys)
+            if len(found) != len(keys):
+                self.rebuild(version)
+                return
+            for jti in found.values():
+                self.filter.add(jti)
+            self.version = version
+
+    def might_contain(self, jti):
+        self.sync()
+        return jti in self.filter
+
+    def add(self, jti):
+        version = bump_version()
+        cache.set(revocation_log_key(version), jti, timeout=REVOCATION_LOG_TIMEOUT)
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+
+revocation_filter = RevocationFilter()
+
+
+def is_revoked(jti):
+    if cache_is_shared() and not revocation_filter.might_contain(jti):
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def record_revocation(jti):
+    if cache_is_shared():
+        revocation_filter.add(jti)
+
+
+def invalidate_revocation_filters():
+    bump_version()
@@ -3,6 +3,10 @@ from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.cache import cache
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from .tokens import RidingRefreshToken
+from .card_utils import context_participant_cards
 import re
 
 User = get_user_model()
@@ -111,6 +115,7 @@ class ChangePasswordSerializer(serializers.Serializer):
     def save(self, **kwargs):
         user = self.context['request'].user
         user.set_password(self.validated_data['new_password'])
+        user.last_password_change = timezone.now()
         user.save()
         return user
     
@@ -151,6 +156,21 @@ class ResetPasswordSerializer(serializers.Serializer):
             raise serializers.ValidationError("New passwords don't match.")
         return data
 
+class ParticipantCardListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        context_participant_cards(
+            self.context, [user_id for item in items for user_id in self.child.card_user_ids(item)]
+        )
+        return super().to_representation(items)
+
+class ParticipantCardsMixin:
+    def card_user_ids(self, obj):
+        return []
+
+    def participant_card(self, user_id):
+        return context_participant_cards(self.context, [user_id]).get(user_id)
+
 class BasicUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -329,4 +349,7 @@ class FacebookLoginSerializer(serializers.Serializer):
             return access_token
             
         except requests.RequestException:
-            raise serializers.ValidationError("Failed to validate Facebook access token")
\ No newline at end of file
+            raise serializers.ValidationError("Failed to validate Facebook access token")
+
+class RidingTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RidingRefreshToken
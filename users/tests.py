@@ -1 +1,284 @@
-from django.test import TestCase
\ No newline at end of file
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .card_utils import card_cache_key, get_participant_card, get_participant_cards
+from .checks import check_shared_cache
+from .models import OneTimePassword
+from .otp_utils import OTP_MAX_ATTEMPTS, check_otp, hash_otp, is_locked, issue_otp, purge_expired_otps
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from .revocation_utils import is_revoked, revocation_filter
+from .tokens import RidingRefreshToken
+
+User = get_user_model()
+
+PASSWORD = 'Riding-pass-123'
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def create_account(email, account_type='user', **extra_fields):
+    extra_fields.setdefault('full_name', email.split('@')[0].title())
+    return User.objects.create_user(email=email, password=PASSWORD, account_type=account_type, **extra_fields)
+
+
+def access_token(user):
+    return str(RidingRefreshToken.for_user(user).access_token)
+
+
+def authenticated_client(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token(user)}')
+    return client
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, PASSWORD_HASHERS=FAST_HASHERS)
+class UsersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+
+class ProfileConditionalGetTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_account('rider@example.com')
+        self.client = authenticated_client(self.user)
+
+    def test_profile_carries_validators(self):
+        response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+        self.assertIn('Authorization', response['Vary'])
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get('/api/users/profile/')['ETag']
+        response = self.client.get('/api/users/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_profile_update_changes_etag(self):
+        etag = self.client.get('/api/users/profile/')['ETag']
+        self.client.put('/api/users/profile/', {'full_name': 'Renamed Rider'}, format='json')
+        response = self.client.get('/api/users/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['full_name'], 'Renamed Rider')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ParticipantCardTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.driver = create_account('driver@example.com', 'driver', car_name='Axio', plate_number='DHK-1')
+
+    def test_card_reflects_profile_without_shared_cache(self):
+        self.assertEqual(get_participant_card(self.driver.id)['car_name'], 'Axio')
+        User.objects.filter(id=self.driver.id).update(car_name='Premio')
+        self.assertEqual(get_participant_card(self.driver.id)['car_name'], 'Premio')
+        self.assertIsNone(cache.get(card_cache_key(self.driver.id)))
+
+    @override_settings(SHARED_CACHE=True)
+    def test_shared_cache_is_written_through_on_save(self):
+        get_participant_card(self.driver.id)
+        self.driver.car_name = 'Premio'
+        self.driver.save()
+        self.assertEqual(cache.get(card_cache_key(self.driver.id))['car_name'], 'Premio')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_participant_cards([self.driver.id])[self.driver.id]['car_name'], 'Premio')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_delete_invalidates_card(self):
+        get_participant_card(self.driver.id)
+        driver_id = self.driver.id
+        self.driver.delete()
+        self.assertIsNone(get_participant_card(driver_id))
+
+    @override_settings(SHARED_CACHE=True)
+    def test_admin_bulk_action_invalidates_filtered_selection(self):
+        staff = User.objects.create_superuser(email='admin@example.com', password=PASSWORD)
+        get_participant_card(self.driver.id)
+        client = Client()
+        client.force_login(staff)
+        response = client.post('/admin/users/customuser/?is_verified__exact=0', {
+            'action': 'verify_users',
+            '_selected_action': [self.driver.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.driver.refresh_from_db()
+        self.assertTrue(self.driver.is_verified)
+        self.assertIsNone(cache.get(card_cache_key(self.driver.id)))
+
+    def test_deploy_check_warns_about_process_local_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['users.W001'])
+        with override_settings(SHARED_CACHE=True):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class SocketAuthTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_account('rider@example.com')
+        self.token = access_token(self.user)
+
+    async def connects(self):
+        from RidingApp.asgi import application
+        socket = WebsocketCommunicator(application, f'/ws/stream/?token={self.token}')
+        connected, _ = await socket.connect()
+        if connected:
+            await socket.disconnect()
+        return connected
+
+    async def test_valid_token_connects(self):
+        self.assertTrue(await self.connects())
+
+    async def test_deleted_account_is_refused(self):
+        self.assertTrue(await self.connects())
+        await User.objects.filter(id=self.user.id).adelete()
+        self.assertFalse(await self.connects())
+
+    async def test_password_change_revokes_socket_access(self):
+        self.user.last_password_change = timezone.now()
+        await sync_to_async(self.user.save)()
+        self.assertFalse(await self.connects())
+
+    @override_settings(SHARED_CACHE=True)
+    async def test_shared_cache_is_invalidated_on_delete(self):
+        self.assertTrue(await self.connects())
+        await sync_to_async(self.user.delete)()
+        self.assertFalse(await self.connects())
+
+
+class RestAuthTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_account('rider@example.com')
+        self.client = authenticated_client(self.user)
+
+    def change_password(self):
+        response = self.client.post('/api/users/change-password/', {
+            'old_password': PASSWORD,
+            'new_password': 'Another-pass-456',
+            'new_password_confirm': 'Another-pass-456',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_password_change_revokes_old_tokens(self):
+        self.change_password()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, 401)
+
+    def test_deleted_account_is_rejected(self):
+        User.objects.filter(id=self.user.id).delete()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, 401)
+
+    def test_profile_changes_made_elsewhere_are_seen(self):
+        self.client.get('/api/users/profile/')
+        User.objects.filter(id=self.user.id).update(full_name='Renamed Rider')
+        self.assertEqual(self.client.get('/api/users/profile/').data['full_name'], 'Renamed Rider')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_shared_cache_is_invalidated_on_save(self):
+        self.client.get('/api/users/profile/')
+        self.client.put('/api/users/profile/', {'full_name': 'Renamed Rider'}, format='json')
+        self.assertEqual(self.client.get('/api/users/profile/').data['full_name'], 'Renamed Rider')
+        self.change_password()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, 401)
+
+
+class TokenRevocationTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        revocation_filter.filter = revocation_filter.version = None
+        self.user = create_account('rider@example.com')
+        self.refresh = RidingRefreshToken.for_user(self.user)
+        self.client = APIClient()
+
+    def refresh_status(self):
+        return self.client.post('/api/users/token/refresh/', {'refresh': str(self.refresh)}, format='json').status_code
+
+    def revoke_elsewhere(self):
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=self.refresh['jti']))
+
+    def test_logout_revokes_the_refresh_token(self):
+        self.assertEqual(self.refresh_status(), 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        self.client.post('/api/users/logout/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(self.refresh_status(), 401)
+
+    def test_revocation_by_another_worker_is_seen_without_shared_cache(self):
+        self.assertFalse(is_revoked(self.refresh['jti']))
+        self.revoke_elsewhere()
+        self.assertTrue(is_revoked(self.refresh['jti']))
+
+    @override_settings(SHARED_CACHE=True)
+    def test_shared_filter_skips_the_database_for_live_tokens(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(is_revoked(self.refresh['jti']))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_revoked(self.refresh['jti']))
+        self.refresh.blacklist()
+        self.assertTrue(is_revoked(self.refresh['jti']))
+
+
+class OneTimePasswordTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_account('rider@example.com')
+
+    def wrong_code(self, code):
+        return str(100000 + (int(code) - 100000 + 1) % 900000)
+
+    def test_issued_code_is_stored_hashed_in_the_database(self):
+        code = issue_otp(self.user.id)
+        otp = OneTimePassword.objects.get(user=self.user)
+        self.assertNotIn(code, otp.code_hash)
+        self.assertTrue(check_otp(self.user.id, code))
+        cache.clear()
+        self.assertTrue(check_otp(self.user.id, code))
+
+    def test_reissuing_replaces_the_previous_code(self):
+        first = issue_otp(self.user.id)
+        OneTimePassword.objects.filter(user=self.user).update(attempts=2)
+        second = issue_otp(self.user.id)
+        otp = OneTimePassword.objects.get(user=self.user)
+        self.assertEqual(otp.attempts, 0)
+        self.assertEqual(otp.code_hash == hash_otp(self.user.id, first), first == second)
+        self.assertTrue(check_otp(self.user.id, second))
+
+    def test_expired_code_is_rejected_and_purged(self):
+        code = issue_otp(self.user.id)
+        OneTimePassword.objects.filter(user=self.user).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(check_otp(self.user.id, code))
+        self.assertEqual(purge_expired_otps(), 1)
+
+    def test_repeated_failures_lock_out_even_the_right_code(self):
+        code = issue_otp(self.user.id)
+        for _ in range(OTP_MAX_ATTEMPTS):
+            self.assertFalse(check_otp(self.user.id, self.wrong_code(code)))
+        self.assertTrue(is_locked(self.user.id))
+        self.assertFalse(check_otp(self.user.id, code))
+        self.assertFalse(check_otp(self.user.id, issue_otp(self.user.id)))
+
+    def test_verify_reads_once_and_clearing_writes_once(self):
+        code = self.user.generate_otp()
+        User.objects.filter(id=self.user.id).update(is_verified=True)
+        self.user.refresh_from_db()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.user.verify_otp(code))
+        with self.assertNumQueries(1):
+            self.user.clear_otp()
+        self.assertFalse(OneTimePassword.objects.filter(user=self.user).exists())
+
+    def test_verify_endpoint_consumes_the_code(self):
+        code = self.user.generate_otp()
+        payload = {'email_or_phone': self.user.email, 'otp_code': code}
+        response = APIClient().post('/api/users/verify-otp/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_verified)
+        self.assertEqual(APIClient().post('/api/users/verify-otp/', payload, format='json').status_code, 400)
@@ -0,0 +1,39 @@
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+ACCOUNT_TYPE_CLAIM = 'account_type'
+NAME_CLAIM = 'name'
+PASSWORD_EPOCH_CLAIM = 'pwd'
+
+
+def password_epoch(user):
+    return int(user.last_password_change.timestamp()) if user.last_password_change else 0
+
+
+def principal_claims(user):
+    return {
+        ACCOUNT_TYPE_CLAIM: user.account_type,
+        NAME_CLAIM: user.full_name or user.phone_number or user.username,
+        PASSWORD_EPOCH_CLAIM: password_epoch(user),
+    }
+
+
+class RidingRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim, value in principal_claims(user).items():
+            token[claim] = value
+        return token
+
+    def check_blacklist(self):
+        from .revocation_utils import is_revoked
+        if is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError('Token is blacklisted')
+
+    def blacklist(self):
+        from .revocation_utils import record_revocation
+        result = super().blacklist()
+        record_revocation(self.payload[api_settings.JTI_CLAIM])
+        return result
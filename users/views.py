@@ -1,11 +1,12 @@
 from rest_framework import status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from .tokens import RidingRefreshToken
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
 from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
 from django.contrib import messages
 from twilio.rest import Client
 import os
@@ -17,6 +18,7 @@ from .serializers import (
     GoogleLoginSerializer, FacebookLoginSerializer
 )
 
+from RidingApp.http_utils import make_etag, timestamp_of, not_modified_response, set_validators
 from .email_utils import send_welcome_email, send_deletion_confirmation_email, send_deletion_otp_email, send_password_reset_otp_email
 
 User = get_user_model()
@@ -133,7 +135,7 @@ class UserLoginView(APIView):
         serializer = UserLoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data['user']
-            refresh = RefreshToken.for_user(user)
+            refresh = RidingRefreshToken.for_user(user)
             
             return Response({
                 'message': 'Login successful',
@@ -157,7 +159,7 @@ class UserLogoutView(APIView):
                     'note': 'Please remove tokens from client storage'
                 }, status=status.HTTP_200_OK)
             
-            token = RefreshToken(refresh_token)
+            token = RidingRefreshToken(refresh_token)
             token.blacklist()
             
             return Response({
@@ -190,9 +192,6 @@ class ChangePasswordView(APIView):
         serializer = ChangePasswordSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             user = serializer.save()
-            from django.utils import timezone
-            user.last_password_change = timezone.now()
-            user.save()
             
             if user.email:
                 try:
@@ -220,7 +219,7 @@ class ChangePasswordView(APIView):
             refresh_token = request.data.get("refresh")
             if refresh_token:
                 try:
-                    token = RefreshToken(refresh_token)
+                    token = RidingRefreshToken(refresh_token)
                     token.blacklist()
                 except Exception as e:
                     print(f"Failed to blacklist token after password change: {str(e)}")
@@ -287,10 +286,10 @@ class ResetPasswordView(APIView):
             
             if user.verify_otp(otp_code):
                 user.set_password(new_password)
+                user.last_password_change = timezone.now()
+                user.clear_otp(commit=False)
                 user.save()
                 
-                user.clear_otp()
-                
                 return Response({
                     'message': 'Password reset successfully'
                 }, status=status.HTTP_200_OK)
@@ -313,8 +312,14 @@ class UserProfileView(APIView):
     def get(self, request):
         user = self.request.user
         serializer_class = self.get_serializer_class()
+        etag = make_etag('profile', user.id, user.account_type, user.updated_at)
+        last_modified = timestamp_of(user.updated_at)
+        response = not_modified_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
         serializer = serializer_class(user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+        return set_validators(response, etag=etag, last_modified=last_modified)
     
     def put(self, request):
         user = self.request.user
@@ -404,12 +409,9 @@ class VerifyOTPView(APIView):
                 }, status=status.HTTP_404_NOT_FOUND)
             
             if user.verify_otp(otp_code):
-                user.is_verified = True
-                user.save()
-                
                 user.clear_otp()
                 
-                refresh = RefreshToken.for_user(user)
+                refresh = RidingRefreshToken.for_user(user)
                 
                 return Response({
                     'message': 'OTP verified successfully',
@@ -432,7 +434,6 @@ class DeleteAccountView(APIView):
         user = self.request.user
         
         user.generate_otp()
-        user.save()
         
         cache.set(f'delete_user_{user.id}', True, timeout=600)
         
@@ -474,7 +475,7 @@ class ConfirmDeleteAccountView(APIView):
                     except Exception as e:
                         print(f"Exception sending deletion confirmation email: {str(e)}")
                 
-                user.clear_otp()
+                user.clear_otp(commit=False)
                 
                 cache.delete(f'delete_user_{user.id}')
                 
@@ -532,7 +533,7 @@ class GoogleLoginView(APIView):
                     )
                     created = True
                 
-                refresh = RefreshToken.for_user(user)
+                refresh = RidingRefreshToken.for_user(user)
                 
                 if created and user.email:
                     try:
@@ -621,7 +622,7 @@ class FacebookLoginView(APIView):
                     )
                     created = True
                 
-                refresh = RefreshToken.for_user(user)
+                refresh = RidingRefreshToken.for_user(user)
                 
                 if created and user.email:
                     try: